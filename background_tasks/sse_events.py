@@ -4,6 +4,7 @@ from queue import LifoQueue
 from datetime import datetime, timedelta
 
 from utils.logData import LogDataClass
+from utils.timer_wheel import timer_wheel
 # Dictionary to hold queues for each client
 queues = {}
 
@@ -22,15 +23,22 @@ def calculate_expiry(event_type: str) -> datetime:
 
 # Function to add current time, expiry, and manage queue
 async def add_event(client_id: str, event: dict):
-    event["created"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    event["expires"] = calculate_expiry(event["type"]).strftime("%Y-%m-%d %H:%M:%S") if calculate_expiry(event["type"]) else None
-    
+    created = datetime.now()
+    expiry = calculate_expiry(event["type"])
+    event["created"] = created.strftime("%Y-%m-%d %H:%M:%S")
+    event["expires"] = expiry.strftime("%Y-%m-%d %H:%M:%S") if expiry else None
+
     if client_id not in queues:
         queues[client_id] = LifoQueue()
 
     if event["type"] in ["global", "explicit"]:
         await delete_specific_events(client_id, ["global", "explicit"])
     queues[client_id].put(event)
+    if expiry:
+        # one shared ticker drops undelivered events once they expire
+        timer_wheel.schedule(
+            (expiry - created).total_seconds(), delete_expired_events, client_id
+        )
     # print(f"final state of queue for client {client_id}: {list(queues[client_id].queue)}") to checkout queue
     # print(f"Current queue size: {queues[client_id].qsize()}") to checkout queue size
 
@@ -45,6 +53,25 @@ async def delete_specific_events(client_id: str, event_types: list):
                 new_queue.put(event)
         queues[client_id] = new_queue  # Replace with filtered queue
 
+
+# Function to drop expired events, and the queue itself once it is empty
+def delete_expired_events(client_id: str):
+    if client_id not in queues:
+        return
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    new_queue = LifoQueue()
+    events = []
+    while not queues[client_id].empty():
+        events.append(queues[client_id].get())
+    for event in reversed(events):  # keep the LIFO order
+        if event["expires"] is None or event["expires"] > now:
+            new_queue.put(event)
+    if new_queue.empty():
+        del queues[client_id]
+    else:
+        queues[client_id] = new_queue
+
+
 # Event generator to continuously check the queue
 async def event_generator(client_id: str):
     while True:
@@ -0,0 +1,82 @@
+"""
+Event loop latency while SQL queries run, DbExecute (blocking) versus AsyncDbExecute.
+
+A probe coroutine wakes up every millisecond and records how late it was while
+CONCURRENCY queries run on a SQLite file (aiosqlite for the async engine), the way other
+requests would be delayed by a route running those queries.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.async_db_bench
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+
+DATABASE = os.path.join(tempfile.mkdtemp(), "async_db_bench.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ["SQLALCHEMY_ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATABASE}"
+os.environ.setdefault("ENVIRONMENT_PATH", ".env.staging")
+
+from db import sqlEngine  # noqa: E402
+from db.sqlEngine import DbExecute  # noqa: E402
+from db.asyncSqlEngine import AsyncDbExecute, async_db  # noqa: E402
+
+sqlEngine.db.echo = False
+async_db.echo = False
+
+CONCURRENCY = 20
+# a CPU bound query taking a few milliseconds on SQLite
+QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :limit) "
+    "SELECT count(*) AS total FROM n"
+)
+PARAMS = {"limit": 50_000}
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def sync_query():
+    return DbExecute().fetchone(QUERY, PARAMS)  # blocks the loop, as in an async route
+
+
+async def async_query():
+    return await AsyncDbExecute().fetchone(QUERY, PARAMS)
+
+
+async def run(query) -> tuple:
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.ensure_future(probe(lags, stop))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(query() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    assert all(result.data["total"] == PARAMS["limit"] for result in results)
+    lags.sort()
+    return elapsed, lags[len(lags) // 2], lags[-1], len(lags)
+
+
+async def main():
+    for name, query in (
+        ("DbExecute (sync)", sync_query),
+        ("AsyncDbExecute", async_query),
+    ):
+        elapsed, median, worst, wakeups = await run(query)
+        print(
+            f"{name:<18} {CONCURRENCY} queries in {elapsed * 1000:7.1f} ms | "
+            f"loop lag median {median * 1000:6.2f} ms, max {worst * 1000:7.2f} ms, "
+            f"{wakeups} probe wakeups"
+        )
+    await async_db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Throughput of DbExecute.bulk_insert for 100k rows on SQLite.
+
+Compares one insert() call per row and one insert() call with the whole list (the
+previous options) with bulk_insert batching through executemany or multi-row VALUES,
+committing per batch or once, and upserting over existing rows.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.bulk_insert_bench
+"""
+
+import os
+import time
+import tempfile
+
+DATABASE = os.path.join(tempfile.mkdtemp(), "bulk_insert_bench.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ.setdefault("ENVIRONMENT_PATH", ".env.staging")
+
+from db import sqlEngine  # noqa: E402
+from db.sqlEngine import DbExecute  # noqa: E402
+
+sqlEngine.db.echo = False
+ROWS = 100_000
+INSERT = "INSERT INTO events (id, name, score, kind) VALUES (:id, :name, :score, :kind)"
+
+
+def rows(count: int = ROWS, name: str = "event"):
+    return (
+        {"id": row, "name": f"{name}-{row}", "score": row * 0.5, "kind": row % 7}
+        for row in range(count)
+    )
+
+
+def reset():
+    DbExecute().update("DROP TABLE IF EXISTS events", {})
+    DbExecute().update(
+        "CREATE TABLE events "
+        "(id INTEGER PRIMARY KEY, name TEXT, score REAL, kind INTEGER)",
+        {},
+    )
+
+
+CASES = {
+    "insert() per row (10k rows)": lambda: [
+        DbExecute().insert(INSERT, row) for row in rows(10_000)
+    ],
+    "insert() whole list": lambda: DbExecute().insert(INSERT, list(rows())),
+    "executemany, batch 1000, commit per batch": lambda: DbExecute().bulk_insert(
+        "events", rows(), batch_size=1000
+    ),
+    "executemany, batch 1000, one commit": lambda: DbExecute().bulk_insert(
+        "events", rows(), batch_size=1000, commit_per_batch=False
+    ),
+    "multi-row VALUES, batch 500, per batch": lambda: DbExecute().bulk_insert(
+        "events", rows(), batch_size=500, multirow=True
+    ),
+    "multi-row VALUES, batch 500, one commit": lambda: DbExecute().bulk_insert(
+        "events", rows(), batch_size=500, multirow=True, commit_per_batch=False
+    ),
+}
+
+
+def main():
+    for name, run in CASES.items():
+        reset()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        written = (
+            DbExecute()
+            .fetchone("SELECT count(*) AS total FROM events", {})
+            .data["total"]
+        )
+        print(f"{name:<44}{written / elapsed:>12,.0f} rows/s")
+    start = time.perf_counter()
+    result = DbExecute().bulk_insert(
+        "events",
+        rows(name="updated"),
+        batch_size=500,
+        multirow=True,
+        update_columns=["name", "score"],
+        conflict_keys=["id"],
+    )
+    elapsed = time.perf_counter() - start
+    updated = (
+        DbExecute()
+        .fetchone(
+            "SELECT count(*) AS total FROM events WHERE name LIKE 'updated-%'", {}
+        )
+        .data["total"]
+    )
+    print(
+        f"{'upsert over existing rows, VALUES, batch 500':<44}"
+        f"{result.rows_effected / elapsed:>12,.0f} rows/s "
+        f"({updated:,} updated, {len(result.batches)} batches)"
+    )
+
+
+if __name__ == "__main__":
+    main()
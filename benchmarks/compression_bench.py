@@ -0,0 +1,79 @@
+"""
+CPU cost versus bytes saved of every available response encoding and level.
+
+Compresses a small and a large CustomResponse body and the public/404.html page with
+gzip, and br / zstd when the brotli / zstandard packages are installed.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.compression_bench
+"""
+import time
+
+from utils.compression import AVAILABLE_ENCODINGS, compress
+from utils.json_encoder import dumps
+
+LEVELS = {"gzip": (1, 3, 6, 9), "br": (1, 4, 6, 9, 11), "zstd": (1, 3, 9, 19)}
+ROWS = [
+    {
+        "id": row,
+        "name": f"row-{row}",
+        "score": row * 0.5,
+        "tags": ["a", "b", "c"],
+        "created": "2024-08-05T10:00:00",
+    }
+    for row in range(1_000)
+]
+PAYLOADS = {
+    "json 2 KiB": dumps(
+        {
+            "code": "HTTP_200_SUCCESS",
+            "message": "Success",
+            "data": ROWS[:20],
+            "error": False,
+            "details": {},
+        }
+    ),
+    "json 100 KiB": dumps(
+        {
+            "code": "HTTP_200_SUCCESS",
+            "message": "Success",
+            "data": ROWS,
+            "error": False,
+            "details": {},
+        }
+    ),
+}
+
+
+def measure(encoding: str, data: bytes, level: int) -> tuple:
+    """Return (compressed size, microseconds per call)."""
+    compressed = compress(encoding, data, level)
+    iterations = max(3, min(2_000, 2_000_000 // len(data)))
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        compress(encoding, data, level)
+    return len(compressed), (time.perf_counter_ns() - start) / iterations / 1000
+
+
+def main():
+    with open("public/404.html", "rb") as file:
+        PAYLOADS["404.html"] = file.read()
+    print(f"encodings available: {', '.join(AVAILABLE_ENCODINGS)}")
+    for name, data in PAYLOADS.items():
+        print(f"\n{name} ({len(data):,} bytes)")
+        print(
+            f"  {'encoding':<10}{'level':>6}{'size':>10}{'saved':>8}"
+            f"{'us/call':>11}{'MB/s':>9}{'saved/CPU us':>14}"
+        )
+        for encoding in AVAILABLE_ENCODINGS:
+            for level in LEVELS[encoding]:
+                size, micros = measure(encoding, data, level)
+                saved = len(data) - size
+                print(
+                    f"  {encoding:<10}{level:>6}{size:>10,}{saved / len(data):>8.1%}"
+                    f"{micros:>11.1f}{len(data) / micros:>9.1f}{saved / micros:>14.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Throughput and uniqueness of utils.ids, the id generator behind generate_uuid_string.
+
+Prints ids/sec of the previous random.choices strings (before their database lookups),
+IdGenerator.generate and IdGenerator.generate_many for each format. Then PROCESSES
+processes sharing one slot directory generate ids concurrently, twice in a row (the
+second round restarts on the slots and high-water marks of the first), and every id is
+checked for uniqueness, format and per-process ordering.
+
+Usage:
+    python -m benchmarks.id_bench
+"""
+
+import os
+import time
+import random
+import string
+import tempfile
+import multiprocessing
+
+# spawned processes re-import this module, they keep the directory of the parent
+os.environ.setdefault("ID_SLOT_DIR", tempfile.mkdtemp())
+os.environ.setdefault("ID_NODE_ID", "0")
+
+from utils.ids import ID_FORMATS, id_generator  # noqa: E402
+
+PROCESSES = 8
+PER_PROCESS = 50_000
+RUNS = 200_000
+PREVIOUS = {
+    'game': (string.ascii_letters + string.digits, 16),
+    'project_id': (string.ascii_letters + string.digits, 12),
+    'user_id': (string.digits, 10),
+}
+
+
+def rate(run, count: int) -> float:
+    start = time.perf_counter()
+    run(count)
+    return count / (time.perf_counter() - start)
+
+
+def produce(usage: str) -> tuple:
+    ids = [id_generator.generate(usage) for _ in range(PER_PROCESS // 2)]
+    ids += id_generator.generate_many(usage, PER_PROCESS - len(ids))
+    return os.getpid(), id_generator.worker, ids
+
+
+def check(usage: str, results: list, seen: set):
+    id_format = ID_FORMATS[usage]
+    for _, _, ids in results:
+        assert ids == sorted(ids), "ids of one process are not increasing"
+        assert all(
+            len(id) == id_format.length and set(id) <= set(id_format.alphabet)
+            for id in ids
+        )
+        seen.update(ids)
+
+
+def main():
+    print(f"{'format':<12}{'previous':>16}{'generate':>16}{'generate_many':>18}")
+    for usage, (alphabet, size) in PREVIOUS.items():
+        previous = rate(
+            lambda count: [
+                ''.join(random.choices(alphabet, k=size)) for _ in range(count)
+            ],
+            RUNS,
+        )
+        single = rate(
+            lambda count: [id_generator.generate(usage) for _ in range(count)], RUNS
+        )
+        bulk = rate(
+            lambda count: [
+                id_generator.generate_many(usage, 1000) for _ in range(count // 1000)
+            ],
+            RUNS,
+        )
+        print(f"{usage:<12}{previous:>14,.0f}/s{single:>14,.0f}/s{bulk:>16,.0f}/s")
+
+    context = multiprocessing.get_context("spawn")
+    for usage in ID_FORMATS:
+        seen, total, workers = set(), 0, set()
+        for _ in range(2):
+            with context.Pool(PROCESSES) as pool:
+                results = pool.map(produce, [usage] * PROCESSES)
+            check(usage, results, seen)
+            total += sum(len(ids) for _, _, ids in results)
+            workers.update(worker for _, worker, _ in results)
+        print(
+            f"{usage:<12}{total:,} ids from {2 * PROCESSES} processes on "
+            f"{len(workers)} worker slots: {total - len(seen)} collisions"
+        )
+        assert len(seen) == total
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Per-request cost of JWT verification with and without the verified-claims cache.
+
+Replays requests from a pool of clients that each reuse one 7 day token, the way
+clients reuse tokens from utils.auth.create_jwt_token.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.jwt_cache_bench
+"""
+import os
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from utils.auth import create_jwt_token, jwt_cache, verify_jwt_token  # noqa: E402
+
+CLIENTS = 1_000
+REQUESTS = 100_000
+
+
+def run(tokens, use_cache: bool) -> float:
+    start = time.perf_counter_ns()
+    for request in range(REQUESTS):
+        verify_jwt_token(tokens[request % CLIENTS], use_cache=use_cache)
+    return (time.perf_counter_ns() - start) / REQUESTS
+
+
+def main():
+    tokens = [create_jwt_token(f"user-{client}") for client in range(CLIENTS)]
+    uncached = run(tokens, use_cache=False)
+    jwt_cache.clear()
+    cached = run(tokens, use_cache=True)
+    print(f"cache off: {uncached / 1000:8.2f} us/request")
+    print(f"cache on:  {cached / 1000:8.2f} us/request  ({uncached / cached:.1f}x)")
+    print(f"cache stats: {jwt_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Flood benchmark for utils.rate_limiter.RateLimiter.
+
+Replays a burst of requests from a fixed client population and prints, per slice,
+the admission latency and the traced memory, which should both stay flat. The second
+run replays one request from each of a million unique IPs against a capped state
+table to show that memory stops growing at `max_entries`.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.rate_limiter_bench
+"""
+import time
+import tracemalloc
+
+from utils.rate_limiter import RateLimiter
+from utils.rate_limit_backends import LocalBackend
+
+CLIENTS = 10_000
+REQUESTS = 1_000_000
+SLICES = 10
+
+
+def flood():
+    limiter = RateLimiter(
+        requests_limit=30, time_window=60, backend=LocalBackend(), name="flood"
+    )
+    hit, policy = limiter.backend.hit, limiter.policy
+    keys = [f"10.0.{i // 256}.{i % 256}|/backend/demo" for i in range(CLIENTS)]
+    per_slice = REQUESTS // SLICES
+
+    tracemalloc.start()
+    request = 0
+    for slice_no in range(SLICES):
+        rejected = 0
+        start = time.perf_counter_ns()
+        for _ in range(per_slice):
+            if hit(keys[request % CLIENTS], policy):
+                rejected += 1
+            request += 1
+        elapsed = time.perf_counter_ns() - start
+        current, _ = tracemalloc.get_traced_memory()
+        print(f"slice {slice_no}: {elapsed / per_slice:8.1f} ns/request  "
+              f"rejected {rejected:7d}  memory {current / 1024:9.1f} KiB")
+    tracemalloc.stop()
+
+
+def unique_ip_replay(unique_ips: int = 1_000_000, max_entries: int = 100_000):
+    limiter = RateLimiter(
+        requests_limit=30,
+        time_window=60,
+        backend=LocalBackend(max_entries=max_entries),
+        name="unique_ip_replay",
+    )
+    hit, policy = limiter.backend.hit, limiter.policy
+    per_slice = unique_ips // SLICES
+
+    tracemalloc.start()
+    for slice_no in range(SLICES):
+        start = time.perf_counter_ns()
+        for i in range(slice_no * per_slice, (slice_no + 1) * per_slice):
+            hit(
+                f"{i >> 24}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}|/backend/demo",
+                policy,
+            )
+        elapsed = time.perf_counter_ns() - start
+        current, _ = tracemalloc.get_traced_memory()
+        stats = limiter.backend.stats()
+        print(
+            f"slice {slice_no}: {elapsed / per_slice:8.1f} ns/request  "
+            f"entries {stats['entries']:7d}  evicted {stats['evictions']:7d}  "
+            f"memory {current / 1024:9.1f} KiB"
+        )
+    tracemalloc.stop()
+
+
+def main():
+    print("flood from a fixed client population")
+    flood()
+    print("one request from each unique ip")
+    unique_ip_replay()
+
+
+if __name__ == "__main__":
+    main()
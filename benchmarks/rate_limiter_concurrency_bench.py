@@ -0,0 +1,74 @@
+"""
+Admission cost of utils.rate_limiter.RateLimiter under concurrency.
+
+Runs the dependency the way FastAPI does (one coroutine per request) with 1, 100 and
+10k distinct clients in flight at once and prints the cost per admitted request for
+each backend that is available locally.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.rate_limiter_concurrency_bench
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from starlette.requests import Request
+
+from utils.rate_limiter import RateLimiter
+from utils.rate_limit_backends import LocalBackend, SharedMemoryBackend
+
+REQUESTS_PER_CLIENT = 20
+
+
+def make_request(client: int) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/backend/demo",
+            "headers": [
+                (
+                    b"x-forwarded-for",
+                    f"10.{client >> 16}.{(client >> 8) & 255}.{client & 255}".encode(),
+                )
+            ],
+            "client": ("127.0.0.1", 5000),
+            "query_string": b"",
+        }
+    )
+
+
+async def run(limiter: RateLimiter, clients: int) -> float:
+    requests = [make_request(client) for client in range(clients)]
+
+    async def client_loop(request):
+        for _ in range(REQUESTS_PER_CLIENT):
+            await limiter(request)
+
+    start = time.perf_counter_ns()
+    await asyncio.gather(*(client_loop(request) for request in requests))
+    return (time.perf_counter_ns() - start) / (clients * REQUESTS_PER_CLIENT)
+
+
+def main():
+    shm_path = os.path.join(tempfile.gettempdir(), "rate-limit-bench.bin")
+    backends = {
+        "local": lambda: LocalBackend(),
+        "shared_memory": lambda: SharedMemoryBackend(path=shm_path, slots=65536),
+    }
+    for name, factory in backends.items():
+        for clients in (1, 100, 10_000):
+            limiter = RateLimiter(
+                requests_limit=1000,
+                time_window=60,
+                backend=factory(),
+                name=f"{name}_{clients}",
+            )
+            cost = asyncio.run(run(limiter, clients))
+            print(f"{name:14s} {clients:6d} concurrent clients: {cost:8.1f} ns/request")
+    os.remove(shm_path)
+
+
+if __name__ == "__main__":
+    main()
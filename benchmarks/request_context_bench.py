@@ -0,0 +1,121 @@
+"""
+Throughput of the request context: per-route dependencies vs RequestContextMiddleware.
+
+Builds two copies of a minimal app serving the same routes under the protected /backend
+prefix, one with the previous `create_request_id`/`authorisation` router dependencies
+(kept here, they were removed from middleware.middleware) and one with the pure ASGI
+middleware, and prints requests/sec of each route in both apps. Every request carries
+a valid token, so both setups log, time and authenticate it.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.request_context_bench
+"""
+
+import asyncio
+import os
+import time
+import uuid
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+from fastapi import APIRouter, Depends, FastAPI, Request  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer  # noqa: E402
+from jose import JWTError  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from db.routing import start_request_routing  # noqa: E402
+from middleware.middleware import RequestContextMiddleware  # noqa: E402
+from utils.auth import create_jwt_token, verify_jwt_token  # noqa: E402
+from utils.invalid_response_class import AuthenticationError  # noqa: E402
+from utils.invalid_response_class import AuthenticationMissing  # noqa: E402
+from utils.logData import LogDataClass  # noqa: E402
+from utils.response_manipulator import CustomResponse  # noqa: E402
+from utils.timing import start_request_timer  # noqa: E402
+
+REQUESTS = 2_000
+security = HTTPBearer(auto_error=False)
+
+
+async def create_request_id(request: Request):
+    """
+    The previous request context dependency: request id, timer, routing and request log.
+    """
+    request_id = request.headers.get('X-Request-ID') or str(uuid.uuid4())
+    request.state.request_token = request_id
+    request.state.timer = start_request_timer()
+    start_request_routing()
+    await LogDataClass(request_id=request_id).request_log(request)
+
+
+async def authorisation(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    """The previous authentication dependency."""
+    if credentials is None:
+        raise AuthenticationMissing("Authorization header is missing")
+    try:
+        payload = verify_jwt_token(credentials.credentials)
+    except JWTError:
+        raise AuthenticationError("Invalid or expired token")
+    request.state.user_data = payload.get("sub")
+
+
+def build_app(use_middleware: bool) -> FastAPI:
+    app = FastAPI()
+    router = APIRouter()
+
+    @router.post('/demo')
+    async def demo(request: Request):
+        return CustomResponse(
+            resp_code='HTTP_200_SUCCESS', data={"resp": "Success"}, request=request
+        ).respond()
+
+    @router.get('/ping')
+    async def ping():
+        return {"status": True, "message": "server health ok"}
+
+    if use_middleware:
+        app.add_middleware(RequestContextMiddleware, protected_prefixes=['/backend'])
+        app.include_router(router, prefix='/backend')
+    else:
+        app.include_router(
+            router,
+            prefix='/backend',
+            dependencies=[Depends(create_request_id), Depends(authorisation)],
+        )
+    return app
+
+
+async def requests_per_second(
+    app: FastAPI, method: str, path: str, headers: dict
+) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            response = await client.request(method, path, headers=headers)
+            assert response.status_code == 200, response.text
+        return REQUESTS / (time.perf_counter() - start)
+
+
+def main():
+    logger.remove()  # measure the request path, not the log sinks
+    headers = {"Authorization": f"Bearer {create_jwt_token('benchmark-user')}"}
+    apps = {"dependencies": build_app(False), "middleware": build_app(True)}
+    for method, path in (("POST", "/backend/demo"), ("GET", "/backend/ping")):
+        rates = {
+            label: asyncio.run(requests_per_second(app, method, path, headers))
+            for label, app in apps.items()
+        }
+        for label, rate in rates.items():
+            print(f"{label:12s} {method:4s} {path:15s} {rate:9.1f} requests/sec")
+        speedup = rates['middleware'] / rates['dependencies']
+        print(f"{'speedup':12s} {method:4s} {path:15s} {speedup:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Responses per second of CustomResponse(...).respond() for small and large payloads.
+
+Compares the previous path (pydantic validated arguments, stdlib json JSONResponse and
+set_cookie) with the current one (pre-encoded envelopes, orjson, cached static bodies).
+Logging is disabled so only response construction is measured.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.response_bench
+"""
+import os
+import time
+from datetime import datetime
+
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import validate_arguments  # noqa: E402
+from starlette.datastructures import State  # noqa: E402
+from utils.response_manipulator import CustomResponse  # noqa: E402
+
+SMALL = {"id": 42, "name": "demo", "active": True}
+LARGE = [
+    {
+        "id": row,
+        "name": f"row-{row}",
+        "score": row * 0.5,
+        "tags": ["a", "b", "c"],
+        "created": "2024-08-05T10:00:00",
+    }
+    for row in range(1_000)
+]
+CASES = {
+    "401 static": ("HTTP_401_UNAUTHORIZED", {}, 100_000),
+    "200 small": ("HTTP_200_SUCCESS", SMALL, 100_000),
+    "200 large (1000 rows)": ("HTTP_200_SUCCESS", LARGE, 500),
+}
+
+
+class FakeRequest(object):
+    method = "POST"
+    headers = {}
+
+    def __init__(self):
+        self.state = State({"request_token": "5f0c8a42-9b1e-4c1d-8f59-0b2a7d3e6c11"})
+
+    class url:
+        path = "/backend/demo"
+
+
+@validate_arguments
+def legacy_respond(request, resp_code: str, data=None, details=None, message: str = ''):
+    entry = CustomResponse.LEGAL_RESPONSE_CODES[resp_code]
+    content = {
+        "code": resp_code,
+        "message": message or entry["message"],
+        "data": data,
+        "error": entry["status"] >= 400,
+        "details": details,
+    }
+    response = JSONResponse(status_code=entry["status"], content=content)
+    response.set_cookie(key='request_id', value=request.state.request_token)
+    return response
+
+
+def run(respond, request, resp_code, data, iterations) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        respond(request, resp_code, data)
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    request = FakeRequest()
+
+    def current(request, resp_code, data):
+        return CustomResponse(request=request, resp_code=resp_code, data=data).respond()
+
+    def legacy(request, resp_code, data):
+        return legacy_respond(request, resp_code, data=data, details={})
+
+    print(f"{'case':<24}{'before':>14}{'after':>14}")
+    for name, (resp_code, data, iterations) in CASES.items():
+        before = run(legacy, request, resp_code, data, iterations)
+        after = run(current, request, resp_code, data, iterations)
+        print(
+            f"{name:<24}{before:>10,.0f}/s  {after:>10,.0f}/s  ({after / before:.1f}x)"
+        )
+    payload = CustomResponse(
+        request=request, resp_code="HTTP_200_SUCCESS", data={"at": datetime(2024, 8, 5)}
+    ).respond()
+    print(f"datetime payload: {payload.body.decode()}")
+
+
+if __name__ == "__main__":
+    main()
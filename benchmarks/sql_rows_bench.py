@@ -0,0 +1,103 @@
+"""
+Rows per second of DbExecute row materialisation for 1k, 100k and 1M-row result sets.
+
+Compares the previous conversion (mappings, then a dict per row checking every value for
+datetimes) with fetchall's column-oriented conversion and with iter_rows on a
+server-side cursor. Runs on a SQLite file whose DATETIME column is returned as datetime
+objects, as MySQL does.
+
+Usage:
+    ENVIRONMENT=STAGING python -m benchmarks.sql_rows_bench
+"""
+
+import os
+import time
+import sqlite3
+import datetime
+import tempfile
+
+DATABASE = os.path.join(tempfile.mkdtemp(), "sql_rows_bench.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ.setdefault("ENVIRONMENT_PATH", ".env.staging")
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from db import sqlEngine  # noqa: E402
+from db.sqlEngine import DbExecute  # noqa: E402
+
+sqlEngine.db = create_engine(
+    f"sqlite:///{DATABASE}", connect_args={"detect_types": sqlite3.PARSE_DECLTYPES}
+)
+SIZES = (1_000, 100_000, 1_000_000)
+QUERY = "SELECT id, name, score, created FROM events WHERE id <= :limit"
+
+
+def previous_fetchall(limit: int) -> list:
+    with sqlEngine.db.connect() as connection:
+        rows = connection.execute(text(QUERY), {"limit": limit}).mappings().all()
+    return [
+        {
+            column: (
+                str(row[column])
+                if isinstance(row[column], datetime.datetime)
+                else row[column]
+            )
+            for column in row.keys()
+        }
+        for row in rows
+    ]
+
+
+def fetchall(limit: int) -> list:
+    return DbExecute().fetchall(QUERY, {"limit": limit}).data
+
+
+def iter_rows(limit: int) -> int:
+    count = 0
+    for _ in DbExecute().iter_rows(QUERY, {"limit": limit}, chunk_size=5_000):
+        count += 1
+    return count
+
+
+def setup():
+    created = datetime.datetime(2024, 8, 5, 10, 0, 0)
+    with sqlEngine.db.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE events "
+                "(id INTEGER PRIMARY KEY, name TEXT, score REAL, created TIMESTAMP)"
+            )
+        )
+        connection.execute(
+            text("INSERT INTO events VALUES (:id, :name, :score, :created)"),
+            [
+                {
+                    "id": row,
+                    "name": f"event-{row}",
+                    "score": row * 0.5,
+                    "created": created,
+                }
+                for row in range(1, SIZES[-1] + 1)
+            ],
+        )
+
+
+def main():
+    setup()
+    sample = fetchall(1)[0]
+    assert sample == previous_fetchall(1)[0] and isinstance(
+        sample["created"], str
+    ), sample
+    print(f"{'rows':>10}{'previous':>16}{'fetchall':>16}{'iter_rows':>16}")
+    for size in SIZES:
+        rates = []
+        for run in (previous_fetchall, fetchall, iter_rows):
+            start = time.perf_counter()
+            result = run(size)
+            rates.append(size / (time.perf_counter() - start))
+            assert (result if isinstance(result, int) else len(result)) == size
+            del result
+        print(f"{size:>10,}" + "".join(f"{rate:>12,.0f}/s  " for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
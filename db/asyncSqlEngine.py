@@ -0,0 +1,237 @@
+import os
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import create_async_engine
+from db.sqlEngine import (
+    DB_USER,
+    DB_PASSWORD,
+    DB_IP,
+    DB_PORT,
+    DB_NAME,
+    ECHO,
+    SQL_REPLICA_STRATEGY,
+    pool_options,
+    serialize_rows,
+    insert_statement,
+    insert_batches,
+    multirow_params,
+    sql_text,
+)
+from db.routing import ReplicaSet, replica_urls, mark_primary_write, reads_from_primary
+from db.instrumentation import SQL_METRICS, sql_instrumentation, start_checkout_clock
+from utils import metrics
+from utils.timing import timed
+
+# asyncio counterpart of db.sqlEngine, queries never block the event loop
+
+SQLALCHEMY_ASYNC_DATABASE_URL_DEV = (
+    f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_IP}:{DB_PORT}/{DB_NAME}"
+)
+# full URL override, e.g. sqlite+aiosqlite:///local.db for local runs
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv(
+    "SQLALCHEMY_ASYNC_DATABASE_URL", SQLALCHEMY_ASYNC_DATABASE_URL_DEV
+)
+# comma separated async read replica URLs, e.g.
+# sqlite+aiosqlite:///replica-1.db,sqlite+aiosqlite:///replica-2.db
+SQLALCHEMY_ASYNC_REPLICA_URLS = replica_urls(os.getenv("SQLALCHEMY_ASYNC_REPLICA_URLS"))
+
+async_db = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL,
+    echo=ECHO,
+    **pool_options(SQLALCHEMY_ASYNC_DATABASE_URL),
+)
+async_replicas = ReplicaSet(
+    [
+        create_async_engine(url, echo=ECHO, **pool_options(url))
+        for url in SQLALCHEMY_ASYNC_REPLICA_URLS
+    ],
+    SQL_REPLICA_STRATEGY,
+)
+metrics.register('sql_async_routing', async_replicas.stats)
+
+if SQL_METRICS:
+    sql_instrumentation.instrument(async_db, "async-primary")
+    for number, engine in enumerate(async_replicas.engines, 1):
+        sql_instrumentation.instrument(engine, f"async-replica-{number}")
+
+
+class AsyncDbExecute(object):
+    """
+    Async version of DbExecute with the same fetchall/fetchone/update/insert API and
+    status/data/rows_effected results.
+
+    Every call checks a connection out of the asyncio pool and returns it when done.
+    Reads run on a plain connection, writes in a transaction committed when the
+    statement succeeded and rolled back otherwise. Inside `transaction()` every call
+    shares one connection and one transaction. Reads are routed to
+    SQLALCHEMY_ASYNC_REPLICA_URLS like DbExecute's.
+
+    Usage:
+        query = "SELECT * FROM users WHERE id = :id"
+        rows = (await AsyncDbExecute().fetchall(query, {"id": 1})).data
+        async with AsyncDbExecute().transaction() as tx:
+            charge = "UPDATE users SET credits = credits - 1 WHERE id = :id"
+            await tx.update(charge, {"id": 1})
+            await tx.insert("INSERT INTO usage (user_id) VALUES (:id)", {"id": 1})
+    """
+
+    def __init__(self) -> None:
+        self.engine = async_db
+        self.replicas = async_replicas
+        self.connection = None
+        self.status = False
+        self.data = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Run every call made on the yielded AsyncDbExecute in one transaction."""
+        mark_primary_write()
+        start_checkout_clock()
+        async with self.engine.begin() as connection:
+            self.connection = connection
+            try:
+                yield self
+            finally:
+                self.connection = None
+
+    @asynccontextmanager
+    async def connect(self, write: bool):
+        """
+        Yield the connection to run a statement on: the transaction's, or a new one
+        routed as in DbExecute.connect.
+        """
+        if self.connection is not None:
+            yield self.connection
+            return
+        if write:
+            mark_primary_write()
+            start_checkout_clock()
+            async with self.engine.begin() as connection:
+                yield connection
+        elif self.replicas and not reads_from_primary():
+            with self.replicas.checkout() as engine:
+                start_checkout_clock()
+                async with engine.connect() as connection:
+                    yield connection
+        else:
+            start_checkout_clock()
+            async with self.engine.connect() as connection:
+                yield connection
+
+    async def bulk_insert(
+        self,
+        table,
+        rows,
+        batch_size=1000,
+        update_columns=None,
+        conflict_keys=None,
+        multirow=False,
+        commit_per_batch=True,
+    ):
+        """
+        Insert or upsert any iterable of row dicts in batches, see
+        DbExecute.bulk_insert.
+
+        Usage:
+            await AsyncDbExecute().bulk_insert(
+                "users", rows, update_columns=["name"], conflict_keys=["id"]
+            )
+        """
+        self.batches = []
+        self.rows_effected = 0
+        if commit_per_batch or self.connection is not None:
+            await self.write_batches(
+                table, rows, batch_size, update_columns, conflict_keys, multirow
+            )
+        else:
+            async with self.transaction():
+                await self.write_batches(
+                    table, rows, batch_size, update_columns, conflict_keys, multirow
+                )
+        self.status = True
+        return self
+
+    async def write_batches(
+        self, table, rows, batch_size, update_columns, conflict_keys, multirow
+    ):
+        statements = {}
+        for columns, batch in insert_batches(rows, batch_size):
+            size = len(batch) if multirow else None
+            if size not in statements:
+                statements[size] = sql_text(
+                    insert_statement(
+                        self.engine.dialect,
+                        table,
+                        columns,
+                        size,
+                        update_columns,
+                        conflict_keys,
+                    )
+                )
+            async with self.connect(write=True) as connection:
+                with timed('db'):
+                    await connection.execute(
+                        statements[size],
+                        multirow_params(columns, batch) if multirow else batch,
+                    )
+            self.batches.append(len(batch))
+            self.rows_effected += len(batch)
+
+    async def fetchall(self, query, valuelist):
+        async with self.connect(write=False) as connection:
+            with timed('db'):
+                result = await connection.execute(sql_text(query), valuelist)
+            keys = list(result.keys())
+            rows = result.all()
+        self.data = serialize_rows(keys, rows)
+        if len(self.data) > 0:
+            self.status = True
+        return self
+
+    async def fetchone(self, query, valuelist):
+        async with self.connect(write=False) as connection:
+            with timed('db'):
+                result = await connection.execute(sql_text(query), valuelist)
+            keys = list(result.keys())
+            row = result.fetchone()
+        self.data = serialize_rows(keys, [row])[0] if row else {}
+        if self.data:
+            self.status = True
+        return self
+
+    async def iter_rows(self, query, valuelist, chunk_size=1000):
+        """
+        Yield the rows of a large result one by one from a server-side cursor,
+        `chunk_size` rows in memory at a time.
+
+        Usage:
+            items = AsyncDbExecute().iter_rows(query, values)
+            return StreamingCustomResponse(request=request, items=items).respond()
+        """
+        async with self.connect(write=False) as connection:
+            with timed('db'):
+                result = await connection.stream(sql_text(query), valuelist)
+            keys = list(result.keys())
+            async for rows in result.partitions(chunk_size):
+                self.status = True
+                for row in serialize_rows(keys, rows):
+                    yield row
+
+    # Function to update fields in a table.
+    async def update(self, query, valuelist):
+        async with self.connect(write=True) as connection:
+            with timed('db'):
+                result = await connection.execute(sql_text(query), valuelist)
+        self.status = True
+        self.rows_effected = result.rowcount
+        return self
+
+    # Function to insert single or multiple rows in a table. For single row-entry
+    # valueList should be dictonary and for multiple rows-entry valueList should be list
+    # containing multiple dictonary.
+    async def insert(self, query, valuelist):
+        async with self.connect(write=True) as connection:
+            with timed('db'):
+                result = await connection.execute(sql_text(query), valuelist)
+        self.status = True
+        self.rows_effected = result.rowcount
+        return self
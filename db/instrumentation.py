@@ -0,0 +1,438 @@
+import os
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+from utils.log_sink import log_sink
+
+# SQL pool and statement metrics collected from SQLAlchemy engine and pool events,
+# exposed on /metrics
+
+SQL_METRICS = os.getenv('SQL_METRICS', '1') == '1'
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', 500))
+SQL_EXPLAIN = os.getenv('SQL_EXPLAIN', '1') == '1'
+# seconds between two plans of one fingerprint
+SQL_EXPLAIN_INTERVAL = float(os.getenv('SQL_EXPLAIN_INTERVAL', 300))
+# parameters may hold personal data
+SQL_SLOW_QUERY_PARAMS = os.getenv('SQL_SLOW_QUERY_PARAMS', '0') == '1'
+SQL_SLOW_QUERY_KEEP = int(os.getenv('SQL_SLOW_QUERY_KEEP', 20))
+SQL_FINGERPRINT_LIMIT = int(os.getenv('SQL_FINGERPRINT_LIMIT', 500))
+
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+OTHER_FINGERPRINT = "(other)"
+STATEMENT_MAX_CHARS = 2000
+EXPLAIN_QUEUE_LIMIT = 10
+EXPLAINED_STATEMENTS = ("SELECT", "WITH")
+SYNC_DRIVERS = {
+    "aiomysql": "pymysql",
+    "asyncmy": "pymysql",
+    "aiosqlite": "pysqlite",
+    "asyncpg": "psycopg2",
+}
+
+FINGERPRINT_PATTERNS = (
+    # string literals
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    # bind parameters of every paramstyle
+    (re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+"), "?"),
+    # numeric literals
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    # IN lists and VALUES rows of any length
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    # multi-row VALUES
+    (re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+"), "(?+)+"),
+    (re.compile(r"\s+"), " "),
+)
+
+_checkout_started: ContextVar = ContextVar('sql_checkout_started', default=None)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """
+    Normalise a statement so every execution of the same query shape shares one key.
+
+    Example output:
+    'SELECT * FROM users WHERE id = ? AND kind IN (?+)'
+    """
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()[:STATEMENT_MAX_CHARS]
+
+
+def start_checkout_clock():
+    """
+    Start timing the next connection checkout of this context, recorded (once) by the
+    pool `checkout` event.
+    """
+    _checkout_started.set([time.perf_counter()])
+
+
+def sync_url(url):
+    """
+    The URL of `url`'s database with a blocking driver, e.g. mysql+aiomysql becomes
+    mysql+pymysql.
+    """
+    driver = SYNC_DRIVERS.get(url.get_driver_name())
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}") if driver else url
+
+
+class Histogram(object):
+    """
+    Fixed-bucket latency histogram in milliseconds, not thread safe on its own.
+
+    Example output of `as_dict`:
+    {'count': 3, 'sum_ms': 14.2, 'max_ms': 9.1, 'p50_ms': 5, 'p99_ms': 10,
+     'buckets': {'1': 0, '2.5': 1, ..., '+Inf': 3}}
+    """
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket holding the `q` quantile, the maximum for the last
+        bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return round(self.max, 3)
+
+    def as_dict(self) -> dict:
+        buckets = {}
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            buckets[str(bound)] = seen
+        buckets["+Inf"] = self.count
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class SQLInstrumentation(object):
+    """
+    Collects pool and statement metrics of the instrumented engines from SQLAlchemy
+    events.
+
+    - pool `checkout`/`checkin`/`connect`/`invalidate`: connections in use (and their
+      peak), checkouts, new connections and invalidations per engine, plus the pool's
+      own size, checked-out and overflow gauges. Checkouts following
+      `start_checkout_clock()` (every DbExecute/AsyncDbExecute call) add their wait to
+      the checkout wait histogram.
+    - `before_cursor_execute`/`after_cursor_execute`/`handle_error`: a latency histogram
+      of every statement and count, total, max and errors per SQL fingerprint (at most
+      `fingerprint_limit` of them, later shapes are counted under '(other)').
+    - statements slower than `slow_query_ms` are logged as 'SLOW_QUERY' warnings,
+      /metrics only keeps their fingerprint and duration. SELECTs get their EXPLAIN
+      plan, run on a separate connection in a background thread, at most once per
+      fingerprint every SQL_EXPLAIN_INTERVAL seconds.
+
+    Args:
+        slow_query_ms (float): Slow query threshold in milliseconds.
+        explain (bool): Capture EXPLAIN plans of slow SELECTs.
+        fingerprint_limit (int): Maximum number of fingerprints tracked.
+        keep_slow (int): Number of recent slow queries shown on /metrics.
+
+    Usage:
+        sql_instrumentation.instrument(engine, "primary")
+        sql_instrumentation.stats()
+    """
+
+    def __init__(
+        self,
+        slow_query_ms: float = SQL_SLOW_QUERY_MS,
+        explain: bool = SQL_EXPLAIN,
+        fingerprint_limit: int = SQL_FINGERPRINT_LIMIT,
+        keep_slow: int = SQL_SLOW_QUERY_KEEP,
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self.fingerprint_limit = fingerprint_limit
+        self.lock = threading.Lock()
+        self.engines = {}
+        self.pools = {}
+        self.checkout_wait = Histogram()
+        self.statement_latency = Histogram()
+        self.fingerprints = {}  # fingerprint -> [count, total_ms, max_ms, errors]
+        self.slow_queries = deque(maxlen=keep_slow)
+        self.slow_count = 0
+        self.explained = {}  # fingerprint -> monotonic time of the last plan
+        self.explain_engines = {}
+        self.explain_pending = 0
+        self.executor = None
+
+    def instrument(self, engine, name: str):
+        """
+        Listen to the pool and statement events of a sync or async `engine`, reported
+        under `name`.
+        """
+        engine = getattr(engine, "sync_engine", engine)
+        self.engines[name] = engine
+        self.pools[name] = {
+            "checkouts": 0,
+            "checkins": 0,
+            "connects": 0,
+            "invalidations": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+        }
+        event.listen(engine, "checkout", partial(self.on_checkout, name))
+        event.listen(engine, "checkin", partial(self.on_checkin, name))
+        event.listen(engine, "connect", partial(self.on_connect, name))
+        event.listen(engine, "invalidate", partial(self.on_invalidate, name))
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(
+            engine, "after_cursor_execute", partial(self.after_cursor_execute, name)
+        )
+        event.listen(engine, "handle_error", self.handle_error)
+
+    def on_checkout(self, name, dbapi_connection, connection_record, connection_proxy):
+        started = _checkout_started.get()
+        now = time.perf_counter()
+        with self.lock:
+            pool = self.pools[name]
+            pool["checkouts"] += 1
+            pool["in_use"] += 1
+            pool["peak_in_use"] = max(pool["peak_in_use"], pool["in_use"])
+            if started is not None and started[0] is not None:
+                self.checkout_wait.observe((now - started[0]) * 1000)
+                started[0] = None
+
+    def on_checkin(self, name, dbapi_connection, connection_record):
+        with self.lock:
+            pool = self.pools[name]
+            pool["checkins"] += 1
+            pool["in_use"] = max(pool["in_use"] - 1, 0)
+
+    def on_connect(self, name, dbapi_connection, connection_record):
+        with self.lock:
+            self.pools[name]["connects"] += 1
+
+    def on_invalidate(self, name, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.pools[name]["invalidations"] += 1
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        context._instrument_start = time.perf_counter()
+
+    def after_cursor_execute(
+        self, name, conn, cursor, statement, parameters, context, executemany
+    ):
+        start = getattr(context, "_instrument_start", None)
+        if start is None:
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        key = self.record(statement, elapsed)
+        if elapsed >= self.slow_query_ms:
+            self.slow_query(
+                name, conn.engine, key, statement, parameters, executemany, elapsed
+            )
+
+    def handle_error(self, exception_context):
+        context = exception_context.execution_context
+        start = getattr(context, "_instrument_start", None)
+        if start is not None and exception_context.statement:
+            self.record(
+                exception_context.statement,
+                (time.perf_counter() - start) * 1000,
+                error=True,
+            )
+
+    def record(self, statement: str, elapsed: float, error: bool = False) -> str:
+        """
+        Add one execution of `statement` taking `elapsed` milliseconds, return its
+        fingerprint.
+        """
+        key = fingerprint(statement)
+        with self.lock:
+            self.statement_latency.observe(elapsed)
+            entry = self.fingerprints.get(key)
+            if entry is None:
+                if len(self.fingerprints) >= self.fingerprint_limit:
+                    key = OTHER_FINGERPRINT
+                entry = self.fingerprints.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            entry[3] += error
+        return key
+
+    def slow_query(
+        self, name, engine, key, statement, parameters, executemany, elapsed
+    ):
+        """
+        Log a slow statement, after capturing its plan in the background when it is a
+        SELECT.
+        """
+        from utils.logData import current_request_log
+
+        request_log = current_request_log()
+        record = {
+            "engine": name,
+            "fingerprint": key,
+            "duration_ms": round(elapsed, 3),
+            "statement": statement[:STATEMENT_MAX_CHARS],
+            "request_id": request_log.request_id if request_log is not None else None,
+            "time": time.time(),
+        }
+        if SQL_SLOW_QUERY_PARAMS:
+            record["parameters"] = repr(parameters)[:STATEMENT_MAX_CHARS]
+        now = time.monotonic()
+        with self.lock:
+            self.slow_count += 1
+            plan = (
+                self.explain
+                and not executemany
+                and self.explain_pending < EXPLAIN_QUEUE_LIMIT
+                and statement.lstrip()[:7].split(None, 1)[0].upper()
+                in EXPLAINED_STATEMENTS
+                and now - self.explained.get(key, float("-inf")) >= SQL_EXPLAIN_INTERVAL
+            )
+            if plan:
+                self.explained[key] = now
+                self.explain_pending += 1
+        if not plan:
+            self.log_slow_query(record)
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="sql-explain"
+            )
+        self.executor.submit(
+            self.explain_and_log, engine, statement, parameters, record
+        )
+
+    def explain_and_log(self, engine, statement, parameters, record):
+        try:
+            record["plan"] = self.explain_plan(engine, statement, parameters)
+        except Exception as e:
+            record["plan"] = {"error": f"{type(e).__name__}: {e}"[:STATEMENT_MAX_CHARS]}
+        finally:
+            with self.lock:
+                self.explain_pending -= 1
+        self.log_slow_query(record)
+
+    def explain_plan(self, engine, statement, parameters) -> list:
+        """
+        Run EXPLAIN for `statement` on a connection of its own, outside of the engine's
+        pool.
+        """
+        url = sync_url(engine.url)
+        key = url.render_as_string(hide_password=False)
+        explain_engine = self.explain_engines.get(key)
+        if explain_engine is None:
+            explain_engine = self.explain_engines[key] = create_engine(
+                url, poolclass=NullPool
+            )
+        prefix = (
+            "EXPLAIN QUERY PLAN " if url.get_backend_name() == "sqlite" else "EXPLAIN "
+        )
+        with explain_engine.connect() as connection:
+            result = connection.exec_driver_sql(prefix + statement, parameters)
+            return [dict(row._mapping) for row in result]
+
+    def log_slow_query(self, record: dict):
+        # the full record (statement, request id, plan) only goes to the log, /metrics
+        # keeps the fingerprint
+        self.slow_queries.append({
+            "engine": record["engine"],
+            "fingerprint": record["fingerprint"],
+            "duration_ms": record["duration_ms"],
+            "time": record["time"],
+            "explained": "plan" in record,
+        })
+        log_sink.emit(
+            30, "WARNING", {"@fields": {"level": "SLOW_QUERY"}, "@message": record}
+        )
+
+    def pool_stats(self, name: str) -> dict:
+        """Counters of `name` plus the gauges its pool implementation provides."""
+        pool = self.engines[name].pool
+        data = dict(self.pools[name])
+        data["pool"] = type(pool).__name__
+        for key, gauge in (
+            ("size", "size"),
+            ("checked_out", "checkedout"),
+            ("checked_in", "checkedin"),
+            ("overflow", "overflow"),
+        ):
+            method = getattr(pool, gauge, None)
+            if method is not None:
+                data[key] = max(method(), 0)
+        return data
+
+    def stats(self, top: int = 20) -> dict:
+        """
+        Return the pool gauges, latency histograms, the `top` fingerprints by total time
+        and recent slow queries.
+
+        Example output:
+        {'engines': {'primary': {'checkouts': 120, 'in_use': 2, 'peak_in_use': 7,
+                                 'pool': 'QueuePool', 'size': 5, 'checked_out': 2,
+                                 'overflow': 0, ...}},
+         'checkout_wait_ms': {...}, 'statement_ms': {...},
+         'statements': [{'fingerprint': 'SELECT * FROM users WHERE id = ?', 'count': 96,
+                         'total_ms': 210.4, 'mean_ms': 2.192, 'max_ms': 31.0,
+                         'errors': 0}],
+         'fingerprints': 14, 'slow_queries_total': 1, 'slow_queries': [...]}
+        """
+        with self.lock:
+            engines = {name: self.pool_stats(name) for name in self.engines}
+            statements = sorted(
+                self.fingerprints.items(), key=lambda item: item[1][1], reverse=True
+            )[:top]
+            return {
+                "engines": engines,
+                "checkout_wait_ms": self.checkout_wait.as_dict(),
+                "statement_ms": self.statement_latency.as_dict(),
+                "statements": [
+                    {
+                        "fingerprint": key,
+                        "count": count,
+                        "total_ms": round(total, 3),
+                        "mean_ms": round(total / count, 3),
+                        "max_ms": round(peak, 3),
+                        "errors": errors,
+                    }
+                    for key, (count, total, peak, errors) in statements
+                ],
+                "fingerprints": len(self.fingerprints),
+                "slow_queries_total": self.slow_count,
+                "slow_queries": list(self.slow_queries),
+            }
+
+
+sql_instrumentation = SQLInstrumentation()
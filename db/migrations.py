@@ -0,0 +1,41 @@
+"""
+Schema migrations of the Mongo collections, run explicitly before deploying a release
+that needs them.
+
+Creates the unique sparse indexes on user_id (services.ID_UNIQUE_INDEXES) that keep a
+reissued user id from duplicating a user. Building an index on a large collection takes
+a while and fails while duplicates are stored, so it is not done on startup. Exits with
+status 1 if an index could not be created, the error is logged.
+
+Usage:
+    ENVIRONMENT=STAGING python -m db.migrations
+"""
+
+import os
+import sys
+import asyncio
+from dotenv import load_dotenv
+
+# the environment file is loaded before the modules reading it, like in main.py
+load_dotenv(dotenv_path=f".env.{os.getenv('ENVIRONMENT', '').lower()}")
+
+from db.mongoEngine import mongo  # noqa: E402
+from db.service_utils.services import ensure_id_indexes  # noqa: E402
+
+
+async def migrate() -> list:
+    try:
+        return await ensure_id_indexes()
+    finally:
+        mongo.close()
+
+
+def main():
+    failed = asyncio.run(migrate())
+    for index in failed:
+        print(f"could not create the unique index on {index}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
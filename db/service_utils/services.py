@@ -1,29 +1,242 @@
+import os
+import asyncio
+from typing import Iterable
+from pymongo.errors import DuplicateKeyError
 from db.mongoEngine import mongo_user, mongo_data
+from utils import metrics
+from utils.ids import id_generator
+from utils.log_sink import log_sink
+from utils.timing import timed
+from utils.ttl_cache import TTLCache
 
 user_collection = 'user-data'
 data_collection = 'game-details'
 waitlist_table_collection = 'waitlist-table'
 
+# collections holding the ids of each usage, as (database, collection, field)
+ID_LOOKUPS = {
+    'user_id': (
+        (mongo_user, user_collection, 'user_id'),
+        (mongo_user, waitlist_table_collection, 'user_id'),
+    ),
+    'game': ((mongo_data, data_collection, 'game_id'),),
+    'project_id': ((mongo_data, data_collection, 'project_id'),),
+}
+# usages whose ids only count as existing when present in every collection
+ID_MATCH_ALL = {'user_id'}
+# user ids have no random bits, a misconfigured ID_NODE_ID or a lost slot directory
+# would reissue them, so new ones are still checked against the database and kept
+# unique by the indexes `python -m db.migrations` creates
+ID_CHECKED = {'user_id'}
+ID_UNIQUE_INDEXES = ID_LOOKUPS['user_id']
+ID_INSERT_ATTEMPTS = int(os.getenv('ID_INSERT_ATTEMPTS', 3))
+
+# ids found missing are not looked up again for VERIFY_ID_NEGATIVE_TTL seconds. Ids
+# inserted by other processes in that window still read as missing, call
+# forget_missing_ids after inserting one to drop it from this process' cache
+VERIFY_ID_NEGATIVE_TTL = float(os.getenv('VERIFY_ID_NEGATIVE_TTL', 30))
+missing_ids = TTLCache(
+    max_entries=int(os.getenv('VERIFY_ID_CACHE_SIZE', 100_000)),
+    ttl=VERIFY_ID_NEGATIVE_TTL,
+)
+# ids per $in query, larger checks are split in chunks queried concurrently
+VERIFY_ID_BATCH_SIZE = int(os.getenv('VERIFY_ID_BATCH_SIZE', 1000))
+id_counters = {"ids": 0, "cached_missing": 0, "queries": 0, "saved_round_trips": 0}
+
+
+def verify_id_stats() -> dict:
+    """
+    Return the existence check counters and the negative cache stats, used by the
+    metrics endpoint.
+    """
+    data = dict(id_counters)
+    data["negative_cache"] = missing_ids.stats()
+    return data
+
+
+metrics.register('verify_id', verify_id_stats)
+
+
+async def find_ids(database, collection: str, field: str, ids: list) -> set:
+    """
+    Return the values of `ids` present in `field` of `collection`, in one $in query.
+    """
+    cursor = database[collection].find({field: {"$in": ids}}, {field: 1, "_id": 0})
+    return {document[field] for document in await cursor.to_list(length=None)}
+
+
+async def existing_ids(
+    ids: Iterable, usage: str = 'user_id', match_all: bool = None
+) -> set:
+    """
+    Check many ids at once, one $in query per collection of `usage` and chunk of
+    VERIFY_ID_BATCH_SIZE ids, all queried concurrently.
+
+    Ids found missing within the last VERIFY_ID_NEGATIVE_TTL seconds are answered from
+    the in-process negative cache without a query.
+
+    Args:
+        ids (Iterable): Candidate ids.
+        usage (str): 'user_id', 'game' or 'project_id'.
+        match_all (bool, optional): Count an id as existing only when present in every
+            collection, defaults to `usage` being in ID_MATCH_ALL.
+
+    Returns:
+        set: The ids that already exist.
+
+    Usage:
+        taken = await existing_ids(candidates, usage='game')
+
+    Example output:
+    {'a1B2c3D4e5F6g7H8'}
+    """
+    lookups = ID_LOOKUPS.get(usage, ())
+    ids = list(dict.fromkeys(ids))
+    unknown = [id for id in ids if (usage, id) not in missing_ids]
+    id_counters["ids"] += len(ids)
+    id_counters["cached_missing"] += len(ids) - len(unknown)
+    if not lookups or not unknown:
+        id_counters["saved_round_trips"] += len(ids) * len(lookups)
+        return set()
+    chunks = [
+        unknown[start : start + VERIFY_ID_BATCH_SIZE]
+        for start in range(0, len(unknown), VERIFY_ID_BATCH_SIZE)
+    ]
+    with timed('db'):
+        results = await asyncio.gather(
+            *(
+                find_ids(database, collection, field, chunk)
+                for database, collection, field in lookups
+                for chunk in chunks
+            )
+        )
+    # one set per collection, the union of its chunks
+    found = [
+        set().union(*results[index : index + len(chunks)])
+        for index in range(0, len(results), len(chunks))
+    ]
+    id_counters["queries"] += len(results)
+    id_counters["saved_round_trips"] += len(ids) * len(lookups) - len(results)
+    if match_all is None:
+        match_all = usage in ID_MATCH_ALL
+    anywhere = set.union(*found)
+    existing = set.intersection(*found) if match_all else anywhere
+    # only ids absent from every collection are cached, so the cache answers both kinds
+    # of match
+    for id in unknown:
+        if id not in anywhere:
+            missing_ids.set((usage, id), True)
+    return existing
+
+
+def forget_missing_ids(ids: Iterable, usage: str = 'user_id'):
+    """Drop ids this process just inserted from the negative cache."""
+    for id in ids:
+        missing_ids.pop((usage, id))
+
+
 async def verify_id(id, usage: str= 'user_id') -> bool:
-    if usage == 'user_id':
-        projection = {
-            "user_id": 1
-        }
-        existing_user = await mongo_user[user_collection].find_one({"user_id": id}, projection) and await mongo_user[waitlist_table_collection].find_one({"user_id": id}, projection)
-        if existing_user:
-            return True
-    elif usage == 'game':
-        projection = {
-            "game_id": 1
-        }
-        existing_id = await mongo_data[data_collection].find_one({"game_id": id}, projection)
-        if existing_id:
-            return True
-    elif usage == 'project_id':
-        projection = {
-            "project_id": 1
-        }
-        existing_project = await mongo_data[data_collection].find_one({"project_id": id}, projection)
-        if existing_project:
-            return True
-    return False
\ No newline at end of file
+    """Return True if `id` exists for `usage`, see existing_ids."""
+    return id in await existing_ids([id], usage)
+
+
+async def new_ids(usage: str, count: int = 1) -> list:
+    """
+    Return `count` new ids of `usage` from utils.ids.
+
+    Usages of ID_CHECKED are checked against every collection of ID_LOOKUPS in one
+    batched query per collection, ids already taken are dropped and replaced.
+
+    Usage:
+        user_ids = await new_ids('user_id', 100)
+
+    Example output:
+    ['1070596096', '1070596352']
+    """
+    ids = id_generator.generate_many(usage, count)
+    if usage not in ID_CHECKED:
+        return ids
+    for _ in range(ID_INSERT_ATTEMPTS):
+        taken = await existing_ids(ids, usage, match_all=False)
+        if not taken:
+            return ids
+        log_sink.emit(
+            40,
+            "ERROR",
+            {
+                "@fields": {"level": "Error"},
+                "@message": {
+                    "message": f"{len(taken)} generated {usage} ids already exist, "
+                    "check ID_NODE_ID and ID_SLOT_DIR",
+                    "ids": sorted(taken)[:10],
+                },
+            },
+        )
+        ids = [id for id in ids if id not in taken] + id_generator.generate_many(
+            usage, len(taken)
+        )
+    raise RuntimeError(f"could not generate unused {usage} ids")
+
+
+async def ensure_id_indexes() -> list:
+    """
+    Create the unique indexes of ID_UNIQUE_INDEXES, so a reissued id fails its insert
+    instead of duplicating a user.
+
+    A schema migration, run by `python -m db.migrations` and never on startup: building
+    an index on a large collection takes a while, and fails while duplicates are stored.
+
+    Returns:
+        list: The `collection.field` of every index that could not be created,
+            failures are logged.
+    """
+    failed = []
+    for database, collection, field in ID_UNIQUE_INDEXES:
+        try:
+            await database[collection].create_index(field, unique=True, sparse=True)
+        except Exception as e:
+            # e.g. duplicates already stored, the ids are still checked by new_ids
+            failed.append(f"{collection}.{field}")
+            log_sink.emit(
+                40,
+                "ERROR",
+                {
+                    "@fields": {"level": "Error"},
+                    "@message": {
+                        "id_index": f"{collection}.{field}",
+                        "error": f"{type(e).__name__}: {e}"[:500],
+                    },
+                },
+            )
+    return failed
+
+
+async def insert_with_id(
+    database,
+    collection: str,
+    document: dict,
+    usage: str = 'user_id',
+    field: str = 'user_id',
+):
+    """
+    Insert `document` with a new id of `usage` in `field`, retrying with another id on a
+    duplicate key.
+
+    Usage:
+        user_id = await insert_with_id(mongo_user, user_collection, {'email': email})
+
+    Example output:
+    '1070596096'
+    """
+    for attempt in range(ID_INSERT_ATTEMPTS):
+        document[field] = (await new_ids(usage))[0]
+        try:
+            await database[collection].insert_one(document)
+        except DuplicateKeyError as error:
+            duplicated = (error.details or {}).get('keyPattern') or {field: 1}
+            if field not in duplicated or attempt == ID_INSERT_ATTEMPTS - 1:
+                raise
+            document.pop('_id', None)
+            continue
+        forget_missing_ids([document[field]], usage)
+        return document[field]
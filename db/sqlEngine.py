@@ -2,10 +2,18 @@
 
 
 import datetime
+from itertools import islice
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Optional, Sequence
 from sqlalchemy import create_engine,text
 from sqlalchemy.ext.declarative import declarative_base
 import os
-    
+from utils import metrics
+from utils.timing import timed
+from db.routing import ReplicaSet, replica_urls, mark_primary_write, reads_from_primary
+from db.instrumentation import SQL_METRICS, sql_instrumentation, start_checkout_clock
+
 Base = declarative_base()
 
 DB_USER=os.getenv("DB_USER")
@@ -14,62 +22,411 @@ DB_IP=os.getenv("DB_IP")
 DB_NAME=os.getenv("DB_NAME")
 DB_PORT=os.getenv("DB_PORT")
 SQLALCHEMY_DATABASE_URL_DEV = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_IP}:{DB_PORT}/{DB_NAME}"
+# full URL override, e.g. sqlite:///local.db for local runs
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "SQLALCHEMY_DATABASE_URL", SQLALCHEMY_DATABASE_URL_DEV
+)
+# comma separated read replica URLs, reads go to the primary when empty
+SQLALCHEMY_REPLICA_URLS = replica_urls(os.getenv("SQLALCHEMY_REPLICA_URLS"))
+# round_robin or least_busy
+SQL_REPLICA_STRATEGY = os.getenv("SQL_REPLICA_STRATEGY", "round_robin")
+SQL_TEXT_CACHE_SIZE = int(os.getenv("SQL_TEXT_CACHE_SIZE", "512"))
+
+# SQL_ECHO=1 logs every statement, off by default in production
+ECHO = (
+    os.getenv("SQL_ECHO", "0" if os.getenv("ENVIRONMENT") == "PRODUCTION" else "1")
+    == "1"
+)
+
+
+def pool_options(url: str) -> dict:
+    """
+    Pool settings for server databases, sized by SQL_POOL_* variables. SQLite (local
+    runs and tests) keeps its default pool.
+    """
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_use_lifo": True,
+        "pool_pre_ping": True,
+        "pool_size": int(os.getenv("SQL_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("SQL_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("SQL_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("SQL_POOL_RECYCLE", -1)),
+    }
 
-ECHO=True
-if os.environ["ENVIRONMENT_PATH"]=="PRODUCTION":
-    ECHO=False
 
 db = create_engine(
-    SQLALCHEMY_DATABASE_URL_DEV,echo=ECHO,json_serializer=True, pool_use_lifo=True, pool_pre_ping=True
+    SQLALCHEMY_DATABASE_URL,
+    echo=ECHO,
+    json_serializer=True,
+    **pool_options(SQLALCHEMY_DATABASE_URL),
+)
+replicas = ReplicaSet(
+    [
+        create_engine(url, echo=ECHO, **pool_options(url))
+        for url in SQLALCHEMY_REPLICA_URLS
+    ],
+    SQL_REPLICA_STRATEGY,
 )
 
+# text() parses the bind parameters out of the string on every call, the construct is
+# reused per query string
+sql_text = lru_cache(maxsize=SQL_TEXT_CACHE_SIZE)(text)
+
+
+def routing_stats() -> dict:
+    """
+    Return the replica routing and text() cache counters, used by the metrics endpoint.
+    """
+    cache = sql_text.cache_info()
+    data = replicas.stats()
+    data["text_cache"] = {
+        "entries": cache.currsize,
+        "max_entries": cache.maxsize,
+        "hits": cache.hits,
+        "misses": cache.misses,
+    }
+    return data
+
+
+metrics.register('sql_routing', routing_stats)
+
+if SQL_METRICS:
+    sql_instrumentation.instrument(db, "primary")
+    for number, engine in enumerate(replicas.engines, 1):
+        sql_instrumentation.instrument(engine, f"replica-{number}")
+    metrics.register('sql', sql_instrumentation.stats)
+
+
+def datetime_columns(rows: list, width: int) -> list:
+    """
+    Indexes of the columns holding datetimes, judged on the first non-NULL value of each
+    column.
+    """
+    pending = set(range(width))
+    found = []
+    for row in rows:
+        for index in list(pending):
+            value = row[index]
+            if value is not None:
+                pending.discard(index)
+                if isinstance(value, datetime.datetime):
+                    found.append(index)
+        if not pending:
+            break
+    return found
+
+
+def serialize_rows(keys: list, rows: list) -> list:
+    """
+    Turn result rows (tuples) into dicts, datetimes as strings.
+
+    Column types are checked once per result set, rows are zipped with the keys by C
+    code and only the datetime columns are then converted, column by column.
+
+    Example output:
+    [{'id': 1, 'name': 'a', 'created': '2024-08-05 10:00:00'}]
+    """
+    data = [dict(zip(keys, row)) for row in rows]
+    for index in (datetime_columns(rows, len(keys)) if rows else ()):
+        column = keys[index]
+        for item in data:
+            value = item[column]
+            if isinstance(value, datetime.datetime):
+                item[column] = str(value)
+    return data
+
+
+def insert_statement(
+    dialect,
+    table: str,
+    columns: Sequence[str],
+    rows: Optional[int] = None,
+    update_columns: Optional[Sequence[str]] = None,
+    conflict_keys: Optional[Sequence[str]] = None,
+) -> str:
+    """
+    Build an INSERT for `columns` of `table`, identifiers quoted for the dialect.
+
+    Args:
+        dialect: The engine dialect.
+        table (str): Table name.
+        columns (Sequence[str]): Inserted columns, bound as :column.
+        rows (int, optional): Multi-row VALUES with this many rows, bound as :column_0,
+            :column_1... None builds a one-row statement for executemany.
+        update_columns (Sequence[str], optional): Upsert, columns updated when the row
+            exists (ON DUPLICATE KEY UPDATE on MySQL, ON CONFLICT DO UPDATE elsewhere).
+        conflict_keys (Sequence[str], optional): Unique columns of the ON CONFLICT
+            target, not used on MySQL.
+
+    Example output:
+    'INSERT INTO users (id, name) VALUES (:id, :name)
+    ON DUPLICATE KEY UPDATE name = VALUES(name)'
+    """
+    quote = dialect.identifier_preparer.quote
+    names = ", ".join(quote(column) for column in columns)
+    if rows is None:
+        values = "(" + ", ".join(f":{column}" for column in columns) + ")"
+    else:
+        values = ", ".join(
+            "(" + ", ".join(f":{column}_{index}" for column in columns) + ")"
+            for index in range(rows)
+        )
+    statement = f"INSERT INTO {quote(table)} ({names}) VALUES {values}"
+    if update_columns:
+        if dialect.name in ("mysql", "mariadb"):
+            statement += " ON DUPLICATE KEY UPDATE " + ", ".join(
+                f"{quote(column)} = VALUES({quote(column)})"
+                for column in update_columns
+            )
+        else:
+            if not conflict_keys:
+                raise ValueError(
+                    f"conflict_keys are required for upserts on {dialect.name}"
+                )
+            target = ', '.join(quote(key) for key in conflict_keys)
+            statement += (
+                f" ON CONFLICT ({target}) DO UPDATE SET "
+                + ", ".join(
+                    f"{quote(column)} = excluded.{quote(column)}"
+                    for column in update_columns
+                )
+            )
+    return statement
+
+
+def insert_batches(rows: Iterable[dict], batch_size: int):
+    """
+    Split `rows` into lists of `batch_size`, checking every row has the columns of the
+    first one.
+    """
+    iterator = iter(rows)
+    columns = None
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        if columns is None:
+            columns = batch[0].keys()
+        for row in batch:
+            if row.keys() != columns:
+                raise ValueError(
+                    f"every row needs the columns {sorted(columns)}, got {sorted(row)}"
+                )
+        yield list(columns), batch
+
+
+def multirow_params(columns: Sequence[str], batch: list) -> dict:
+    """
+    Flatten a batch into the :column_index parameters of a multi-row VALUES statement.
+    """
+    return {
+        f"{column}_{index}": row[column]
+        for index, row in enumerate(batch)
+        for column in columns
+    }
+
+
 class DbExecute(object):
+    """
+    Runs raw SQL on the engine, each call on its own pooled connection.
+
+    Reads run on a plain connection, writes in a transaction committed when the
+    statement succeeded and rolled back otherwise. Inside `transaction()` every call
+    shares one connection and one transaction.
+
+    With SQLALCHEMY_REPLICA_URLS set, fetchall/fetchone/iter_rows go to a read replica
+    chosen by SQL_REPLICA_STRATEGY and writes to the primary. Once a request has written
+    (or opened a transaction), its later reads go to the primary too, so it reads its
+    own writes.
+
+    Usage:
+        query = "SELECT * FROM users WHERE id = :id"
+        rows = DbExecute().fetchall(query, {"id": 1}).data
+        with DbExecute().transaction() as tx:
+            charge = "UPDATE users SET credits = credits - 1 WHERE id = :id"
+            tx.update(charge, {"id": 1})
+            tx.insert("INSERT INTO usage (user_id) VALUES (:id)", {"id": 1})
+    """
+
     def __init__(self) -> None:
         self.engine=db
+        self.replicas = replicas
+        self.connection = None
         self.status=False
         self.data=[]
-    
+
     def del_engine(self):
         del self.engine
 
+    @contextmanager
+    def transaction(self):
+        """Run every call made on the yielded DbExecute in one transaction."""
+        mark_primary_write()
+        start_checkout_clock()
+        with self.engine.begin() as connection:
+            self.connection = connection
+            try:
+                yield self
+            finally:
+                self.connection = None
+
+    @contextmanager
+    def connect(self, write: bool):
+        """
+        Yield the connection to run a statement on: the transaction's, or a new one.
+
+        Writes get a transaction on the primary, reads a connection to a replica unless
+        the request already wrote.
+        """
+        if self.connection is not None:
+            yield self.connection
+            return
+        if write:
+            mark_primary_write()
+            start_checkout_clock()
+            with self.engine.begin() as connection:
+                yield connection
+        elif self.replicas and not reads_from_primary():
+            with self.replicas.checkout() as engine:
+                start_checkout_clock()
+                with engine.connect() as connection:
+                    yield connection
+        else:
+            start_checkout_clock()
+            with self.engine.connect() as connection:
+                yield connection
+
+    def bulk_insert(
+        self,
+        table,
+        rows,
+        batch_size=1000,
+        update_columns=None,
+        conflict_keys=None,
+        multirow=False,
+        commit_per_batch=True,
+    ):
+        """
+        Insert or upsert any iterable of row dicts (a generator works) in batches.
+
+        Args:
+            table (str): Table name.
+            rows (Iterable[dict]): Rows, all with the same columns.
+            batch_size (int): Rows per statement. With `multirow`, batch_size * columns
+                must stay under the driver's bind parameter limit (32766 on SQLite,
+                65535 on MySQL).
+            update_columns (list, optional): Upsert, columns updated when the row
+                already exists.
+            conflict_keys (list, optional): Unique columns identifying existing rows,
+                needed except on MySQL.
+            multirow (bool): One INSERT ... VALUES (...), (...) per batch instead of
+                executemany.
+            commit_per_batch (bool): Commit after every batch, or all batches in one
+                transaction. Inside `transaction()` the surrounding transaction is
+                always used.
+
+        Sets `batches` to the rows written per batch and `rows_effected` to their total.
+
+        Usage:
+            rows = ({"id": i, "name": n} for i, n in source)
+            DbExecute().bulk_insert(
+                "users", rows, update_columns=["name"], conflict_keys=["id"]
+            )
+        """
+        self.batches = []
+        self.rows_effected = 0
+        statements = {}
+        scope = (
+            nullcontext()
+            if commit_per_batch or self.connection is not None
+            else self.transaction()
+        )
+        with scope:
+            for columns, batch in insert_batches(rows, batch_size):
+                size = len(batch) if multirow else None
+                if size not in statements:
+                    statements[size] = sql_text(
+                        insert_statement(
+                            self.engine.dialect,
+                            table,
+                            columns,
+                            size,
+                            update_columns,
+                            conflict_keys,
+                        )
+                    )
+                with self.connect(write=True) as connection:
+                    with timed('db'):
+                        connection.execute(
+                            statements[size],
+                            multirow_params(columns, batch) if multirow else batch,
+                        )
+                self.batches.append(len(batch))
+                self.rows_effected += len(batch)
+        self.status = True
+        return self
+
     def fetchall(self,query,valuelist):
-        result=db.execute(text(query),valuelist)
-        self.del_engine()
-        result=result.mappings().all()
-        self.data=result if result else []
+        with self.connect(write=False) as connection:
+            with timed('db'):
+                result = connection.execute(sql_text(query), valuelist)
+            keys = list(result.keys())
+            rows = result.all()
+        self.data = serialize_rows(keys, rows)
         if len(self.data)>0:
-            for index,row in enumerate(self.data):
-                self.data[index]={column: str(getattr(row, column)) if  isinstance(getattr(row, column), datetime.datetime) else getattr(row, column)   for column in row._keymap.keys()}
             self.status=True
-            return self
-        else:
-            return self
-    
+        return self
+
     def fetchone(self,query,valuelist):
-        result=db.execute(text(query),valuelist)
-        self.del_engine()
-        result=result.mappings().fetchone()
-        self.data=result if result else {}
+        with self.connect(write=False) as connection:
+            with timed('db'):
+                result = connection.execute(sql_text(query), valuelist)
+            keys = list(result.keys())
+            row = result.fetchone()
+        self.data = serialize_rows(keys, [row])[0] if row else {}
         if self.data:
-            
-            self.data={column: str(getattr(self.data, column)) if  isinstance(getattr(self.data, column), datetime.datetime) else getattr(self.data, column)   for column in self.data._keymap.keys()}
             self.status=True
-            return self
-        else:
-            return self
-    
+        return self
+
+    def iter_rows(self, query, valuelist, chunk_size=1000):
+        """
+        Yield the rows of a large result one by one from a server-side cursor,
+        `chunk_size` rows in memory at a time.
+
+        The connection stays checked out until the generator is exhausted or closed.
+
+        Usage:
+            for row in DbExecute().iter_rows("SELECT * FROM events", {}):
+                ...
+            items = DbExecute().iter_rows(query, values)
+            return StreamingCustomResponse(request=request, items=items).respond()
+        """
+        with self.connect(write=False) as connection:
+            with timed('db'):
+                result = connection.execution_options(
+                    stream_results=True, yield_per=chunk_size
+                ).execute(sql_text(query), valuelist)
+            keys = list(result.keys())
+            for rows in result.partitions(chunk_size):
+                self.status = True
+                yield from serialize_rows(keys, rows)
+
     # Function to update fields in a table.
     def update(self,query,valuelist):
-        result=db.execute(text(query),valuelist)
-        self.del_engine()
+        with self.connect(write=True) as connection:
+            with timed('db'):
+                result = connection.execute(sql_text(query), valuelist)
         self.status=True
         self.rows_effected = result.rowcount
         return self
-  
+
     # Function to insert single or multiple rows in a table. For single row-entry valueList should be dictonary and for multiple rows-entry valueList should be list containing multiple dictonary.
-    def insert(self,query,valuelist):     
-        result=db.execute(text(query),valuelist)
-        self.del_engine()
+    def insert(self, query, valuelist):
+        with self.connect(write=True) as connection:
+            with timed('db'):
+                result = connection.execute(sql_text(query), valuelist)
         self.status=True
         self.rows_effected = result.rowcount
-        return self
\ No newline at end of file
+        return self
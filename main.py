@@ -1,14 +1,17 @@
 import os
-from fastapi import FastAPI, Depends
+import hmac
+import math
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from dotenv import load_dotenv
 # import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
-from routers.demo.demo import DEMO_ROUTE
-
 
 path=os.getenv('ENVIRONMENT')
 if path:
@@ -30,6 +33,8 @@ if path:
 else:
     raise RuntimeError('Missing  Environment')
 
+# first-party modules read their settings (ID_*, RATE_LIMIT_*, LOG_*, RESPONSE_*, ...)
+# when imported, so every one of them is imported after the environment file is loaded
 load_dotenv(dotenv_path=str(os.getenv('ENVIRONMENT_PATH')))
 
 # if os.getenv('ENVIRONMENT')=="PRODUCTION" or os.getenv('ENVIRONMENT')=="STAGING":
@@ -45,33 +50,93 @@ load_dotenv(dotenv_path=str(os.getenv('ENVIRONMENT_PATH')))
 #         environment=str(os.getenv("ENVIRONMENT"))
 #     )
 
-from middleware.middleware import *
-from utils.invalid_response_class import *
-from utils.response_manipulator import CustomResponse
-from utils.logging import init_logging
+from routers.demo.demo import DEMO_ROUTE  # noqa: E402
+from middleware.middleware import *  # noqa: E402
+from middleware.middleware import (  # noqa: E402
+    CompressionMiddleware,
+    RequestContextMiddleware,
+)
+from utils.invalid_response_class import *  # noqa: E402
+from utils.response_manipulator import CustomResponse  # noqa: E402
+from utils.logging import init_logging  # noqa: E402
+from utils import metrics  # noqa: E402
+from utils.timer_wheel import timer_wheel  # noqa: E402
+from utils.compression import StaticAssets  # noqa: E402
+from db.mongoEngine import mongo  # noqa: E402
+from utils.ids import id_generator  # noqa: E402
 
 init_logging()
+metrics.register('timer_wheel', timer_wheel.stats)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # refuse to start without ID_SLOT_DIR / ID_NODE_ID rather than fail on the first id
+    id_generator.start()
+    timer_wheel.start()
+    static_assets.load()
+    # warm the Mongo pools before serving, /readiness retries in the background if
+    # MongoDB was not reachable (the unique user_id indexes are created by
+    # `python -m db.migrations`, not on startup)
+    await mongo.start()
+    yield
+    mongo.close()
+    timer_wheel.stop()
+
 if path == "PRODUCTION":
-    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, title="Backend", version="1.0.0")
+    app = FastAPI(
+        docs_url=None,
+        redoc_url=None,
+        openapi_url=None,
+        title="Backend",
+        version="1.0.0",
+        lifespan=lifespan,
+    )
 else:
-    app = FastAPI(title="Backend", version="1.0.0")
+    app = FastAPI(title="Backend", version="1.0.0", lifespan=lifespan)
 
+# innermost, so CORS preflight requests are answered before authentication
+app.add_middleware(
+    RequestContextMiddleware, protected_prefixes=['/backend'], public_paths=[]
+)
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(SentryAsgiMiddleware)
- 
+
 
 app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.include_router(DEMO_ROUTE, prefix='/backend', tags=["Demo/Health Checks"],dependencies=[Depends(create_request_id), Depends(authorisation)] )
-# app.include_router(EXCLUDE_ROUTE, prefix='/backend', tags=["Exclude Paths"], dependencies=[Depends(create_request_id)] )
+# request id, request log and auth come from RequestContextMiddleware, list auth-free
+# routes in its public_paths
+app.include_router(DEMO_ROUTE, prefix='/backend', tags=["Demo/Health Checks"])
+# app.include_router(EXCLUDE_ROUTE, prefix='/backend', tags=["Exclude Paths"])
+
+# public/ is served from memory, compressed once on startup
+static_assets = StaticAssets('public')
+app.mount('/public', static_assets, name='public')
 
 
 # @app.exception_handler(CreditInsufficientError)
 # async def credit_insufficient_error(request: Request, exc: CreditInsufficientError):
 #     return CustomResponse(request=request, resp_code='CREDIT_402_INSUFFICIENT_CREDITS',  details={"available_credits": exc.details['data']['available_credits']}).respond()
 
+
+@app.exception_handler(404)
+async def not_found(request: Request, exc: StarletteHTTPException):
+    # browsers get the public/404.html page, API clients the usual JSON
+    if 'text/html' in request.headers.get('accept', ''):
+        response = static_assets.response(
+            '/404.html', request.headers.get('accept-encoding', ''), status_code=404
+        )
+        if response is not None:
+            return response
+    return JSONResponse(
+        {"detail": exc.detail}, status_code=404, headers=getattr(exc, 'headers', None)
+    )
+
+
 @app.exception_handler(AuthenticationError)
 async def invalidation_exception_handler(request: Request, exc: AuthenticationError):
     return CustomResponse(resp_code='HTTP_401_UNAUTHORIZED', message=exc.message, request=request).respond()
-    
+
 @app.exception_handler(AuthenticationMissing)
 async def internal_server_error(request: Request, exc: AuthenticationMissing):
     return CustomResponse(resp_code='HTTP_401_AUTHORIZATION_MISSING', request=request).respond()
@@ -87,7 +152,17 @@ async def internal_server_error(request: Request, exc: InternalServerError):
 
 @app.exception_handler(RequestTimeoutError)
 async def internal_server_error(request: Request, exc: RequestTimeoutError):
-    return CustomResponse(resp_code='HTTP_429_TOO_MANY_REQUEST', request=request).respond()
+    if exc.retry_after is None:
+        return CustomResponse(
+            resp_code='HTTP_429_TOO_MANY_REQUEST', request=request
+        ).respond()
+    response = CustomResponse(
+        resp_code='HTTP_429_TOO_MANY_REQUEST',
+        request=request,
+        details={"retry_after": round(exc.retry_after, 3)},
+    ).respond()
+    response.headers['Retry-After'] = str(math.ceil(exc.retry_after))
+    return response
 
 
 
@@ -100,3 +175,41 @@ async def read_root():
 async def ping():
     return {"status":True,
             "message": "server health ok",}
+
+
+@app.get('/readiness', tags=['system'])
+async def readiness():
+    # answers from the cached state, a failed warmup is retried without holding the
+    # probe
+    if not mongo.ready:
+        mongo.start_in_background()
+        return JSONResponse(
+            {"status": False, "message": "mongo unavailable"}, status_code=503
+        )
+    return {
+        "status": True,
+        "message": "server ready",
+    }
+
+# /metrics shows pool, cache, limiter and query internals: it is only served when
+# METRICS_ENABLED=1 (the default outside PRODUCTION) and, if METRICS_TOKEN is set, to
+# "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ENABLED = (
+    os.getenv('METRICS_ENABLED', '0' if path == 'PRODUCTION' else '1') == '1'
+)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+if METRICS_ENABLED:
+    @app.get('/metrics', tags=['system'])
+    async def read_metrics(request: Request):
+        if METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get('authorization', '').encode(),
+            f"Bearer {METRICS_TOKEN}".encode(),
+        ):
+            return CustomResponse(
+                resp_code='HTTP_401_UNAUTHORIZED', request=request
+            ).respond()
+        return {
+            "status": True,
+            "metrics": metrics.snapshot(),
+        }
@@ -1,71 +1,316 @@
 import os
+import time
 import uuid
-from fastapi import Depends, Request
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
-from utils.helpers import current_datetime
-from utils.invalid_response_class import AuthenticationError, AuthenticationMissing
+from typing import Sequence
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from jose import JWTError
+from utils.auth import verify_jwt_token
+from utils.timing import start_request_timer, timed
+from db.routing import start_request_routing
+from utils.compression import compress, compress_stream, negotiate_encoding
 from utils.logData import LogDataClass
-from utils.exception import CustomException
+from utils.response_manipulator import CustomResponse
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = "HS256"
-security = HTTPBearer(auto_error=False)
 
-async def create_request_id(request: Request):
+class RequestContextMiddleware:
     """
-    Generate or retrieve a unique request ID and log the request data.
-    
-    Uses 'X-Request-ID' header if available; otherwise generates a UUID. 
-    Captures the start time and logs the request details.
+    Pure ASGI middleware setting up the request context in one pass over the scope.
+
+    Requests under `protected_prefixes` get `request.state.request_token` and
+    `request.state.timer`, are logged and must carry a valid bearer token, whose subject
+    is stored in `request.state.user_data`, unless their path is listed in
+    `public_paths`. Other requests (health checks, docs, metrics) are passed through
+    untouched. The request timer phases (auth, handler and whatever the handler records
+    with `timed`) are sent back in a `Server-Timing` header. Each request starts with
+    its own SQL routing state, so its reads go to the primary once it has written. Each
+    request produces one access log record: request metadata is collected on entry,
+    `CustomResponse.respond` (including in the exception handlers) and
+    `InternalServerError` add the response and the error to it, and it is written once
+    the response is sent or the request failed.
 
     Args:
-        request (Request): The incoming HTTP request.
+        app: The wrapped ASGI application.
+        protected_prefixes (Sequence[str]): Path prefixes that are logged and
+            authenticated.
+        public_paths (Sequence[str]): Paths under those prefixes that skip
+            authentication.
 
-    Raises:
-        CustomException: If logging or processing fails.
+    Usage:
+        app.add_middleware(
+            RequestContextMiddleware,
+            protected_prefixes=['/backend'],
+            public_paths=['/backend/login'],
+        )
     """
-    try:
-        request_id = request._headers.get('X-Request-ID')
-        if request_id:
-            request.state.request_token = str(request_id)
-        else:
-            request_id = str(uuid.uuid4())
-            request.state.request_token = request_id
-        
-        # Capture the start time
-        request.state.start_time = str(current_datetime())
-        
-        log = await LogDataClass(request_id=request_id).request_log(request)
-    except:
-        raise CustomException().raise_exception(request_id=request.state.request_token)
-
-async def authorisation(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+
+    def __init__(
+        self,
+        app,
+        protected_prefixes: Sequence[str] = ('/backend',),
+        public_paths: Sequence[str] = (),
+    ):
+        self.app = app
+        self.protected_prefixes = tuple(protected_prefixes)
+        self.public_paths = frozenset(public_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(
+            self.protected_prefixes
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+        request_id = request_id or str(uuid.uuid4())
+
+        state = scope.setdefault("state", {})
+        state["request_token"] = request_id
+        state["timer"] = timer = start_request_timer()
+        start_request_routing()
+
+        path = scope["path"]
+        request = Request(scope, receive)
+        log = LogDataClass(request_id=request_id).start_request()
+        await log.add_request(request)
+        body = getattr(request, "_body", None)
+        if body is not None:
+            # the body prefix was read for the log, replay it to the application
+            receive = replay_body(body, receive)
+
+        if path not in self.public_paths:
+            with timed('auth'):
+                response = self.authenticate(request, authorization)
+            if response is not None:
+                await response(scope, receive, send)
+                log.flush(timer, response.status_code, len(response.body))
+                return
+
+        status = {"code": None, "size": 0}
+        handler_start = time.perf_counter_ns()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                timer.add('handler', time.perf_counter_ns() - handler_start)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timer.server_timing().encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body":
+                status["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            # unhandled, ServerErrorMiddleware turns it into a 500 outside of this
+            # middleware
+            log.add_error(
+                {"exception_type": type(e).__name__, "exception_object": str(e)}
+            )
+            log.flush(timer, status["code"] or 500, status["size"])
+            raise
+        log.flush(timer, status["code"], status["size"])
+
+    def authenticate(self, request: Request, authorization: str):
+        """
+        Store the token subject in the request state, or return the 401 response to
+        send.
+        """
+        scheme, _, token = (authorization or "").partition(" ")
+        if not token or scheme.lower() != "bearer":
+            return CustomResponse(
+                resp_code='HTTP_401_AUTHORIZATION_MISSING', request=request
+            ).respond()
+        try:
+            payload = verify_jwt_token(token)
+        except JWTError:
+            return CustomResponse(
+                resp_code='HTTP_401_UNAUTHORIZED',
+                message="Invalid or expired token",
+                request=request,
+            ).respond()
+        request.state.user_data = payload.get("sub")
+        return None
+
+
+def replay_body(body: bytes, receive):
+    """Return a receive callable yielding `body` first, then the original messages."""
+    sent = False
+
+    async def receive_wrapper():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return receive_wrapper
+
+
+class CompressionMiddleware:
     """
-    Validate JWT from Authorization header and extract user ID.
-    
-    Checks for a valid JWT token in the Authorization header. If valid, 
-    stores the user ID in request state; raises exceptions if invalid.
+    Pure ASGI middleware compressing responses with the best encoding the client
+    accepts.
+
+    gzip is always available, br and zstd when the brotli and zstandard packages are
+    installed (see utils.compression). Only responses with a content type in
+    `content_types`, without a Content-Encoding yet and of at least `minimum_size` bytes
+    are compressed. Streamed responses (StreamingCustomResponse, SSE) are compressed
+    chunk by chunk with a flush after each chunk, so clients receive every chunk as soon
+    as it is sent. Bodies larger than `threadpool_size` are compressed in the threadpool
+    to keep the event loop responsive. Compression runs after the Server-Timing header
+    was rendered, so its time is part of `total` in the request log only. Strong ETags
+    of compressed responses are turned into weak ones; If-None-Match still matches them.
 
     Args:
-        request (Request): The incoming HTTP request.
-        credentials (HTTPAuthorizationCredentials): JWT token from the header.
+        app: The wrapped ASGI application.
+        minimum_size (int): Smaller bodies are sent uncompressed.
+        content_types (Sequence[str]): Media types to compress, a trailing `/` matches a
+            whole family.
+        threadpool_size (int): Bodies at least this large are compressed off the event
+            loop.
+
+    Usage:
+        app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = int(os.getenv('COMPRESSION_MIN_BYTES', 1024)),
+        content_types: Sequence[str] = (
+            'application/json',
+            'application/x-ndjson',
+            'text/',
+            'application/javascript',
+            'image/svg+xml',
+        ),
+        threadpool_size: int = 256 * 1024,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+        self.threadpool_size = threadpool_size
+
+    def compressible(self, headers) -> bool:
+        content_type = ""
+        for name, value in headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").partition(";")[0].strip().lower()
+        return any(
+            content_type == allowed
+            or (allowed.endswith('/') and content_type.startswith(allowed))
+            for allowed in self.content_types
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        headers = None
+        stream = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, headers, stream
+            if message["type"] == "http.response.start":
+                if not self.compressible(message.get("headers", [])):
+                    await send(message)
+                    return
+                # held until the first body chunk tells if it is worth compressing
+                start_message = message
+                headers = compressed_headers(start_message.get("headers", []), encoding)
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                if not more_body:
+                    # complete body in one message
+                    if len(body) < self.minimum_size:
+                        await send(start_message)
+                        start_message = None
+                        await send(message)
+                        return
+                    if len(body) >= self.threadpool_size:
+                        compressed = await run_in_threadpool(compress, encoding, body)
+                    else:
+                        compressed = compress(encoding, body)
+                    await send(
+                        dict(
+                            start_message,
+                            headers=headers
+                            + [(b"content-length", str(len(compressed)).encode())],
+                        )
+                    )
+                    start_message = None
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": compressed,
+                            "more_body": False,
+                        }
+                    )
+                    return
+                stream = compress_stream(encoding)
+                await send(dict(start_message, headers=headers))
+            chunk = stream.compress(body) if body else b""
+            if not more_body:
+                chunk += stream.finish()
+            await send(
+                {"type": "http.response.body", "body": chunk, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def compressed_headers(headers, encoding: str) -> list:
+    """
+    Return the response headers for the `encoding` representation, without
+    Content-Length.
+
+    A strong ETag names the uncompressed bytes, so it is only kept as weak, and
+    Accept-Encoding is merged into an existing Vary header instead of being repeated.
 
-    Raises:
-        AuthenticationMissing: If the Authorization header is missing.
-        AuthenticationError: If the token is invalid or expired.
-        CustomException: For general exceptions during processing.
+    Example output:
+    [(b'content-type', b'application/json'), (b'etag', b'W/"1a2b"'),
+     (b'content-encoding', b'gzip'), (b'vary', b'Origin, Accept-Encoding')]
     """
-    if credentials is None:
-        raise AuthenticationMissing("Authorization header is missing")
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        
-        request.state.user_data = user_id
-        
-    except JWTError:
-        raise AuthenticationError("Invalid or expired token")
-    except Exception as e:
-        raise CustomException().raise_exception(request_id=request.state.request_token)
+    result = []
+    vary = []
+    for name, value in headers:
+        if name == b"content-length":
+            continue
+        if name == b"vary":
+            vary += [token.strip() for token in value.split(b",") if token.strip()]
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        result.append((name, value))
+    if not any(token.lower() in (b"accept-encoding", b"*") for token in vary):
+        vary.append(b"Accept-Encoding")
+    return result + [
+        (b"content-encoding", encoding.encode()),
+        (b"vary", b", ".join(vary)),
+    ]
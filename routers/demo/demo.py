@@ -7,13 +7,14 @@ from utils.response_manipulator import CustomResponse
 from utils.exception import CustomException
 from utils.rate_limiter import RateLimiter
 from utils.logData import LogDataClass
+from utils.response_cache import cached
 
 DEMO_ROUTE = APIRouter(dependencies=[Depends(RateLimiter())] )
 
 @DEMO_ROUTE.post('/demo' )
 def demo(request: Request ):
     try:
-        
+
         log=LogDataClass(Request)
         # Dummy Response
         time.sleep(1)
@@ -22,6 +23,17 @@ def demo(request: Request ):
         }
         log.general_AI_log(data)
         return CustomResponse(resp_code='HTTP_200_SUCCESS', data=data, message='Success', request=request).respond()
-        
+
     except:
-        raise CustomException().raise_exception(request_id=request.state.request_token)
\ No newline at end of file
+        raise CustomException().raise_exception(request_id=request.state.request_token)
+
+
+@DEMO_ROUTE.get('/demo')
+@cached(ttl=30, stale_ttl=60, tags=['demo'])
+async def demo_status(request: Request):
+    # served from the response cache for 30s, call response_cache.invalidate('demo')
+    # after a write
+    data = {"resp": "Success"}
+    return CustomResponse(
+        resp_code='HTTP_200_SUCCESS', data=data, request=request
+    ).respond()
@@ -17,6 +17,12 @@ else
     exit 1
 fi
 
+# every host running this image needs its own ID_NODE_ID (0-15), see utils/ids.py
+if [ -z "$ID_NODE_ID" ]; then
+    echo "Error: ID_NODE_ID is not set, export a node id unique to this host."
+    exit 1
+fi
+
 echo "Delete old container..."
 sudo docker rm -f $containerName
 echo "Delete old image..."
@@ -26,4 +32,5 @@ DOCKER_BUILDKIT=1
 sudo docker build -t $imageName . -f $dockerfilePath
 
 echo "Running container for $ENVIRONMENT environment on port $portMapping..."
-sudo docker run -e ENVIRONMENT=$ENVIRONMENT -d -p $portMapping --name $containerName $imageName
+# the named volume keeps the id slot files across container replacements
+sudo docker run -e ENVIRONMENT=$ENVIRONMENT -e ID_NODE_ID=$ID_NODE_ID -v $containerName-id-slots:/data/id-slots -d -p $portMapping --name $containerName $imageName
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the tests import the application packages (utils, db, middleware) from the repository
+# root
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
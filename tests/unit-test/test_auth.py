@@ -0,0 +1,23 @@
+import unittest
+from unittest import mock
+
+from utils import auth
+
+
+class TestVerifyJwtToken(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(auth, "SECRET_KEY", "test-secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth.jwt_cache.clear()
+
+    def test_cached_claims_are_not_shared(self):
+        token = auth.create_jwt_token("user-1")
+        hits = auth.jwt_cache.stats()["hits"]
+        first = auth.verify_jwt_token(token)
+        first["sub"] = "someone-else"
+        second = auth.verify_jwt_token(token)
+        self.assertEqual(second["sub"], "user-1")
+        second["admin"] = True
+        self.assertNotIn("admin", auth.verify_jwt_token(token))
+        self.assertEqual(auth.jwt_cache.stats()["hits"] - hits, 2)
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite://")
+os.environ.setdefault("SQLALCHEMY_ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("SQL_ECHO", "0")
+
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+from db.routing import ReplicaSet, start_request_routing  # noqa: E402
+from db.asyncSqlEngine import AsyncDbExecute  # noqa: E402
+
+
+def rows(count: int, name: str = "event", start: int = 0):
+    return (
+        {"id": row, "name": f"{name}-{row}", "score": row * 0.5}
+        for row in range(start, start + count)
+    )
+
+
+class TestAsyncBulkInsert(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_async_engine(
+            f"sqlite+aiosqlite:///{os.path.join(self.directory, 'bulk.db')}"
+        )
+        start_request_routing()
+        await self.executor().update(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, name TEXT, score REAL)", {}
+        )
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def executor(self) -> AsyncDbExecute:
+        executor = AsyncDbExecute()
+        executor.engine = self.engine
+        executor.replicas = ReplicaSet([])
+        return executor
+
+    async def count(self, where: str = "1 = 1") -> int:
+        return (
+            await self.executor().fetchone(
+                f"SELECT count(*) AS total FROM events WHERE {where}", {}
+            )
+        ).data["total"]
+
+    async def test_executemany_batches(self):
+        result = await self.executor().bulk_insert(
+            "events", rows(2500), batch_size=1000
+        )
+        self.assertEqual(result.batches, [1000, 1000, 500])
+        self.assertEqual(result.rows_effected, 2500)
+        self.assertEqual(await self.count(), 2500)
+
+    async def test_multirow_values(self):
+        result = await self.executor().bulk_insert(
+            "events", rows(1200), batch_size=500, multirow=True
+        )
+        self.assertEqual(result.batches, [500, 500, 200])
+        self.assertEqual(await self.count(), 1200)
+        row = (
+            await self.executor().fetchone(
+                "SELECT * FROM events WHERE id = :id", {"id": 1199}
+            )
+        ).data
+        self.assertEqual(row, {"id": 1199, "name": "event-1199", "score": 599.5})
+
+    async def test_upsert_updates_existing_rows(self):
+        await self.executor().bulk_insert("events", rows(100))
+        for multirow in (False, True):
+            await self.executor().bulk_insert(
+                "events",
+                rows(150, name=f"updated-{multirow}"),
+                batch_size=40,
+                multirow=multirow,
+                update_columns=["name"],
+                conflict_keys=["id"],
+            )
+            self.assertEqual(await self.count(), 150)
+            self.assertEqual(await self.count(f"name LIKE 'updated-{multirow}-%'"), 150)
+
+    async def test_upsert_needs_conflict_keys_outside_mysql(self):
+        with self.assertRaises(ValueError):
+            await self.executor().bulk_insert(
+                "events", rows(10), update_columns=["name"]
+            )
+
+    async def test_rows_need_the_same_columns(self):
+        with self.assertRaises(ValueError):
+            await self.executor().bulk_insert(
+                "events", [{"id": 1, "name": "a", "score": 1}, {"id": 2, "name": "b"}]
+            )
+
+    async def test_commit_per_batch_keeps_the_batches_before_a_failure(self):
+        # the third batch repeats id 0
+        source = list(rows(20)) + [{"id": 0, "name": "duplicate", "score": 0}]
+        with self.assertRaises(IntegrityError):
+            await self.executor().bulk_insert("events", source, batch_size=10)
+        self.assertEqual(await self.count(), 20)
+
+    async def test_one_transaction_rolls_back_every_batch(self):
+        source = list(rows(20)) + [{"id": 0, "name": "duplicate", "score": 0}]
+        with self.assertRaises(IntegrityError):
+            await self.executor().bulk_insert(
+                "events", source, batch_size=10, commit_per_batch=False
+            )
+        self.assertEqual(await self.count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
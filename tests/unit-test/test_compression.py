@@ -0,0 +1,104 @@
+import gzip
+import unittest
+
+from middleware.middleware import CompressionMiddleware, compressed_headers
+
+
+def json_app(body: bytes, headers: list, chunks: int = 1):
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")] + headers,
+            }
+        )
+        size = len(body) // chunks
+        for index in range(chunks):
+            last = index == chunks - 1
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body[index * size : None if last else (index + 1) * size],
+                    "more_body": not last,
+                }
+            )
+    return app
+
+
+async def call(app, accept_encoding: bytes = b"gzip") -> list:
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"accept-encoding", accept_encoding)],
+    }
+    await CompressionMiddleware(app, minimum_size=16)(scope, receive, send)
+    return messages
+
+
+class TestCompressedHeaders(unittest.TestCase):
+    def test_vary_is_merged(self):
+        headers = dict(
+            compressed_headers(
+                [(b"vary", b"Origin"), (b"content-length", b"10")], "gzip"
+            )
+        )
+        self.assertEqual(headers[b"vary"], b"Origin, Accept-Encoding")
+        self.assertNotIn(b"content-length", headers)
+
+    def test_vary_already_listing_accept_encoding_is_kept(self):
+        headers = compressed_headers([(b"vary", b"accept-encoding, Origin")], "br")
+        self.assertEqual(
+            [value for name, value in headers if name == b"vary"],
+            [b"accept-encoding, Origin"],
+        )
+
+    def test_strong_etag_becomes_weak(self):
+        headers = dict(compressed_headers([(b"etag", b'"abc"')], "gzip"))
+        self.assertEqual(headers[b"etag"], b'W/"abc"')
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+    async def test_single_body(self):
+        body = b'{"data": "' + b"x" * 100 + b'"}'
+        messages = await call(
+            json_app(
+                body,
+                [
+                    (b"vary", b"Accept-Encoding"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            )
+        )
+        headers = messages[0]["headers"]
+        self.assertEqual(
+            [value for name, value in headers if name == b"vary"], [b"Accept-Encoding"]
+        )
+        self.assertEqual(
+            dict(headers)[b"content-length"], str(len(messages[1]["body"])).encode()
+        )
+        self.assertEqual(gzip.decompress(messages[1]["body"]), body)
+
+    async def test_stream(self):
+        body = b'{"data": "' + b"x" * 100 + b'"}'
+        messages = await call(json_app(body, [], chunks=4))
+        headers = messages[0]["headers"]
+        self.assertNotIn(b"content-length", dict(headers))
+        self.assertEqual(dict(headers)[b"content-encoding"], b"gzip")
+        self.assertEqual(
+            gzip.decompress(b"".join(message["body"] for message in messages[1:])), body
+        )
+
+    async def test_small_body_is_sent_as_is(self):
+        messages = await call(json_app(b"{}", []))
+        self.assertNotIn(b"content-encoding", dict(messages[0]["headers"]))
+        self.assertEqual(messages[1]["body"], b"{}")
@@ -0,0 +1,126 @@
+import os
+import sys
+import subprocess
+import unittest
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils.response_manipulator import CustomResponse, etag_matches
+
+app = FastAPI()
+
+
+@app.get('/items')
+async def items(request: Request):
+    return CustomResponse(
+        request=request, resp_code='HTTP_200_SUCCESS', data={"items": [1, 2, 3]}
+    ).respond()
+
+
+@app.post('/items')
+async def create_item(request: Request):
+    return CustomResponse(
+        request=request, resp_code='HTTP_200_SUCCESS', data={"id": 4}
+    ).respond()
+
+
+@app.get('/document')
+async def document(request: Request):
+    response = CustomResponse.not_modified(request, version="2024-08-05T10:00:00")
+    if response is not None:
+        return response
+    return CustomResponse(
+        request=request,
+        resp_code='HTTP_200_SUCCESS',
+        data={"title": "doc"},
+        version="2024-08-05T10:00:00",
+    ).respond()
+
+
+class TestConditionalResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app)
+        self.etag = self.client.get('/items').headers['etag']
+
+    def test_matching_etag_returns_an_empty_304(self):
+        response = self.client.get('/items', headers={'if-none-match': self.etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['etag'], self.etag)
+
+    def test_other_etag_returns_the_body(self):
+        response = self.client.get(
+            '/items', headers={'if-none-match': '"something-else"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], {"items": [1, 2, 3]})
+        self.assertEqual(response.headers['etag'], self.etag)
+
+    def test_weak_etag_and_any_match(self):
+        for if_none_match in ('W/' + self.etag, '"other", ' + self.etag, '*'):
+            self.assertEqual(
+                self.client.get(
+                    '/items', headers={'if-none-match': if_none_match}
+                ).status_code,
+                304,
+                if_none_match,
+            )
+
+    def test_etag_is_stable_and_only_on_get(self):
+        self.assertEqual(self.client.get('/items').headers['etag'], self.etag)
+        response = self.client.post('/items', headers={'if-none-match': '*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('etag', response.headers)
+
+    def test_version_tag_skips_rendering(self):
+        etag = self.client.get('/document').headers['etag']
+        self.assertTrue(etag.startswith('"v-'))
+        response = self.client.get('/document', headers={'if-none-match': etag})
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"abc"', 'W/"abc"'))
+        self.assertFalse(etag_matches('"abcd"', '"abc"'))
+        self.assertFalse(etag_matches(None, '"abc"'))
+
+
+class TestResponseValidationFlag(unittest.TestCase):
+    # the flag is read when the module is imported, so each setting runs in its own
+    # interpreter
+    SCRIPT = (
+        "from starlette.requests import Request\n"
+        "from utils.response_manipulator import CustomResponse\n"
+        "scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}\n"
+        "request = Request(dict(scope, query_string=b''))\n"
+        "try:\n"
+        "    CustomResponse(request=request, resp_code='HTTP_200_SUCCESS', data=5)\n"
+        "    print('accepted')\n"
+        "except Exception as e:\n"
+        "    print(type(e).__name__)\n"
+    )
+
+    def run_with(self, value: str) -> str:
+        root = os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        env = dict(os.environ, RESPONSE_VALIDATION=value, PYTHONPATH=root)
+        result = subprocess.run(
+            [sys.executable, "-c", self.SCRIPT],
+            env=env,
+            cwd=root,
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+        return result.stdout.strip().splitlines()[-1]
+
+    def test_arguments_are_validated_only_when_enabled(self):
+        self.assertEqual(self.run_with("1"), "ValidationError")
+        self.assertEqual(self.run_with("0"), "accepted")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import multiprocessing
+from unittest import mock
+
+from utils.ids import ID_EPOCH_MS, ID_FORMATS, WORKER_BITS, IdGenerator
+
+PROCESSES = 4
+PER_PROCESS = 20_000
+
+
+def produce(slot_dir: str, node_id: int, usage: str) -> tuple:
+    # runs in a spawned process, like one uvicorn worker
+    generator = IdGenerator(slot_dir=slot_dir, node_id=node_id)
+    ids = [generator.generate(usage) for _ in range(PER_PROCESS // 2)]
+    ids += generator.generate_many(usage, PER_PROCESS - len(ids))
+    return generator.worker, ids
+
+
+class TestIdGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.slot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.slot_dir, ignore_errors=True)
+
+    def run_processes(self, node_ids: list, usage: str) -> list:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(len(node_ids)) as pool:
+            return pool.starmap(
+                produce, [(self.slot_dir, node_id, usage) for node_id in node_ids]
+            )
+
+    def test_processes_sharing_a_slot_dir_never_collide(self):
+        for usage, id_format in ID_FORMATS.items():
+            seen, total = set(), 0
+            # the second round restarts on the slot files and high-water marks of the
+            # first
+            for _ in range(2):
+                results = self.run_processes([0] * PROCESSES, usage)
+                self.assertEqual(len({worker for worker, _ in results}), PROCESSES)
+                for _, ids in results:
+                    self.assertEqual(ids, sorted(ids))
+                    self.assertTrue(
+                        all(
+                            len(id) == id_format.length
+                            and set(id) <= set(id_format.alphabet)
+                            for id in ids
+                        )
+                    )
+                    seen.update(ids)
+                    total += len(ids)
+            self.assertEqual(
+                len(seen), total, f"{total - len(seen)} {usage} collisions"
+            )
+
+    def test_nodes_with_their_own_slot_dirs_never_collide(self):
+        # separate hosts, each with a fresh slot directory but its own ID_NODE_ID
+        first = IdGenerator(slot_dir=os.path.join(self.slot_dir, "host-1"), node_id=1)
+        second = IdGenerator(slot_dir=os.path.join(self.slot_dir, "host-2"), node_id=2)
+        for usage in ID_FORMATS:
+            ids = first.generate_many(usage, 5000) + second.generate_many(usage, 5000)
+            self.assertEqual(len(set(ids)), len(ids))
+
+    def test_restart_does_not_reissue_user_ids(self):
+        previous = IdGenerator(slot_dir=self.slot_dir, node_id=0)
+        before = previous.generate_many('user_id', 100)
+        # the process exits, releasing its slot to the next one
+        os.close(previous.fd)
+        restarted = IdGenerator(slot_dir=self.slot_dir, node_id=0)
+        after = restarted.generate_many('user_id', 100)
+        self.assertEqual(restarted.worker, previous.worker)
+        self.assertFalse(set(before) & set(after))
+        self.assertLess(max(before), min(after))
+
+    def test_fails_fast_without_configuration(self):
+        with mock.patch.dict(os.environ, {}, clear=False):
+            for name in ("ID_SLOT_DIR", "ID_NODE_ID", "ID_WORKER_ID", "ENVIRONMENT"):
+                os.environ.pop(name, None)
+            with self.assertRaisesRegex(RuntimeError, "ID_SLOT_DIR"):
+                IdGenerator(node_id=0).start()
+            with self.assertRaisesRegex(RuntimeError, "ID_NODE_ID"):
+                IdGenerator(slot_dir=self.slot_dir).start()
+            os.environ["ID_NODE_ID"] = "3"
+            generator = IdGenerator(slot_dir=self.slot_dir)
+            generator.start()
+            self.assertEqual(generator.worker, 3 * generator.node_slots)
+
+    def test_settings_are_read_when_claiming(self):
+        generator = IdGenerator()
+        with mock.patch.dict(
+            os.environ, {"ID_SLOT_DIR": self.slot_dir, "ID_NODE_ID": "2"}
+        ):
+            os.environ.pop("ID_WORKER_ID", None)
+            generator.start()
+        self.assertEqual(
+            (generator.slot_dir, generator.worker),
+            (self.slot_dir, 2 * generator.node_slots),
+        )
+
+    def test_development_falls_back_to_a_temp_slot_dir(self):
+        with mock.patch.dict(os.environ, {"ENVIRONMENT": "DEVELOPMENT"}), mock.patch(
+            "tempfile.gettempdir", return_value=self.slot_dir
+        ):
+            for name in ("ID_SLOT_DIR", "ID_NODE_ID", "ID_WORKER_ID"):
+                os.environ.pop(name, None)
+            generator = IdGenerator()
+            generator.start()
+        self.assertEqual(
+            generator.slot_dir, os.path.join(self.slot_dir, "backend-id-slots")
+        )
+        self.assertEqual(generator.node_id, 0)
+
+
+class TestUserIdFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.slot_dir = tempfile.mkdtemp()
+        self.generator = IdGenerator(slot_dir=self.slot_dir, node_id=0)
+        self.id_format = ID_FORMATS['user_id']
+
+    def tearDown(self):
+        shutil.rmtree(self.slot_dir, ignore_errors=True)
+
+    def tick(self, user_id: str) -> int:
+        # user ids have no random bits: counter | worker
+        return int(user_id) >> WORKER_BITS >> self.id_format.seq_bits
+
+    def at(self, day: int):
+        return mock.patch(
+            "time.time", return_value=(ID_EPOCH_MS + day * 86_400_000 + 1000) / 1000
+        )
+
+    def test_sequence_overflow_borrows_the_next_days(self):
+        per_day = 2 ** self.id_format.seq_bits
+        with self.at(100):
+            ids = self.generator.generate_many('user_id', per_day) + [
+                self.generator.generate('user_id') for _ in range(per_day + 1)
+            ]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(
+            [self.tick(ids[0]), self.tick(ids[per_day]), self.tick(ids[-1])],
+            [100, 101, 102],
+        )
+        self.assertEqual(self.generator.stats()["borrowed_ticks"], per_day + 1)
+        with self.at(101):
+            # the clock catches up with the borrowed day, ids keep increasing
+            self.assertGreater(self.generator.generate('user_id'), ids[-1])
+
+    def test_exhausted_after_2046(self):
+        last_day = 2 ** self.id_format.tick_bits - 1
+        with self.at(last_day):
+            self.assertEqual(self.tick(self.generator.generate('user_id')), last_day)
+            with self.assertRaises(OverflowError):
+                self.generator.generate_many('user_id', 2 ** self.id_format.seq_bits)
+        with self.at(last_day + 1), self.assertRaises(OverflowError):
+            self.generator.generate('user_id')
+        self.assertEqual(time_of_day(last_day + 1)[:10], "2046-06-06")
+
+
+def time_of_day(day: int) -> str:
+    return datetime.datetime.fromtimestamp(
+        (ID_EPOCH_MS + day * 86_400_000) / 1000, datetime.timezone.utc
+    ).isoformat()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import itertools
+import logging
+import unittest
+from unittest import mock
+
+from starlette.requests import Request
+
+from utils import logData
+from utils.logData import LogDataClass, current_request_log
+
+
+def make_request(path: str = "/items", body: bytes = b"") -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    headers = [(b"host", b"testserver"), (b"user-agent", b"test")]
+    if body:
+        headers += [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"page=2",
+        "headers": headers,
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "root_path": "",
+    }
+    return Request(scope, receive)
+
+
+class TestRequestLogLevels(unittest.IsolatedAsyncioTestCase):
+    async def build(self, level: int) -> dict:
+        with mock.patch.object(logData, "LOG_LEVEL", level):
+            log = LogDataClass(request_id="request").start_request()
+            await log.add_request(make_request())
+        return log.job_dict["@message"]
+
+    async def test_info_keeps_every_field(self):
+        message = await self.build(logging.DEBUG)
+        self.assertEqual(message["user-agent"], "test")
+        self.assertEqual(message["params"], {"page": "2"})
+        self.assertIn("request_body", message)
+
+    async def test_error_keeps_only_the_url(self):
+        message = await self.build(logging.ERROR)
+        self.assertEqual(message["url"], "http://testserver/items?page=2")
+        self.assertNotIn("user-agent", message)
+        self.assertNotIn("params", message)
+
+    async def test_nothing_is_built_or_registered_above_error(self):
+        token = logData._current_request_log.set(None)
+        try:
+            message = await self.build(logging.CRITICAL)
+            self.assertEqual(set(message), {"request_id", "time"})
+            self.assertIsNone(current_request_log())
+        finally:
+            logData._current_request_log.reset(token)
+
+    def test_time_is_formatted_when_written(self):
+        log = LogDataClass(request_id="request")
+        self.assertIsNone(log.job_dict["@message"]["time"])
+        with mock.patch.object(logData.log_sink, "emit") as emit:
+            log.log_data()
+        self.assertRegex(
+            log.job_dict["@message"]["time"], r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}$"
+        )
+        emit.assert_called_once()
+
+
+class TestBodySampling(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(logData, "_request_counter", itertools.count()),
+            mock.patch.dict(logData.REQUEST_LOG_ROUTES, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def sampled(self, path: str, requests: int = 12) -> int:
+        log = LogDataClass(request_id="request")
+        summaries = [
+            await log.body_summary(make_request(path, b'{"name": "x"}'))
+            for _ in range(requests)
+        ]
+        for summary in summaries:
+            self.assertEqual(summary["size"], 13)
+        return sum("data" in summary for summary in summaries)
+
+    async def test_default_rate(self):
+        with mock.patch.object(logData, "LOG_BODY_SAMPLE_RATE", 3):
+            self.assertEqual(await self.sampled("/items"), 4)
+
+    async def test_route_rate_and_limit(self):
+        logData.configure_request_log("/backend/demo", sample_rate=4)
+        logData.configure_request_log("/backend/demo/small", max_bytes=5)
+        self.assertEqual(await self.sampled("/backend/demo/items"), 3)
+        summary = await LogDataClass(request_id="request").body_summary(
+            make_request("/backend/demo/small", b"0123456789")
+        )
+        # larger than max_bytes and not buffered yet, it is not read
+        self.assertNotIn("data", summary)
+
+    async def test_disabled_route_is_never_sampled(self):
+        logData.configure_request_log("/backend/upload", body=False)
+        self.assertEqual(await self.sampled("/backend/upload"), 0)
+        self.assertEqual(await self.sampled("/items"), 12)
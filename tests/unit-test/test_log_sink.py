@@ -0,0 +1,101 @@
+import os
+import glob
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import multiprocessing
+
+from utils.log_sink import LogSink
+
+LINES = 20_000
+
+
+def write_lines(file_path: str, worker: int):
+    # runs in a spawned process, like one uvicorn worker sharing log_file.log
+    # drop_newest makes emit return False on a full ring, so every line is retried until
+    # queued
+    sink = LogSink(
+        stdout=False,
+        file_path=file_path,
+        batch_size=100,
+        flush_interval=0.01,
+        overflow="drop_newest",
+        rotate_bytes=64 * 1024,
+        backups=1000,
+    )
+    for line in range(LINES):
+        while not sink.emit(20, "INFO", {"worker": worker, "line": line}):
+            pass
+    sink.stop()
+
+
+class TestLogSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "log_file.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_all(self) -> list:
+        lines = []
+        for path in glob.glob(self.file_path + ".*.gz"):
+            with gzip.open(path, "rt") as file:
+                lines += file.read().splitlines()
+        if os.path.exists(self.file_path):
+            with open(self.file_path) as file:
+                lines += file.read().splitlines()
+        return lines
+
+    def test_workers_rotating_the_same_file_lose_no_lines(self):
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=write_lines, args=(self.file_path, worker))
+            for worker in range(2)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        lines = self.read_all()
+        self.assertGreater(len(glob.glob(self.file_path + ".*.gz")), 2)
+        self.assertEqual(len(lines), 2 * LINES)
+        self.assertEqual(len(set(lines)), 2 * LINES)
+
+    def test_payload_changed_after_emit_is_logged_as_emitted(self):
+        sink = LogSink(stdout=False, file_path=self.file_path)
+        payload = {"status": "pending"}
+        sink.emit(20, "INFO", payload)
+        payload["status"] = "changed"
+        sink.stop()
+        self.assertEqual(self.read_all(), ['{"status":"pending"}'])
+
+    def test_nested_payload_changed_after_emit_is_logged_as_emitted(self):
+        sink = LogSink(stdout=False, file_path=self.file_path)
+        payload = {"@message": {"status": "pending"}}
+        sink.emit(20, "INFO", payload)
+        payload["@message"]["status"] = "changed"
+        sink.stop()
+        self.assertEqual(self.read_all(), ['{"@message":{"status":"pending"}}'])
+
+    def test_records_are_formatted_in_the_writer_thread(self):
+        sink = LogSink(stdout=False, file_path=self.file_path)
+        threads = []
+
+        def formatter(label, payload):
+            threads.append(threading.current_thread().name)
+            return f"{label} {payload['line']}\n"
+
+        sink.emit(20, "INFO", {"line": 1}, formatter=formatter)
+        self.assertEqual(threads, [])
+        sink.stop()
+        self.assertEqual(threads, ["log-sink-writer"])
+        self.assertEqual(self.read_all(), ["INFO 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import gc
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from db.mongoEngine import MongoClientManager
+
+
+def fake_client(delay: float = 0, error: Exception = None):
+    async def command(name):
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return {"ok": 1}
+    return SimpleNamespace(admin=SimpleNamespace(command=command))
+
+
+def manager(**clients) -> MongoClientManager:
+    mongo = MongoClientManager(options={"minPoolSize": 2})
+    mongo.clients.update(clients)
+    mongo.uris.update(clients)
+    return mongo
+
+
+class TestMongoWarmup(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.loop_errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: self.loop_errors.append(context)
+        )
+
+    async def test_ready_when_every_server_answers(self):
+        mongo = manager(a=fake_client(), b=fake_client(0.01))
+        self.assertTrue(await mongo.start(timeout=1))
+        self.assertTrue(mongo.ready)
+        self.assertIsNone(mongo.error)
+
+    async def test_failures_are_all_retrieved(self):
+        mongo = manager(
+            a=fake_client(error=ConnectionError("refused")), b=fake_client(10)
+        )
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.assertFalse(await mongo.start(timeout=0.05))
+        self.assertLess(loop.time() - started, 1)
+        self.assertTrue(mongo.error.startswith("4/4 pings failed"))
+        gc.collect()
+        await asyncio.sleep(0)
+        self.assertEqual(self.loop_errors, [])
+        self.assertEqual(
+            [
+                task
+                for task in asyncio.all_tasks()
+                if task is not asyncio.current_task()
+            ],
+            [],
+        )
+
+    async def test_start_in_background_does_not_wait(self):
+        mongo = manager(a=fake_client(0.05))
+        mongo.start_in_background()
+        task = mongo.warmup_task
+        mongo.start_in_background()  # already running, not started twice
+        self.assertIs(mongo.warmup_task, task)
+        self.assertFalse(mongo.ready)
+        self.assertTrue(await task)
+        self.assertTrue(mongo.ready)
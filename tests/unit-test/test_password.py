@@ -36,5 +36,6 @@ class TestPasswordFunctions(unittest.TestCase):
         # Testing if an incorrect password does not match the hash.
         self.assertFalse(verify_password(self.wrong_password, self.hashed_password))
 
+
 if __name__ == "__main__":
     unittest.main()
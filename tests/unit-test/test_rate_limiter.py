@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import unittest
+import itertools
+from unittest import mock
+
+import fakeredis
+from starlette.requests import Request
+
+from utils import metrics
+from utils.invalid_response_class import RequestTimeoutError
+from utils.rate_limiter import RateLimiter
+from utils.rate_limit_backends import (
+    LocalBackend,
+    RedisBackend,
+    SharedMemoryBackend,
+    get_backend,
+)
+
+_names = itertools.count()
+
+
+def limiter(backend, **limits) -> RateLimiter:
+    # 3 requests per 3 seconds: one every second, bursts of 3, cooldown after 3
+    # rejections in a row
+    options = dict(
+        requests_limit=3, time_window=3, wait_request_limit=3, cooldown_minutes=1
+    )
+    options.update(limits)
+    return RateLimiter(backend=backend, name=f"test_{next(_names)}", **options)
+
+
+class GcraDecisions(object):
+    """
+    The same GCRA scenario for every backend exposing a synchronous
+    `hit(key, policy, now)`.
+    """
+
+    def backend(self):
+        raise NotImplementedError
+
+    def test_burst_then_retry_after(self):
+        rate_limiter = limiter(self.backend())
+        hit, policy = rate_limiter.backend.hit, rate_limiter.policy
+        self.assertEqual(
+            [hit("client|/x", policy, now=100.0) for _ in range(3)], [0.0, 0.0, 0.0]
+        )
+        self.assertAlmostEqual(hit("client|/x", policy, now=100.0), 1.0)
+        self.assertAlmostEqual(hit("client|/x", policy, now=100.5), 0.5)
+        self.assertEqual(hit("client|/x", policy, now=101.0), 0.0)
+        # other keys are limited separately
+        self.assertEqual(hit("other|/x", policy, now=101.0), 0.0)
+
+    def test_sustained_rate_is_admitted(self):
+        rate_limiter = limiter(self.backend())
+        hit, policy = rate_limiter.backend.hit, rate_limiter.policy
+        self.assertTrue(
+            all(
+                hit("client|/x", policy, now=100.0 + second) == 0.0
+                for second in range(20)
+            )
+        )
+
+    def test_cooldown_after_consecutive_rejections(self):
+        rate_limiter = limiter(self.backend())
+        hit, policy = rate_limiter.backend.hit, rate_limiter.policy
+        for _ in range(3):
+            hit("client|/x", policy, now=100.0)
+        self.assertAlmostEqual(hit("client|/x", policy, now=100.0), 1.0)
+        self.assertAlmostEqual(hit("client|/x", policy, now=100.0), 1.0)
+        self.assertEqual(hit("client|/x", policy, now=100.0), 60.0)
+        self.assertAlmostEqual(hit("client|/x", policy, now=130.0), 30.0)
+        self.assertEqual(hit("client|/x", policy, now=160.0), 0.0)
+
+    def test_idle_key_starts_over(self):
+        rate_limiter = limiter(self.backend())
+        hit, policy = rate_limiter.backend.hit, rate_limiter.policy
+        for _ in range(4):
+            hit("client|/x", policy, now=100.0)
+        self.assertEqual(
+            [hit("client|/x", policy, now=200.0) for _ in range(3)], [0.0, 0.0, 0.0]
+        )
+
+
+class TestLocalBackend(GcraDecisions, unittest.TestCase):
+
+    def backend(self):
+        return LocalBackend(max_entries=100)
+
+
+class TestSharedMemoryBackend(GcraDecisions, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def backend(self):
+        return SharedMemoryBackend(
+            path=os.path.join(self.directory, f"limits-{next(_names)}.bin"), slots=64
+        )
+
+    def test_processes_share_the_table(self):
+        path = os.path.join(self.directory, "shared.bin")
+        first, second = limiter(SharedMemoryBackend(path=path, slots=64)), limiter(
+            SharedMemoryBackend(path=path, slots=64)
+        )
+        self.assertEqual(
+            [first.backend.hit("client|/x", first.policy, now=100.0) for _ in range(2)],
+            [0.0, 0.0],
+        )
+        self.assertEqual(second.backend.hit("client|/x", second.policy, now=100.0), 0.0)
+        self.assertAlmostEqual(
+            second.backend.hit("client|/x", second.policy, now=100.0), 1.0
+        )
+
+
+class TestRedisBackend(unittest.IsolatedAsyncioTestCase):
+
+    def backend(self, batch_size: int = 1) -> RedisBackend:
+        return RedisBackend(client=fakeredis.FakeAsyncRedis(), batch_size=batch_size)
+
+    async def test_burst_then_retry_after(self):
+        rate_limiter = limiter(self.backend())
+        decisions = [await rate_limiter.check("client|/x") for _ in range(4)]
+        self.assertEqual(decisions[:3], [0.0, 0.0, 0.0])
+        self.assertTrue(0.9 < decisions[3] <= 1.0, decisions[3])
+
+    async def test_cooldown_after_consecutive_rejections(self):
+        rate_limiter = limiter(self.backend())
+        decisions = [await rate_limiter.check("client|/x") for _ in range(6)]
+        self.assertEqual(decisions[5], 60.0)
+        self.assertTrue(59 < await rate_limiter.check("client|/x") <= 60)
+
+    async def test_batched_reservations_admit_the_same_requests(self):
+        rate_limiter = limiter(self.backend(batch_size=2))
+        decisions = [await rate_limiter.check("client|/x") for _ in range(4)]
+        self.assertEqual(decisions[:3], [0.0, 0.0, 0.0])
+        self.assertGreater(decisions[3], 0.9)
+        self.assertEqual(rate_limiter.backend.stats()["local_hits"], 1)
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def request(self, client: str = "10.0.0.1") -> Request:
+        return Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "path": "/backend/demo",
+                "headers": [],
+                "client": (client, 5000),
+            }
+        )
+
+    async def test_rejection_carries_retry_after(self):
+        rate_limiter = limiter(LocalBackend(max_entries=100))
+        for _ in range(3):
+            await rate_limiter(self.request())
+        with self.assertRaises(RequestTimeoutError) as raised:
+            await rate_limiter(self.request())
+        self.assertTrue(0.9 < raised.exception.retry_after <= 1.0)
+        await rate_limiter(self.request(client="10.0.0.2"))
+
+    def test_names_are_unique(self):
+        name = f"test_{next(_names)}"
+        RateLimiter(backend=LocalBackend(), name=name)
+        with self.assertRaises(ValueError):
+            RateLimiter(backend=LocalBackend(), name=name)
+
+    def test_every_limiter_has_its_own_metrics_and_state(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(
+                os.environ,
+                {
+                    "RATE_LIMIT_BACKEND": "shared_memory",
+                    "RATE_LIMIT_SHM_DIR": directory,
+                    "RATE_LIMIT_SHM_SLOTS": "64",
+                },
+            ):
+                login = RateLimiter(
+                    requests_limit=5, time_window=60, name=f"login_{next(_names)}"
+                )
+                search = RateLimiter(
+                    requests_limit=50, time_window=60, name=f"search_{next(_names)}"
+                )
+            self.assertNotEqual(login.backend.path, search.backend.path)
+            self.assertIn(login.name, login.backend.path)
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot[login.name]["path"], login.backend.path)
+            self.assertEqual(snapshot[search.name]["path"], search.backend.path)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_redis_keys_are_prefixed_with_the_limiter_name(self):
+        with mock.patch(
+            "redis.asyncio.from_url", return_value=fakeredis.FakeAsyncRedis()
+        ):
+            backend = get_backend("redis", namespace="login")
+        self.assertEqual(backend.prefix, "rate-limit:login:")
+
+
+if __name__ == "__main__":
+    unittest.main()
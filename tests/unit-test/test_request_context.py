@@ -0,0 +1,128 @@
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from middleware.middleware import RequestContextMiddleware
+from utils import auth
+from utils.logData import LogDataClass
+from utils.timing import timed
+
+app = FastAPI()
+app.add_middleware(
+    RequestContextMiddleware,
+    protected_prefixes=['/backend'],
+    public_paths=['/backend/login'],
+)
+
+
+@app.post('/backend/echo')
+async def echo(request: Request):
+    with timed('db'):
+        body = await request.body()
+    return {
+        "body": body.decode(),
+        "user": request.state.user_data,
+        "request_id": request.state.request_token,
+    }
+
+
+@app.post('/backend/login')
+async def login(request: Request):
+    return {"body": (await request.body()).decode()}
+
+
+@app.get('/backend/fail')
+async def fail():
+    raise RuntimeError("handler failed")
+
+
+@app.get('/health-check')
+async def health_check():
+    return {"status": True}
+
+
+class TestRequestContextMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(auth, "SECRET_KEY", "test-secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(app, raise_server_exceptions=False)
+        self.headers = {"Authorization": f"Bearer {auth.create_jwt_token('user-1')}"}
+        flush = LogDataClass.flush
+        self.flushes = []
+
+        def count_flush(log, *args, **kwargs):
+            self.flushes.append(log.request_id)
+            return flush(log, *args, **kwargs)
+
+        patcher = mock.patch.object(
+            LogDataClass, "flush", autospec=True, side_effect=count_flush
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_body_read_for_the_log_is_replayed_to_the_app(self):
+        response = self.client.post(
+            '/backend/echo',
+            content=b'{"name": "value"}',
+            headers=dict(
+                self.headers,
+                **{"content-type": "application/json", "x-request-id": "req-1"},
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {"body": '{"name": "value"}', "user": "user-1", "request_id": "req-1"},
+        )
+
+    def test_protected_paths_need_a_valid_token(self):
+        self.assertEqual(self.client.post('/backend/echo').status_code, 401)
+        self.assertEqual(
+            self.client.post(
+                '/backend/echo', headers={"Authorization": "Bearer not-a-token"}
+            ).status_code,
+            401,
+        )
+        self.assertEqual(
+            self.client.post(
+                '/backend/echo', headers={"Authorization": "Basic dXNlcg=="}
+            ).status_code,
+            401,
+        )
+        self.assertEqual(
+            self.client.post('/backend/login', content=b'secret').json(),
+            {"body": "secret"},
+        )
+        self.assertEqual(self.client.get('/health-check').status_code, 200)
+
+    def test_server_timing_lists_the_phases(self):
+        timing = self.client.post('/backend/echo', headers=self.headers).headers[
+            "server-timing"
+        ]
+        phases = [part.split(";")[0] for part in timing.split(", ")]
+        self.assertEqual(phases[-1], "total")
+        self.assertTrue({"auth", "db", "handler"} <= set(phases), timing)
+        self.assertNotIn("server-timing", self.client.get('/health-check').headers)
+
+    def test_one_access_log_record_per_request(self):
+        self.client.post(
+            '/backend/echo', headers=dict(self.headers, **{"x-request-id": "ok"})
+        )
+        self.client.post('/backend/echo', headers={"x-request-id": "unauthorized"})
+        self.assertEqual(
+            self.client.get(
+                '/backend/fail',
+                headers=dict(self.headers, **{"x-request-id": "failed"}),
+            ).status_code,
+            500,
+        )
+        self.client.get('/health-check')
+        self.assertEqual(self.flushes, ["ok", "unauthorized", "failed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
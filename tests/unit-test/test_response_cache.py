@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from unittest import mock
+from fastapi.responses import Response
+
+from utils import response_cache
+from utils.response_cache import ResponseCache
+
+
+class TestResponseCacheTags(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=2)
+
+    def store(self, key: str, tags: tuple):
+        self.assertTrue(
+            self.cache.store(
+                key,
+                Response(b"cached"),
+                ttl=60,
+                stale_ttl=0,
+                generations=self.cache.tag_generations(tags),
+            )
+        )
+
+    def test_invalidated_tag_misses(self):
+        self.store("items", ("items",))
+        self.assertIsNotNone(self.cache.lookup("items", ("items",)))
+        self.cache.invalidate("items")
+        self.assertIsNone(self.cache.lookup("items", ("items",)))
+
+    def test_evicted_tag_generation_does_not_match_again(self):
+        # stored while "items" was never invalidated, i.e. under the default generation
+        self.store("items", ("items",))
+        self.cache.invalidate("items")
+        # two more tags evict the generation of "items" from the bounded table
+        self.cache.invalidate("users", "games")
+        self.assertIsNone(self.cache.lookup("items", ("items",)))
+
+    def test_untagged_entry_misses_once_after_an_eviction(self):
+        self.store("items", ("items",))
+        self.cache.invalidate("a", "b", "c")
+        self.assertIsNone(self.cache.lookup("items", ("items",)))
+        self.store("items", ("items",))
+        self.assertIsNotNone(self.cache.lookup("items", ("items",)))
+
+
+class TestResponseCacheRefresh(unittest.IsolatedAsyncioTestCase):
+
+    async def test_refresh_task_is_held_until_done(self):
+        cache = ResponseCache()
+        release = asyncio.Event()
+
+        async def call(kwargs):
+            await release.wait()
+            return Response(b"fresh")
+
+        cache.refresh("items", call, {}, ttl=60, stale_ttl=0, tags=())
+        self.assertEqual(len(response_cache._refresh_tasks), 1)
+        task = next(iter(response_cache._refresh_tasks))
+        release.set()
+        await task
+        await asyncio.sleep(0)
+        self.assertEqual(response_cache._refresh_tasks, set())
+        self.assertEqual(cache.entries.get("items").body, b"fresh")
+        self.assertEqual(cache._refreshing, set())
+
+    async def test_failed_refresh_is_logged(self):
+        cache = ResponseCache()
+
+        async def call(kwargs):
+            raise RuntimeError("database down")
+
+        with mock.patch.object(response_cache.logger, "exception") as log:
+            cache.refresh("items", call, {}, ttl=60, stale_ttl=0, tags=())
+            await asyncio.gather(*response_cache._refresh_tasks)
+        log.assert_called_once()
+        self.assertEqual(cache._refreshing, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+import unittest
+import contextvars
+
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite://")
+os.environ.setdefault("SQLALCHEMY_ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("SQL_ECHO", "0")
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+from db.routing import ReplicaSet, start_request_routing  # noqa: E402
+from db.sqlEngine import DbExecute  # noqa: E402
+from db.asyncSqlEngine import AsyncDbExecute  # noqa: E402
+
+SOURCE = "SELECT name FROM source"
+NAMES = ("primary", "replica-1", "replica-2")
+
+
+def create_databases(directory: str) -> list:
+    # one SQLite file per server, each one knows which server it is
+    paths = []
+    for name in NAMES:
+        path = os.path.join(directory, f"{name}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE source (name TEXT)"))
+            connection.execute(
+                text("INSERT INTO source (name) VALUES (:name)"), {"name": name}
+            )
+            connection.execute(text("CREATE TABLE events (id INTEGER PRIMARY KEY)"))
+        engine.dispose()
+        paths.append(path)
+    return paths
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        paths = create_databases(self.directory)
+        self.primary = create_engine(f"sqlite:///{paths[0]}")
+        self.replica_engines = [
+            create_engine(f"sqlite:///{path}") for path in paths[1:]
+        ]
+
+    def tearDown(self):
+        for engine in [self.primary] + self.replica_engines:
+            engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def executor(
+        self, strategy: str = "round_robin", replicas: ReplicaSet = None
+    ) -> DbExecute:
+        executor = DbExecute()
+        executor.engine = self.primary
+        executor.replicas = (
+            replicas
+            if replicas is not None
+            else ReplicaSet(self.replica_engines, strategy)
+        )
+        return executor
+
+    def request(self, run):
+        # every request runs in its own context, like a request handled by the
+        # middleware
+        def handle():
+            start_request_routing()
+            return run()
+        return contextvars.copy_context().run(handle)
+
+    def read_source(self, replicas: ReplicaSet) -> str:
+        return self.executor(replicas=replicas).fetchone(SOURCE, {}).data["name"]
+
+    def test_reads_go_round_robin_to_replicas(self):
+        replicas = ReplicaSet(self.replica_engines, "round_robin")
+        sources = self.request(lambda: [self.read_source(replicas) for _ in range(4)])
+        self.assertEqual(sources, ["replica-1", "replica-2", "replica-1", "replica-2"])
+        self.assertEqual(replicas.stats()["replicas"][0]["reads"], 2)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        replicas = ReplicaSet(self.replica_engines)
+
+        def run():
+            before = self.read_source(replicas)
+            self.executor(replicas=replicas).insert(
+                "INSERT INTO events (id) VALUES (:id)", {"id": 1}
+            )
+            after = [self.read_source(replicas) for _ in range(3)]
+            written = (
+                self.executor(replicas=replicas)
+                .fetchone("SELECT count(*) AS total FROM events", {})
+                .data["total"]
+            )
+            return before, after, written
+
+        before, after, written = self.request(run)
+        self.assertEqual(before, "replica-1")
+        self.assertEqual(after, ["primary"] * 3)
+        self.assertEqual(written, 1)
+        # the next request reads from the replicas again
+        self.assertTrue(
+            self.request(lambda: self.read_source(replicas)).startswith("replica")
+        )
+
+    def test_transaction_pins_the_request_to_the_primary(self):
+        replicas = ReplicaSet(self.replica_engines)
+
+        def run():
+            with self.executor(replicas=replicas).transaction() as tx:
+                inside = tx.fetchone(SOURCE, {}).data["name"]
+            return inside, self.read_source(replicas)
+
+        self.assertEqual(self.request(run), ("primary", "primary"))
+
+    def test_least_busy_skips_the_replica_held_by_a_stream(self):
+        replicas = ReplicaSet(self.replica_engines, "least_busy")
+
+        def run():
+            rows = self.executor(replicas=replicas).iter_rows(SOURCE, {})
+            streaming = next(rows)["name"]
+            during = [self.read_source(replicas) for _ in range(2)]
+            rows.close()
+            return streaming, during
+
+        streaming, during = self.request(run)
+        self.assertEqual(streaming, "replica-1")
+        self.assertEqual(during, ["replica-2", "replica-2"])
+        self.assertEqual(
+            [replica["in_flight"] for replica in replicas.stats()["replicas"]], [0, 0]
+        )
+
+    def test_without_replicas_reads_go_to_the_primary(self):
+        self.assertEqual(
+            self.request(lambda: self.read_source(ReplicaSet([]))), "primary"
+        )
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ReplicaSet(self.replica_engines, "random")
+
+
+class TestAsyncReplicaRouting(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.mkdtemp()
+        paths = create_databases(self.directory)
+        self.primary = create_async_engine(f"sqlite+aiosqlite:///{paths[0]}")
+        self.replicas = ReplicaSet(
+            [create_async_engine(f"sqlite+aiosqlite:///{path}") for path in paths[1:]]
+        )
+
+    async def asyncTearDown(self):
+        for engine in [self.primary] + self.replicas.engines:
+            await engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def executor(self) -> AsyncDbExecute:
+        executor = AsyncDbExecute()
+        executor.engine = self.primary
+        executor.replicas = self.replicas
+        return executor
+
+    async def read_source(self) -> str:
+        return (await self.executor().fetchone(SOURCE, {})).data["name"]
+
+    async def test_reads_your_writes(self):
+        start_request_routing()
+        self.assertEqual(
+            [await self.read_source(), await self.read_source()],
+            ["replica-1", "replica-2"],
+        )
+        await self.executor().insert("INSERT INTO events (id) VALUES (:id)", {"id": 1})
+        self.assertEqual(await self.read_source(), "primary")
+        start_request_routing()
+        self.assertEqual(await self.read_source(), "replica-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
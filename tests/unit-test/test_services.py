@@ -0,0 +1,129 @@
+import time
+import unittest
+from unittest import mock
+
+from db.service_utils import services
+
+
+def fake_database(**collections):
+    return {
+        name: mock.Mock(create_index=mock.AsyncMock(side_effect=error))
+        for name, error in collections.items()
+    }
+
+
+class TestEnsureIdIndexes(unittest.IsolatedAsyncioTestCase):
+    async def test_creates_unique_sparse_indexes(self):
+        database = fake_database(users=None, waitlist=None)
+        indexes = ((database, 'users', 'user_id'), (database, 'waitlist', 'user_id'))
+        with mock.patch.object(services, 'ID_UNIQUE_INDEXES', indexes):
+            self.assertEqual(await services.ensure_id_indexes(), [])
+        database['users'].create_index.assert_awaited_once_with(
+            'user_id', unique=True, sparse=True
+        )
+
+    async def test_reports_indexes_that_fail(self):
+        database = fake_database(
+            users=RuntimeError("E11000 duplicate key"), waitlist=None
+        )
+        indexes = ((database, 'users', 'user_id'), (database, 'waitlist', 'user_id'))
+        with mock.patch.object(
+            services, 'ID_UNIQUE_INDEXES', indexes
+        ), mock.patch.object(services.log_sink, 'emit') as emit:
+            self.assertEqual(await services.ensure_id_indexes(), ['users.user_id'])
+        emit.assert_called_once()
+        database['waitlist'].create_index.assert_awaited_once()
+
+
+class FakeCollection(object):
+    """
+    Answers find({field: {"$in": ids}}) from a set of stored ids and records every
+    query.
+    """
+
+    def __init__(self, field: str, stored=()):
+        self.field = field
+        self.stored = set(stored)
+        self.queries = []
+        self.insert_one = mock.AsyncMock()
+
+    def find(self, query: dict, projection: dict):
+        ids = query[self.field]["$in"]
+        self.queries.append(list(ids))
+        cursor = mock.Mock()
+        cursor.to_list = mock.AsyncMock(
+            return_value=[{self.field: id} for id in ids if id in self.stored]
+        )
+        return cursor
+
+
+class TestExistingIds(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.users = FakeCollection('user_id', stored={'1', '2'})
+        self.waitlist = FakeCollection('user_id', stored={'2'})
+        database = {'users': self.users, 'waitlist': self.waitlist}
+        lookups = dict(
+            services.ID_LOOKUPS,
+            user_id=((database, 'users', 'user_id'), (database, 'waitlist', 'user_id')),
+        )
+        for patcher in (
+            mock.patch.object(services, 'ID_LOOKUPS', lookups),
+            mock.patch.object(
+                services, 'missing_ids', services.TTLCache(max_entries=100, ttl=30)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def query_count(self) -> int:
+        return len(self.users.queries) + len(self.waitlist.queries)
+
+    async def test_match_all_and_any(self):
+        self.assertEqual(await services.existing_ids(['1', '2', '3']), {'2'})
+        self.assertEqual(
+            await services.existing_ids(['1', '2', '4'], match_all=False), {'1', '2'}
+        )
+
+    async def test_missing_ids_are_answered_from_the_cache(self):
+        self.assertEqual(await services.existing_ids(['3', '4']), set())
+        self.assertEqual(self.query_count(), 2)
+        self.assertEqual(await services.existing_ids(['3', '4']), set())
+        self.assertEqual(self.query_count(), 2)
+        # an id present in one collection only is not cached, it may count for
+        # match_all=False
+        await services.existing_ids(['1'])
+        await services.existing_ids(['1'])
+        self.assertEqual(self.query_count(), 6)
+
+    async def test_cached_misses_expire(self):
+        start = time.monotonic()
+        with mock.patch('time.monotonic', return_value=start):
+            await services.existing_ids(['3'])
+        with mock.patch('time.monotonic', return_value=start + 29):
+            await services.existing_ids(['3'])
+        self.assertEqual(self.query_count(), 2)
+        with mock.patch('time.monotonic', return_value=start + 31):
+            await services.existing_ids(['3'])
+        self.assertEqual(self.query_count(), 4)
+
+    async def test_inserted_id_is_dropped_from_the_cache(self):
+        await services.existing_ids(['3'])
+        with mock.patch.object(
+            services.id_generator, 'generate_many', return_value=['3']
+        ):
+            user_id = await services.insert_with_id(
+                {'users': self.users}, 'users', {'email': 'a@b.c'}
+            )
+        self.assertEqual(user_id, '3')
+        self.users.stored.add('3')
+        self.assertEqual(await services.existing_ids(['3'], match_all=False), {'3'})
+
+    async def test_large_checks_are_split_in_chunks(self):
+        ids = [str(id) for id in range(10, 35)]
+        with mock.patch.object(services, 'VERIFY_ID_BATCH_SIZE', 10):
+            self.assertEqual(
+                await services.existing_ids(ids + ['2'], match_all=False), {'2'}
+            )
+        self.assertEqual([len(query) for query in self.users.queries], [10, 10, 6])
+        self.assertEqual(sorted(sum(self.users.queries, [])), sorted(ids + ['2']))
+        self.assertEqual(len(self.waitlist.queries), 3)
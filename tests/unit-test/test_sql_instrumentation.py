@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from db import instrumentation
+from db.instrumentation import SQLInstrumentation, fingerprint
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_literals_share_one_fingerprint(self):
+        first = fingerprint(
+            "SELECT * FROM users WHERE email = 'a@b.c' AND age > 30 AND id IN (1, 2, 3)"
+        )
+        second = fingerprint(
+            "SELECT *  FROM users\n WHERE email = 'o''neil@d.e' AND age > 41.5 "
+            "AND id IN (7)"
+        )
+        self.assertEqual(
+            first, "SELECT * FROM users WHERE email = ? AND age > ? AND id IN (?+)"
+        )
+        self.assertEqual(first, second)
+
+    def test_bind_parameters_of_every_style(self):
+        expected = "INSERT INTO users (name, email) VALUES (?+)"
+        for values in (
+            "(?, ?)",
+            "(%s, %s)",
+            "(%(name)s, %(email)s)",
+            "(:name, :email)",
+            "($1, $2)",
+        ):
+            self.assertEqual(
+                fingerprint(f"INSERT INTO users (name, email) VALUES {values}"),
+                expected,
+            )
+        self.assertEqual(
+            fingerprint("INSERT INTO t (a) VALUES (1), (2), (3)"),
+            "INSERT INTO t (a) VALUES (?+)+",
+        )
+
+
+class TestSlowQueries(unittest.TestCase):
+    statement = "SELECT * FROM users WHERE email = 'secret@example.com'"
+
+    def log_slow(self) -> tuple:
+        sql = SQLInstrumentation(slow_query_ms=10, explain=False)
+        key = sql.record(self.statement, 25)
+        with mock.patch.object(instrumentation.log_sink, "emit") as emit:
+            sql.slow_query(
+                "primary",
+                None,
+                key,
+                self.statement,
+                {"email": "secret@example.com"},
+                False,
+                25,
+            )
+        return sql, emit.call_args[0][2]["@message"]
+
+    def test_metrics_only_keep_the_fingerprint(self):
+        sql, record = self.log_slow()
+        self.assertEqual(record["fingerprint"], "SELECT * FROM users WHERE email = ?")
+        self.assertNotIn("secret", repr(sql.stats()))
+
+    def test_parameters_are_logged_only_when_enabled(self):
+        self.assertNotIn("parameters", self.log_slow()[1])
+        with mock.patch.object(instrumentation, "SQL_SLOW_QUERY_PARAMS", True):
+            self.assertIn("secret@example.com", self.log_slow()[1]["parameters"])
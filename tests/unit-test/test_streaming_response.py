@@ -0,0 +1,86 @@
+import json
+import unittest
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils.response_manipulator import StreamingCustomResponse
+
+
+def rows(count: int, fail_at: int = None):
+    for row in range(count):
+        if row == fail_at:
+            raise RuntimeError("cursor lost")
+        yield {"id": row}
+
+
+async def async_rows(count: int, fail_at: int = None):
+    for row in rows(count, fail_at):
+        yield row
+
+
+app = FastAPI()
+
+
+@app.get('/rows')
+async def stream_rows(
+    request: Request,
+    count: int,
+    fail_at: int = None,
+    chunk_size: int = 64 * 1024,
+    asynchronous: bool = False,
+):
+    items = async_rows(count, fail_at) if asynchronous else rows(count, fail_at)
+    return StreamingCustomResponse(
+        request=request, items=items, chunk_size=chunk_size
+    ).respond()
+
+
+class TestStreamingCustomResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_envelope_with_every_item(self):
+        response = self.client.get('/rows', params={"count": 1200, "chunk_size": 1000})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["code"], body["error"]), ("HTTP_200_SUCCESS", False))
+        self.assertEqual([row["id"] for row in body["data"]], list(range(1200)))
+
+    def test_ndjson_lines(self):
+        response = self.client.get(
+            '/rows', params={"count": 3}, headers={"accept": "application/x-ndjson"}
+        )
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in response.text.splitlines()],
+            [{"id": 0}, {"id": 1}, {"id": 2}],
+        )
+
+    def test_failure_before_the_first_chunk_is_a_regular_error_response(self):
+        for asynchronous in (False, True):
+            response = self.client.get(
+                '/rows',
+                params={"count": 100, "fail_at": 7, "asynchronous": asynchronous},
+            )
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(
+                (response.json()["code"], response.json()["error"]),
+                ("HTTP_500_SERVER_ERROR", True),
+            )
+
+    def test_failure_after_the_first_chunk_keeps_the_items_read(self):
+        # the failing row is in the first threadpool batch, after the first chunk was
+        # sent
+        response = self.client.get(
+            '/rows', params={"count": 100, "fail_at": 70, "chunk_size": 200}
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([row["id"] for row in body["data"]], list(range(70)))
+        self.assertEqual((body["error"], body["details"]), (True, "stream interrupted"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from utils import timer_wheel
+from utils.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=1.0, slots=(4, 4, 2))
+        self.calls = []
+
+    def test_callbacks_run_when_due_across_levels(self):
+        for delay in (1, 3, 6, 20, 40):
+            self.wheel.schedule(delay, self.calls.append, delay)
+        for second in range(1, 45):
+            self.wheel.advance(self.wheel.origin + second)
+            due = [delay for delay in (1, 3, 6, 20, 40) if delay < second]
+            self.assertTrue(set(due) <= set(self.calls), (second, self.calls))
+        self.assertEqual(sorted(self.calls), [1, 3, 6, 20, 40])
+        self.assertEqual(self.wheel.pending, 0)
+
+    def test_cancelled_callbacks_do_not_run(self):
+        handle = self.wheel.schedule(10, self.calls.append, "cancelled")
+        self.wheel.schedule(10, self.calls.append, "kept")
+        handle.cancel()
+        self.wheel.advance(self.wheel.origin + 20)
+        self.assertEqual(self.calls, ["kept"])
+
+    def test_every_repeats_until_cancelled(self):
+        handle = self.wheel.every(2, self.calls.append, "tick")
+        # one tick at a time, like the ticker task
+        for second in range(1, 8):
+            self.wheel.advance(self.wheel.origin + second)
+        handle.cancel()
+        for second in range(8, 20):
+            self.wheel.advance(self.wheel.origin + second)
+        self.assertEqual(len(self.calls), 3)
+
+
+class TestTimerWheelCoroutines(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coroutine_callbacks_are_held_and_failures_logged(self):
+        wheel = TimerWheel(tick=1.0, slots=(4, 4, 2))
+        calls = []
+
+        async def succeed():
+            await asyncio.sleep(0)
+            calls.append("ok")
+
+        async def fail():
+            raise RuntimeError("sweep failed")
+
+        wheel.schedule(1, succeed)
+        wheel.schedule(1, fail)
+        wheel.stop()  # advanced by hand
+        with mock.patch.object(timer_wheel, "logger") as logger:
+            wheel.advance(wheel.origin + 2)
+            self.assertEqual(wheel.stats()["callback_tasks"], 2)
+            await asyncio.gather(*wheel._callback_tasks, return_exceptions=True)
+            await asyncio.sleep(0)
+        self.assertEqual(calls, ["ok"])
+        self.assertEqual(wheel.stats()["callback_tasks"], 0)
+        logger.opt.return_value.error.assert_called_once_with(
+            "Timer wheel callback failed"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from utils.ttl_cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_entries=10, ttl=5)
+        cache.set("key", "value", now=100.0)
+        self.assertEqual(cache.get("key", now=104.9), "value")
+        self.assertIsNone(cache.get("key", now=105.0))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_purge_drops_idle_expired_entries(self):
+        cache = TTLCache(max_entries=10)
+        cache.set("short", 1, ttl=1, now=100.0)
+        cache.set("long", 2, ttl=100, now=100.0)
+        cache.set("forever", 3, ttl=None, now=100.0)
+        self.assertEqual(cache.purge_expired(now=150.0), 1)
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,12 @@
 import os
+import time
+import hashlib
 from datetime import datetime, timedelta, timezone
 from fastapi import Response
 from jose import jwt
 from passlib.context import CryptContext
+from utils.ttl_cache import TTLCache
+from utils import metrics
 
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -11,6 +15,18 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7  days
 ACCESS_TOKEN_EXPIRE_TEMP_MINUTES = 60 * 2 # 2 hours
 
+# verified claims keyed by token digest, each entry lives until the token's exp
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 10_000))
+# for tokens without exp
+JWT_CACHE_MAX_TTL = int(os.getenv("JWT_CACHE_MAX_TTL", 60 * 60))
+jwt_cache = (
+    TTLCache(max_entries=JWT_CACHE_SIZE, purge_interval=300)
+    if JWT_CACHE_SIZE > 0
+    else None
+)
+if jwt_cache is not None:
+    metrics.register('jwt_cache', jwt_cache.stats)
+
 def create_jwt_token(user_id: str, expires_delta: timedelta = None, temp: bool = False) -> str:
     """
     Generate a JWT token for the specified user ID with an optional expiration delta.
@@ -26,6 +42,39 @@ def create_jwt_token(user_id: str, expires_delta: timedelta = None, temp: bool =
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+
+def verify_jwt_token(token: str, use_cache: bool = True) -> dict:
+    """
+    Decode and verify a JWT, reusing the claims of tokens verified before.
+
+    Entries are keyed by a digest of the token (the token itself is never kept) and
+    expire at the token's `exp`, so an expired token is always re-verified and rejected
+    by jose. Every call returns its own copy of the claims, so callers may modify them
+    without changing what later requests with the same token read from the cache.
+
+    Raises:
+        JWTError: If the token is invalid or expired.
+    """
+    if not use_cache or jwt_cache is None:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    claims = jwt_cache.get(key)
+    if claims is not None:
+        return dict(claims)
+
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = claims.get("exp")
+    ttl = (
+        JWT_CACHE_MAX_TTL
+        if exp is None
+        else min(float(exp) - time.time(), JWT_CACHE_MAX_TTL)
+    )
+    if ttl > 0:
+        jwt_cache.set(key, claims, ttl=ttl)
+    return dict(claims)
+
+
 def create_jwt_cookie(response: Response, user_id: str) -> Response:
     """
     Create a JWT token and set it as a cookie in the response with a 7-day expiration.
@@ -0,0 +1,233 @@
+import os
+import gzip
+import zlib
+import mimetypes
+from typing import Dict, Optional, Sequence
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional, br is only offered when installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd is only offered when installed
+    zstandard = None
+
+# response compression: gzip always, br and zstd when their packages are installed
+
+COMPRESSION_LEVELS = {
+    "gzip": int(os.getenv("COMPRESSION_GZIP_LEVEL", 6)),
+    "br": int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4)),
+    "zstd": int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3)),
+}
+# highest levels, used once for static files
+STATIC_COMPRESSION_LEVELS = {"gzip": 9, "br": 11, "zstd": 19}
+
+
+class GzipStream(object):
+    """
+    Incremental gzip compression flushing every chunk so streamed responses are not held
+    back.
+    """
+
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliStream(object):
+    """Incremental brotli compression flushing every chunk."""
+
+    def __init__(self, level: int):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdStream(object):
+    """Incremental zstd compression flushing every chunk."""
+
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def compress(encoding: str, data: bytes, level: int = None) -> bytes:
+    """
+    Compress `data` in one call with `encoding` ('gzip', 'br' or 'zstd') at `level`, the
+    configured level by default.
+    """
+    if level is None:
+        level = COMPRESSION_LEVELS[encoding]
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unknown encoding {encoding}")
+
+
+def compress_stream(encoding: str, level: int = None):
+    """Return an incremental compressor with `compress(chunk)` and `finish()`."""
+    if level is None:
+        level = COMPRESSION_LEVELS[encoding]
+    return {"gzip": GzipStream, "br": BrotliStream, "zstd": ZstdStream}[encoding](level)
+
+
+# preferred first, among the encodings the client accepts
+AVAILABLE_ENCODINGS = tuple(
+    encoding
+    for encoding, module in (("zstd", zstandard), ("br", brotli), ("gzip", gzip))
+    if module is not None
+)
+
+
+def negotiate_encoding(
+    accept_encoding: str, available: Sequence[str] = AVAILABLE_ENCODINGS
+) -> Optional[str]:
+    """
+    Pick the encoding to use from an Accept-Encoding header value.
+
+    The client's quality values decide, ties go to the first of `available`. Encodings
+    with q=0 are refused, `*` stands for every encoding not listed.
+
+    Example output:
+    negotiate_encoding('gzip, br;q=0.9') -> 'gzip'
+    negotiate_encoding('gzip, br') -> 'br'
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip()] = quality
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StaticAssets(object):
+    """
+    ASGI app serving the files of a directory from memory, compressed once with every
+    available encoding.
+
+    Files are read and compressed at the highest levels by `load()` (called on startup),
+    an encoded variant is only kept when it is smaller than the file. Requests are
+    answered with the best variant the client accepts, no disk access or compression
+    happens per request.
+
+    Args:
+        directory (str): The directory to serve, subdirectories included.
+
+    Usage:
+        static_assets = StaticAssets('public')
+        app.mount('/public', static_assets)
+        static_assets.load()
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files: Dict[str, dict] = {}
+
+    def load(self):
+        """Read and compress every file of the directory."""
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                file_path = os.path.join(root, name)
+                with open(file_path, "rb") as file:
+                    data = file.read()
+                variants = {None: data}
+                for encoding in AVAILABLE_ENCODINGS:
+                    encoded = compress(
+                        encoding, data, STATIC_COMPRESSION_LEVELS[encoding]
+                    )
+                    if len(encoded) < len(data):
+                        variants[encoding] = encoded
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                files[
+                    "/"
+                    + os.path.relpath(file_path, self.directory).replace(os.sep, "/")
+                ] = {"media_type": media_type, "variants": variants}
+        self.files = files
+
+    def response(
+        self, path: str, accept_encoding: str = "", status_code: int = 200
+    ) -> Optional[Response]:
+        """
+        Return the response serving the file at `path` (relative to the directory), or
+        None if it is unknown.
+        """
+        asset = self.files.get(path)
+        if asset is None:
+            return None
+        variants = asset["variants"]
+        encoding = negotiate_encoding(
+            accept_encoding,
+            [encoding for encoding in AVAILABLE_ENCODINGS if encoding in variants],
+        )
+        # an error page served at any missing path must not be cached under that path
+        headers = {
+            "Vary": "Accept-Encoding",
+            "Cache-Control": (
+                "public, max-age=3600" if status_code < 400 else "no-store"
+            ),
+        }
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(
+            variants[encoding],
+            status_code=status_code,
+            headers=headers,
+            media_type=asset["media_type"],
+        )
+
+    async def __call__(self, scope, receive, send):
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        path, root_path = scope["path"], scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            # mounted: the scope path still includes the mount prefix
+            path = path[len(root_path):]
+        response = (
+            self.response(path, accept_encoding)
+            if scope["method"] in ("GET", "HEAD")
+            else None
+        )
+        if response is None:
+            response = Response(status_code=404)
+        await response(scope, receive, send)
@@ -1,5 +1,6 @@
 import random
 import string
+import secrets
 import datetime
 import hashlib
 import time
@@ -12,7 +13,8 @@ import pytz
 import requests
 from typing import Any, Dict, List
 
-from db.service_utils.services import verify_id
+from utils.ids import ID_FORMATS, id_generator
+from db.service_utils.services import ID_CHECKED, new_ids
 
 #helpers to be used in the project as needed, so no need to write the same code again and again
 
@@ -47,31 +49,28 @@ class CUSTOM_ENCODER(json.JSONEncoder):
 
 async def generate_uuid_string(size: int=12, usage: str = None) -> str:
     """
-    Generate a random string of specified size.
+    Generate a random string of specified size, or a unique id for `usage`.
+
+    'game' (16 letters/digits), 'user_id' (10 digits) and 'project_id' (12
+    letters/digits) ids come from utils.ids, unique by construction and time sortable.
+    Game and project ids need no database lookup. User ids have no random bits, so they
+    are still checked with one query per collection before being returned, see
+    services.new_ids. Other strings are drawn from `secrets`.
 
     Usage:
-        uuid_string(size=10, usage='game')
+        await generate_uuid_string(size=10)
+        await generate_uuid_string(usage='game')
 
     Example output:
     'A1B2C3D4E5'
     """
-    uuid = ''.join(random.choices(string.ascii_letters + string.digits, k=size))
-    if usage == 'game':
-        while True:
-            uuid = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-            if not await verify_id(id=uuid, usage='game'):  # If game_id is not a duplicate, return it
-                return uuid
-    elif usage == 'user_id':
-        while True:
-            uuid = ''.join(random.choices(string.digits, k=10))
-            if not await verify_id(id=uuid, usage='user_id'):
-                return uuid
-    elif usage == 'project_id':
-        while True:
-            uuid = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-            if not await verify_id(id=uuid, usage='project_id'):
-                return uuid
-    return uuid
+    if usage in ID_CHECKED:
+        return (await new_ids(usage))[0]
+    if usage in ID_FORMATS:
+        return id_generator.generate(usage)
+    return ''.join(
+        secrets.choice(string.ascii_letters + string.digits) for _ in range(size)
+    )
 
 def determine_user_role(email):
     # Define the roles
@@ -104,15 +103,17 @@ def determine_user_role(email):
 def get_profile_image(name: str) -> str:
     # Replace spaces in the name with '+'
     formatted_name = name.replace(' ', '+')
-    
+
     # Create the full URL
     url = f"https://ui-avatars.com/api/?name={formatted_name}"
-    
+
     return url
 
-def current_datetime() -> str:
+
+def current_datetime(timestamp: float = None) -> str:
     """
-    Get the current datetime in IST timezone with milliseconds.
+    Get the current datetime, or the datetime of a `time.time()` timestamp, in IST
+    timezone with milliseconds.
 
     Usage:
         current_datetime()
@@ -121,10 +122,15 @@ def current_datetime() -> str:
     '2024-08-05 15:30:45.123'
     """
     IST = pytz.timezone('Asia/Kolkata')
-    utc_now = datetime.datetime.now()
+    utc_now = (
+        datetime.datetime.now()
+        if timestamp is None
+        else datetime.datetime.fromtimestamp(timestamp)
+    )
     ist_now = utc_now.astimezone(IST)
     return ist_now.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # Include milliseconds and trim microseconds
 
+
 def content_are_different(content1, content2, content_type: str='json'):
     try:
         if content_type == 'json':
@@ -0,0 +1,289 @@
+import os
+import time
+import fcntl
+import string
+import struct
+import secrets
+import datetime
+import tempfile
+import threading
+from typing import NamedTuple
+from loguru import logger
+from utils import metrics
+
+# unique, time sortable ids in the game / user_id / project_id formats, generated
+# without database lookups
+
+# ASCII order, so ids sort as strings
+BASE62 = string.digits + string.ascii_uppercase + string.ascii_lowercase
+ID_EPOCH_MS = int(
+    datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp() * 1000
+)
+WORKER_BITS = 8
+
+
+class IdFormat(NamedTuple):
+    """
+    Layout of one id format, from the most to the least significant bits:
+    time tick since ID_EPOCH_MS | sequence | worker id | random filler.
+
+    The tick and sequence form one counter per worker, which only moves forward: a
+    worker issuing more than 2**seq_bits ids in a tick borrows the next tick. Ids of one
+    worker are therefore unique and ordered, and ids of different workers differ in the
+    worker bits. Bits left over by the alphabet and length are filled by `secrets`.
+    """
+
+    alphabet: str
+    length: int
+    tick_ms: int
+    tick_bits: int
+    seq_bits: int
+
+    @property
+    def random_bits(self) -> int:
+        return (
+            (len(self.alphabet) ** self.length).bit_length()
+            - 1
+            - self.tick_bits
+            - self.seq_bits
+            - WORKER_BITS
+        )
+
+
+ID_FORMATS = {
+    # 16 base62 characters: millisecond ticks until year 2581, 4096 ids per ms and
+    # worker, 31 random bits
+    'game': IdFormat(BASE62, 16, 1, 44, 12),
+    # 12 base62 characters: millisecond ticks until year 2163, 4096 ids per ms and
+    # worker, 9 random bits
+    'project_id': IdFormat(BASE62, 12, 1, 42, 12),
+    # 10 digits (the length of the existing user ids) hold 33 bits, none left to
+    # chance: daily ticks until 2046-06-06 UTC, 4096 ids per day and worker. A worker
+    # issuing more borrows the next day, its ids stay unique and ordered but run ahead
+    # of the clock, so sustained use above that rate reaches the end sooner; the
+    # `borrowed_ticks` metric counts it. Past the last day generate raises
+    # OverflowError, user ids then need a longer format.
+    'user_id': IdFormat(string.digits, 10, 86_400_000, 13, 12),
+}
+COUNTER = struct.Struct('<Q')
+
+
+def encode(number: int, alphabet: str, length: int) -> str:
+    """
+    Write `number` with `length` characters of `alphabet`, zero padded.
+
+    Example output:
+    '0000003B7xKq9Zw1'
+    """
+    base = len(alphabet)
+    characters = []
+    for _ in range(length):
+        number, digit = divmod(number, base)
+        characters.append(alphabet[digit])
+    if number:
+        raise OverflowError(f"does not fit in {length} characters")
+    return ''.join(reversed(characters))
+
+
+class IdGenerator(object):
+    """
+    Issues unique, time sortable ids in the formats of ID_FORMATS without any database
+    round trip.
+
+    Uniqueness rests on the worker id, one per live process. A process claims one with
+    an exclusive flock on a slot file in `slot_dir`: ID_WORKER_ID when set, otherwise
+    the first free of `node_slots` slots after ID_NODE_ID * `node_slots`. Every host (or
+    container) sharing the id space needs its own ID_NODE_ID. The slot file also records
+    a high-water mark of each format's counter, reserved ahead of use (one second of
+    ticks, or 64 ids for coarser ticks), so a restarted process never reissues its
+    predecessor's ids, even within the same day for user ids. A forked child claims its
+    own slot on first use.
+
+    The settings are read from the environment when the slot is claimed, not on import.
+    Outside of development neither has a default: ID_SLOT_DIR must be on storage that
+    survives restarts (a volume in containers) and ID_NODE_ID (or ID_WORKER_ID) must
+    differ between hosts, so `claim` raises until both are configured. With
+    ENVIRONMENT=DEVELOPMENT they fall back to a directory in the temp dir and node 0,
+    with a warning. Call `start` at startup to fail there rather than on the first id.
+
+    Args:
+        slot_dir (str, optional): Directory of the slot files, defaults to ID_SLOT_DIR.
+        node_id (int, optional): Defaults to ID_NODE_ID.
+        node_slots (int, optional): Worker ids per node, defaults to ID_NODE_SLOTS or
+            16.
+
+    Usage:
+        id_generator.generate('game')
+        id_generator.generate_many('user_id', 1000)
+    """
+
+    def __init__(
+        self, slot_dir: str = None, node_id: int = None, node_slots: int = None
+    ):
+        self.slot_dir = slot_dir
+        self.node_id = node_id
+        self.node_slots = node_slots
+        self.lock = threading.Lock()
+        self.pid = None
+        self.fd = None
+        self.worker = None
+        self.counters = {}
+        self.reserved = {}
+        self.issued = dict.fromkeys(ID_FORMATS, 0)
+        self.borrowed = 0
+        self.random_bits = {
+            usage: id_format.random_bits for usage, id_format in ID_FORMATS.items()
+        }
+
+    def configure(self, explicit: str = None):
+        """Fill the settings not given to the constructor from the environment."""
+        development = os.getenv('ENVIRONMENT') == 'DEVELOPMENT'
+        if not self.slot_dir:
+            self.slot_dir = os.getenv('ID_SLOT_DIR')
+        if not self.slot_dir:
+            if not development:
+                raise RuntimeError(
+                    "ID_SLOT_DIR is not set, "
+                    "point it to a directory that survives restarts"
+                )
+            self.slot_dir = os.path.join(tempfile.gettempdir(), 'backend-id-slots')
+            logger.warning(
+                f"ID_SLOT_DIR is not set, using {self.slot_dir} for development"
+            )
+        if self.node_id is None and os.getenv('ID_NODE_ID'):
+            self.node_id = int(os.getenv('ID_NODE_ID'))
+        if explicit is None and self.node_id is None:
+            if not development:
+                raise RuntimeError(
+                    "ID_NODE_ID is not set, give every host or container "
+                    "sharing the id space its own ID_NODE_ID"
+                )
+            self.node_id = 0
+            logger.warning("ID_NODE_ID is not set, using node 0 for development")
+        if self.node_slots is None:
+            self.node_slots = int(os.getenv('ID_NODE_SLOTS', 16))
+
+    def claim(self):
+        """Lock a worker slot file for this process and load its high-water marks."""
+        explicit = os.getenv('ID_WORKER_ID')
+        self.configure(explicit)
+        os.makedirs(self.slot_dir, exist_ok=True)
+        if explicit is not None:
+            candidates = [int(explicit)]
+        else:
+            candidates = range(
+                self.node_id * self.node_slots, (self.node_id + 1) * self.node_slots
+            )
+        for worker in candidates:
+            if not 0 <= worker < 2 ** WORKER_BITS:
+                raise ValueError(
+                    f"worker id {worker} out of range, "
+                    f"{2 ** WORKER_BITS} workers at most"
+                )
+            fd = os.open(
+                os.path.join(self.slot_dir, f"worker-{worker}"),
+                os.O_RDWR | os.O_CREAT,
+                0o600,
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            if self.fd is not None:
+                os.close(self.fd)
+            self.fd, self.worker, self.pid = fd, worker, os.getpid()
+            self.counters = {}
+            for index, usage in enumerate(ID_FORMATS):
+                data = os.pread(fd, COUNTER.size, index * COUNTER.size)
+                self.counters[usage] = (
+                    COUNTER.unpack(data)[0] if len(data) == COUNTER.size else 0
+                )
+            self.reserved = dict(self.counters)
+            return
+        raise RuntimeError(
+            f"no free id worker slot in {self.slot_dir} for node {self.node_id}, "
+            "set ID_NODE_SLOTS or ID_WORKER_ID"
+        )
+
+    def start(self):
+        """
+        Claim the worker slot of this process now, raising if ID_SLOT_DIR or ID_NODE_ID
+        is not configured.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.claim()
+
+    def reserve(self, usage: str, counter: int, id_format: IdFormat):
+        """Persist a high-water mark above `counter` before ids up to it are issued."""
+        ahead = max(64, (1000 // id_format.tick_ms) << id_format.seq_bits)
+        self.reserved[usage] = counter + ahead
+        os.pwrite(
+            self.fd,
+            COUNTER.pack(self.reserved[usage]),
+            list(ID_FORMATS).index(usage) * COUNTER.size,
+        )
+
+    def next_counters(self, usage: str, count: int) -> range:
+        """
+        Advance the counter of `usage` by `count` and return the counter values to
+        encode.
+        """
+        id_format = ID_FORMATS[usage]
+        with self.lock:
+            if self.pid != os.getpid():
+                self.claim()
+            now_tick = (int(time.time() * 1000) - ID_EPOCH_MS) // id_format.tick_ms
+            first = max(self.counters[usage] + 1, now_tick << id_format.seq_bits)
+            last = first + count - 1
+            if last >> id_format.seq_bits >= 2 ** id_format.tick_bits:
+                raise OverflowError(f"{usage} id space exhausted")
+            if last > self.reserved[usage]:
+                self.reserve(usage, last, id_format)
+            if last >> id_format.seq_bits > now_tick:
+                self.borrowed += 1
+            self.counters[usage] = last
+            self.issued[usage] += count
+            return range(first, last + 1)
+
+    def compose(self, counter: int, usage: str) -> str:
+        id_format = ID_FORMATS[usage]
+        random_bits = self.random_bits[usage]
+        number = (counter << WORKER_BITS | self.worker) << random_bits
+        if random_bits:
+            number |= secrets.randbits(random_bits)
+        return encode(number, id_format.alphabet, id_format.length)
+
+    def generate(self, usage: str) -> str:
+        """
+        Return one new id of `usage` ('game', 'user_id' or 'project_id').
+
+        Example output:
+        '0000004kQz1m7Bc2'
+        """
+        return self.compose(self.next_counters(usage, 1)[0], usage)
+
+    def generate_many(self, usage: str, count: int) -> list:
+        """
+        Return `count` new ids of `usage` in increasing order, reserving their counters
+        in one step.
+        """
+        return [
+            self.compose(counter, usage) for counter in self.next_counters(usage, count)
+        ]
+
+    def stats(self) -> dict:
+        """
+        Return the worker id and the ids issued per format, used by the metrics
+        endpoint.
+        """
+        return {
+            "worker": self.worker,
+            "issued": dict(self.issued),
+            "borrowed_ticks": self.borrowed,
+        }
+
+
+id_generator = IdGenerator()
+metrics.register('ids', id_generator.stats)
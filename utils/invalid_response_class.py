@@ -1,5 +1,5 @@
 import json
-from utils.logData import LogDataClass
+from utils.logData import LogDataClass, current_request_log
 from loguru import logger
 
 class AuthenticationError(Exception):
@@ -8,7 +8,12 @@ class AuthenticationError(Exception):
 
 class InternalServerError(Exception):
     def __init__(self, exception_dict : dict, request_id : str):
-        LogDataClass(request_id).exception_log(exception_dict)
+        log = current_request_log()
+        if log is not None and log.request_id == request_id and not log.flushed:
+            # written with the access log record of the request
+            log.add_error(exception_dict)
+        else:
+            LogDataClass(request_id).exception_log(exception_dict)
 
 # class CreditInsufficientError(Exception):
 #     def __init__(self, request_id: str, details: dict):
@@ -20,7 +25,8 @@ class AuthenticationMissing(Exception):
         self.message = message
         
 class RequestTimeoutError(Exception):
-    def __init__(self, message: str = None):
+    def __init__(self, message: str = None, retry_after: float = None):
         self.message = message
+        self.retry_after = retry_after
 
 
@@ -0,0 +1,89 @@
+import datetime
+from decimal import Decimal
+from typing import Any
+import orjson
+from bson import ObjectId
+
+# fast JSON encoding (orjson) shared by logging and responses
+
+
+class RawJSON(object):
+    """
+    Already encoded JSON embedded as-is by `dumps`, e.g. a response body that is logged.
+
+    Usage:
+        dumps({"body": RawJSON(response.body)})
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __repr__(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+def default(obj: Any) -> Any:
+    """Encode the types orjson does not know natively."""
+    if isinstance(obj, RawJSON):
+        return orjson.Fragment(obj.data)
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any, option: int = 0) -> bytes:
+    """
+    Serialize `obj` to compact JSON bytes.
+
+    datetime, date, UUID, dataclasses and enums are handled by orjson, ObjectId,
+    Decimal, bytes, sets and objects with a `__dict__` by `default`, RawJSON is embedded
+    unchanged.
+
+    Example output:
+    b'{"id":"66b0c8e2f1a4c93a5c8b4567","price":"9.90","at":"2024-08-05T10:00:00"}'
+    """
+    return orjson.dumps(obj, default=default, option=option | orjson.OPT_NON_STR_KEYS)
+
+
+def truncate_fields(
+    obj: Any, max_chars: int, depth: int = 0, max_depth: int = 8
+) -> Any:
+    """
+    Return a copy of `obj` where strings longer than `max_chars` and RawJSON values
+    larger than `max_chars` bytes are cut, noting how much was dropped. Nesting below
+    `max_depth` is replaced by a placeholder.
+    """
+    if isinstance(obj, str):
+        if len(obj) > max_chars:
+            return f"{obj[:max_chars]}...(+{len(obj) - max_chars} chars)"
+        return obj
+    if isinstance(obj, RawJSON):
+        if len(obj.data) > max_chars:
+            # a cut document is not valid JSON any more, log it as text
+            text = obj.data[:max_chars].decode('utf-8', errors='replace')
+            return f"{text}...(+{len(obj.data) - max_chars} bytes)"
+        return obj
+    if depth >= max_depth and isinstance(obj, (dict, list, tuple)):
+        return "...(nested too deep)"
+    if isinstance(obj, dict):
+        return {
+            key: truncate_fields(value, max_chars, depth + 1, max_depth)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [
+            truncate_fields(value, max_chars, depth + 1, max_depth) for value in obj
+        ]
+    return obj
@@ -1,30 +1,126 @@
-import json
 import os
-import pprint
-from loguru import logger
-from utils.helpers import current_datetime, calculate_time_difference
-from utils.logging import init_logging, logging
+import time
+import logging
+import itertools
+from contextvars import ContextVar
+from typing import Optional
+from utils.log_sink import log_sink, format_pretty
+from utils.json_encoder import RawJSON
+from utils.helpers import current_datetime
+from utils import metrics
 
 # init_logging()
 
+metrics.register('log_sink', log_sink.stats)
+
+# request logging: bodies are logged as a bounded prefix for 1 in LOG_BODY_SAMPLE_RATE
+# requests, everything else only records sizes and content types
+LOG_BODY_MAX_BYTES = int(os.getenv('LOG_BODY_MAX_BYTES', 2048))
+LOG_BODY_SAMPLE_RATE = int(os.getenv('LOG_BODY_SAMPLE_RATE', 1))
+LOGGED_REQUEST_HEADERS = (
+    'user-agent',
+    'content-type',
+    'content-length',
+    'x-forwarded-for',
+    'x-request-id',
+    'referer',
+    'origin',
+    'host',
+)
+REQUEST_LOG_ROUTES = {}
+_request_counter = itertools.count()
+_current_request_log: ContextVar = ContextVar('request_log', default=None)
+
+# records below LOG_LEVEL are never built, e.g. LOG_LEVEL=WARNING skips request and
+# response logs
+LOG_LEVEL = logging.getLevelName(os.getenv('LOG_LEVEL', 'DEBUG').upper())
+if not isinstance(LOG_LEVEL, int):
+    raise ValueError(f"Unknown LOG_LEVEL {os.getenv('LOG_LEVEL')}")
+
+LEVEL_NUMBERS = {
+    "INFO": logging.INFO,
+    "WARN": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "AI LOG": logging.DEBUG,
+    "SSE LOG": logging.DEBUG,
+}
+
+
+def log_enabled(levelno: int) -> bool:
+    """Return True if records of `levelno` are written."""
+    return levelno >= LOG_LEVEL
+
+
+def current_request_log() -> Optional['LogDataClass']:
+    """
+    Return the access log record of the current request, or None outside of a request.
+    """
+    return _current_request_log.get()
+
+
+def configure_request_log(
+    path: str, body: bool = True, sample_rate: int = None, max_bytes: int = None
+):
+    """
+    Override body logging for every route under `path`.
+
+    Usage:
+        configure_request_log('/backend/upload', body=False)
+        configure_request_log('/backend/demo', sample_rate=100, max_bytes=512)
+    """
+    REQUEST_LOG_ROUTES[path] = {
+        "body": body,
+        "sample_rate": sample_rate or LOG_BODY_SAMPLE_RATE,
+        "max_bytes": LOG_BODY_MAX_BYTES if max_bytes is None else max_bytes,
+    }
+
+
+def request_log_config(path: str) -> dict:
+    """Return the body logging settings of the longest configured prefix of `path`."""
+    match = None
+    for prefix in REQUEST_LOG_ROUTES:
+        if path.startswith(prefix) and (match is None or len(prefix) > len(match)):
+            match = prefix
+    if match is None:
+        return {
+            "body": True,
+            "sample_rate": LOG_BODY_SAMPLE_RATE,
+            "max_bytes": LOG_BODY_MAX_BYTES,
+        }
+    return REQUEST_LOG_ROUTES[match]
+
+
 class LogDataClass(object):
     """Class for structured logging of requests, responses, and general data with optional color output in development."""
-    
+
     def __init__(self, request_id) -> None:
-        """Initialize the LogDataClass with a request ID."""
+        """
+        Initialize the LogDataClass with a request ID, the time is formatted when the
+        record is written.
+        """
         self.request_id = request_id
+        self.flushed = False
+        self.created = time.time()
         self.job_dict = {
             "@fields": {
                 'level': "info"
             },
             "@message": {
                 "request_id": self.request_id,
-                "time": str(current_datetime()),
+                "time": None,
             }
         }
-        
+
     def log_data(self):
-        """Log the data based on the specified log level."""
+        """
+        Queue the record on the log sink based on the specified log level.
+
+        Only enqueues a snapshot of the record: formatting (a JSON line, or pretty
+        printing in development) and writing happen in the sink's writer thread, so
+        logging never blocks the event loop.
+        """
+        if self.job_dict["@message"].get("time") is None:
+            self.job_dict["@message"]["time"] = current_datetime(self.created)
         level = self.job_dict["@fields"].get("level", "info").upper()
         userAgent = self.job_dict["@message"].get("user-agent", None)
         if os.getenv('ENVIRONMENT') == "DEVELOPMENT":
@@ -34,67 +130,107 @@ class LogDataClass(object):
         else:
             if level == "INFO":
                 if userAgent == "AI":  # add specific term for it
-                    logger.debug(self.job_dict)
+                    log_sink.emit(10, "DEBUG", self.job_dict)
                 else:
-                    logger.info(self.job_dict)
+                    log_sink.emit(20, "INFO", self.job_dict)
             elif level == "WARN":
-                logger.warning(self.job_dict)
+                log_sink.emit(30, "WARNING", self.job_dict)
             elif level == "ERROR":
                 if os.getenv('ENVIRONMENT') == "STAGING":
                     self.color_pprint(self.job_dict, level)
                 else:
-                    logger.error(self.job_dict)
+                    log_sink.emit(40, "ERROR", self.job_dict)
             elif level == "AI LOG" or level == "SSE LOG":
-                logger.debug(self.job_dict)
+                log_sink.emit(10, "DEBUG", self.job_dict)
             else:
-                logger.info(self.job_dict)
+                log_sink.emit(20, "INFO", self.job_dict)
 
     def color_pprint(self, data, level):
-        """Pretty print data with colors based on log level."""
-        try:
-            color_codes = {
-                "INFO": "\033[0m",  # White
-                "WARN": "\033[93m",  # Yellow
-                "ERROR": "\033[91m",  # Red
-                "AI REQ": "\033[94m",  # Blue
-                "AI LOG": "\033[92m",  # Green
-                "SSE LOG": "\033[92m",  # Green
-                "ENDC": "\033[0m",  # Reset to default
-            }
-            color = color_codes.get(level, "\033[0m")
-            pp = pprint.PrettyPrinter()
-            formatted_data = pp.pformat(data)
-            try:
-                print(f"\n{color}{formatted_data}{color_codes['ENDC']}")
-            except Exception as e:
-                # Log the error using the standard logging mechanism
-                logging.error("Failed to print colored output: %s", e)
-                # Fallback to standard pprint without colors
-                print(formatted_data)
-        except Exception as e:
-            print(e)
-                  
+        """Queue data to be pretty printed with colors based on log level."""
+        levelno = {"WARN": 30, "ERROR": 40}.get(level, 20 if level == "INFO" else 10)
+        log_sink.emit(levelno, level, data, formatter=format_pretty)
+
     async def request_log(self, request):
         """Log the details of an incoming request."""
-        self.job_dict["@message"].update(dict(request.headers))
-        formData = await request.form()
-        if formData:
-            self.job_dict["@message"]['formData'] = dict(formData)
-        else:
-            self.job_dict["@message"]['formData'] = {}
-            jsonData = await request.body()
-            if jsonData:
-                self.job_dict["@message"]['jsonData'] = jsonData
-            else:
-                self.job_dict["@message"]['jsonData'] = {}
-        self.job_dict["@message"]['params'] = dict(request.query_params)
-        self.job_dict["@message"]['url'] = str(request.url)
-        self.job_dict["@message"]['method'] = str(request.method)
+        if not log_enabled(logging.INFO):
+            return "Done"
+        await self.add_request(request)
         self.log_data()
         return "Done"
-    
+
+    async def add_request(self, request):
+        """
+        Add the details of an incoming request to the record.
+
+        Only a whitelist of headers is kept, and the body is never parsed: multipart
+        bodies and bodies that are not sampled or larger than the route limit are logged
+        as size and content type only, other bodies as a prefix of at most `max_bytes`.
+        Bodies are not read at all when INFO records are disabled, headers and
+        parameters are only kept when WARN records are written, and nothing is added
+        when no access record can be written.
+        """
+        if not log_enabled(logging.ERROR):
+            return
+        if log_enabled(logging.WARNING):
+            headers = request.headers
+            for header in LOGGED_REQUEST_HEADERS:
+                if header in headers:
+                    self.job_dict["@message"][header] = headers[header]
+            if log_enabled(logging.INFO):
+                self.job_dict["@message"]['request_body'] = await self.body_summary(
+                    request
+                )
+            self.job_dict["@message"]['params'] = dict(request.query_params)
+        self.job_dict["@message"]['url'] = str(request.url)
+        self.job_dict["@message"]['method'] = str(request.method)
+
+    def start_request(self):
+        """
+        Make this record the access log of the current request.
+
+        `CustomResponse.respond` and `InternalServerError` then add the response and the
+        error to it instead of writing records of their own, and the middleware writes
+        it once with `flush` when the response has been sent. The record is only
+        registered when it can be written at some level, otherwise the request runs
+        without one.
+        """
+        if log_enabled(logging.ERROR):
+            _current_request_log.set(self)
+        return self
+
+    async def body_summary(self, request) -> dict:
+        """
+        Describe the request body without buffering more than the configured prefix.
+        """
+        config = request_log_config(request.url.path)
+        content_type = request.headers.get('content-type', '')
+        content_length = request.headers.get('content-length')
+        summary = {
+            "content_type": content_type,
+            "size": int(content_length) if content_length else None,
+        }
+        if (
+            not config["body"]
+            or content_type.startswith('multipart/')
+            or next(_request_counter) % config["sample_rate"]
+        ):
+            return summary
+
+        # already buffered by FastAPI for body parameters
+        body = getattr(request, '_body', None)
+        if body is None:
+            if summary["size"] is None or summary["size"] > config["max_bytes"]:
+                return summary  # reading it just to log would buffer the whole stream
+            body = await request.body()
+        summary["size"] = len(body)
+        summary["data"] = body[:config["max_bytes"]].decode('utf-8', errors='replace')
+        summary["truncated"] = len(body) > config["max_bytes"]
+        return summary
+
     def general_log(self, data, log_type: str= "AI", response=None, error=False):
         """Log general data with AI  and SSE Log level."""
+        if not log_enabled(logging.DEBUG):
+            return
         if log_type == "AI":
             log_level = "AI Log"
         elif log_type == "SSE":
@@ -104,27 +240,89 @@ class LogDataClass(object):
         if response:
             self.job_dict['response'] = response
         self.log_data()
-    
-    def response_log(self, start_time, response):
-        """Log the details of an outgoing response."""
-        end_time = str(current_datetime())
-        duration = calculate_time_difference(start_time, end_time)
-        self.job_dict["@message"]['duration'] = duration
-        self.job_dict["@message"].update(dict(response.headers))
-        self.job_dict["@message"]['body'] = json.loads(response.body)
+
+    def add_timing(self, timer):
+        """
+        Add the request duration (seconds) and its phases (milliseconds) from a
+        RequestTimer.
+        """
+        if timer is not None:
+            self.job_dict["@message"]['duration'] = timer.elapsed()
+            self.job_dict["@message"]['timing'] = timer.as_dict()
+
+    def add_response(self, response, level: str = None):
+        """
+        Add the status, content type, size and encoded body of `response` without
+        parsing the body.
+
+        Responses with an error status raise the record level to Warn unless `level` is
+        given. Streaming responses have no body yet, their size is added by `flush`.
+        """
+        body = getattr(response, 'body', None)
         self.job_dict["@message"]['response_status_code'] = response.status_code
+        self.job_dict["@message"]['response_content_type'] = response.headers.get(
+            'content-type'
+        )
+        if body is not None:
+            self.job_dict["@message"]['response_size'] = len(body)
+        if body:
+            self.job_dict["@message"]['response_body'] = RawJSON(body)
+        if level is None and response.status_code >= 400:
+            level = "Warn"
+        if level is not None and self.job_dict['@fields']['level'] != "Error":
+            self.job_dict['@fields']['level'] = level
+
+    def add_error(self, error_dict: dict):
+        """Add exception details to the record and raise its level to Error."""
+        self.job_dict['@fields']['level'] = "Error"
+        self.job_dict["@message"]['error'] = error_dict
+
+    def flush(self, timer, status_code: int = None, response_size: int = None):
+        """
+        Write the access log record of a request once, with its timing and final status.
+
+        Args:
+            timer (RequestTimer): The request timer.
+            status_code (int, optional): Status sent to the client, None if no response
+                was sent.
+            response_size (int, optional): Body bytes sent to the client.
+        """
+        if self.flushed:
+            return
+        self.flushed = True
+        message = self.job_dict["@message"]
+        if status_code is not None:
+            message['response_status_code'] = status_code
+            if status_code >= 400 and self.job_dict['@fields']['level'] == "info":
+                self.job_dict['@fields']['level'] = "Warn"
+        if response_size is not None:
+            message['response_size'] = response_size
+        level = self.job_dict['@fields']['level'].upper()
+        if not log_enabled(LEVEL_NUMBERS.get(level, logging.INFO)):
+            return
+        self.add_timing(timer)
+        self.log_data()
+
+    def response_log(self, timer, response):
+        """Log the details of an outgoing response."""
+        if not log_enabled(logging.INFO):
+            return
+        self.add_timing(timer)
+        self.add_response(response)
         self.log_data()
 
     def warn_log(self, response):
         """Log a warning response."""
-        self.job_dict["@message"].update(dict(response.headers))
+        if not log_enabled(logging.WARNING):
+            return
         self.job_dict['@fields']['level'] = "Warn"
-        self.job_dict["@message"]['body'] = json.loads(response.body)
-        self.job_dict["@message"]['response_status_code'] = response.status_code
+        self.add_response(response)
         self.log_data()
 
     def exception_log(self, error_dict={}):
         """Log an exception with error details."""
+        if not log_enabled(logging.ERROR):
+            return
         self.job_dict['@fields']['level'] = "Error"
         self.job_dict['@message'].update(error_dict)
         self.log_data()
@@ -0,0 +1,382 @@
+import os
+import sys
+import glob
+import gzip
+import time
+import fcntl
+import shutil
+import atexit
+import pprint
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from utils.json_encoder import dumps, truncate_fields
+
+# bounded, non-blocking log pipeline: request coroutines enqueue record snapshots, a
+# writer thread formats and writes them in batches
+
+OVERFLOW_POLICIES = ("drop_lowest", "drop_newest", "drop_oldest")
+
+COLOR_CODES = {
+    "INFO": "\033[0m",  # White
+    "WARN": "\033[93m",  # Yellow
+    "ERROR": "\033[91m",  # Red
+    "AI REQ": "\033[94m",  # Blue
+    "AI LOG": "\033[92m",  # Green
+    "SSE LOG": "\033[92m",  # Green
+    "ENDC": "\033[0m",  # Reset to default
+}
+
+LOG_FIELD_MAX_CHARS = int(os.getenv("LOG_FIELD_MAX_CHARS", 4096))
+
+
+def format_json(label: str, payload) -> str:
+    """
+    One compact JSON line per record, strings longer than LOG_FIELD_MAX_CHARS are
+    truncated.
+
+    Example output:
+    '{"@fields":{"level":"info"},"@message":{"request_id":"...","response_status_code":200,"body":{"status":true}}}\\n'
+    """
+    return dumps(truncate_fields(payload, LOG_FIELD_MAX_CHARS)).decode("utf-8") + "\n"
+
+
+def format_pretty(label: str, payload) -> str:
+    """Pretty printed record colored by level, for development consoles."""
+    color = COLOR_CODES.get(label, COLOR_CODES["INFO"])
+    return f"\n{color}{pprint.pformat(payload)}{COLOR_CODES['ENDC']}\n"
+
+
+def snapshot(payload):
+    """
+    Copy a record two levels deep, e.g. a LogDataClass job_dict and its "@fields" /
+    "@message".
+
+    Records are dicts of dicts filled in by the request, a snapshot keeps later changes
+    to them out of the queued record without the cost of a deep copy.
+    """
+    if not isinstance(payload, dict):
+        return payload
+    return {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in payload.items()
+    }
+
+
+class LogSink(object):
+    """
+    Bounded in-memory ring of log records drained in batches by a background writer
+    thread.
+
+    `emit` appends a snapshot of the record to the ring, it never blocks, formats or
+    does I/O, so a payload changed after `emit` does not change the logged line. The
+    writer thread wakes up every `flush_interval` seconds (or as soon as a batch is
+    full), formats the queued records (JSON serialization, pretty printing) and writes
+    them to stdout and/or `file_path` with one write per batch.
+
+    The file is rotated once it reaches `rotate_bytes` or is older than
+    `rotate_seconds`; rotated files are gzip compressed and only the newest `backups`
+    are kept. Several processes (uvicorn workers) can share `file_path`: each batch is
+    appended under an flock on `file_path + '.lock'`, the file is reopened by path when
+    another process rotated it, and only one process renames it.
+
+    When the ring is full the overflow policy decides what is lost:
+        drop_lowest: drop the oldest record of the lowest level present, unless the new
+                     record has a lower level, in which case the new record is dropped.
+        drop_newest: drop the new record.
+        drop_oldest: drop the oldest record.
+
+    Args:
+        capacity (int): Maximum number of queued records.
+        batch_size (int): Records written per batch.
+        flush_interval (float): Maximum seconds a record waits before being written.
+        overflow (str): One of OVERFLOW_POLICIES.
+        stdout (bool): Write records to stdout.
+        file_path (str, optional): Log file, None disables file output.
+        rotate_bytes (int, optional): Rotate the file once it grows past this size.
+        rotate_seconds (float, optional): Rotate the file once it is older than this.
+        backups (int): Compressed rotated files to keep.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        overflow: str = "drop_lowest",
+        stdout: bool = True,
+        file_path: str = None,
+        rotate_bytes: int = None,
+        rotate_seconds: float = None,
+        backups: int = 5,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}")
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.stdout = stdout
+        self.file_path = file_path
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        # one deque per level so drop_lowest is O(1); records carry a sequence number to
+        # keep the order
+        self._queues = {}
+        self._size = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self._file = None
+        self._file_opened = None
+        self._lock_file = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = {}
+        self.write_errors = 0
+
+    def configure(self, **options):
+        """
+        Change settings (e.g. file output once the environment is known); takes effect
+        on the next batch.
+        """
+        with self._lock:
+            for key, value in options.items():
+                if not hasattr(self, key) or key.startswith("_"):
+                    raise AttributeError(key)
+                setattr(self, key, value)
+
+    def emit(self, levelno: int, label: str, payload, formatter=format_json) -> bool:
+        """
+        Queue a record for writing. Never blocks.
+
+        Args:
+            levelno (int): Numeric level used by the overflow policy.
+            label (str): Level name shown by the formatter.
+            payload: The record, queued as a `snapshot` and formatted in the writer
+                thread.
+            formatter (callable): Turns the record into the text to write,
+                `formatter(label, payload)`.
+
+        Returns:
+            bool: False if the record was dropped.
+        """
+        record = (next(self._sequence), levelno, label, snapshot(payload), formatter)
+        with self._lock:
+            if self._size >= self.capacity and not self._make_room(levelno, label):
+                return False
+            queue = self._queues.get(levelno)
+            if queue is None:
+                queue = self._queues[levelno] = deque()
+            queue.append(record)
+            self._size += 1
+            self.enqueued += 1
+            full_batch = self._size >= self.batch_size
+        if self._thread is None:
+            self.start()
+        if full_batch:
+            self._wakeup.set()
+        return True
+
+    def _make_room(self, levelno: int, label: str) -> bool:
+        """
+        Apply the overflow policy with the lock held; False means drop the incoming
+        record.
+        """
+        if self.overflow == "drop_newest":
+            self._count_drop(label)
+            return False
+        live = [level for level, queue in self._queues.items() if queue]
+        if self.overflow == "drop_oldest":
+            victim_level = min(live, key=lambda level: self._queues[level][0][0])
+        else:
+            victim_level = min(live)
+            if levelno < victim_level:
+                self._count_drop(label)
+                return False
+        victim = self._queues[victim_level].popleft()
+        self._size -= 1
+        self._count_drop(victim[2])
+        return True
+
+    def _count_drop(self, label: str):
+        self.dropped[label] = self.dropped.get(label, 0) + 1
+
+    def _take_batch(self) -> list:
+        """Pop up to `batch_size` records in emission order."""
+        with self._lock:
+            batch = []
+            while self._size and len(batch) < self.batch_size:
+                level = min(
+                    (level for level, queue in self._queues.items() if queue),
+                    key=lambda level: self._queues[level][0][0],
+                )
+                batch.append(self._queues[level].popleft())
+                self._size -= 1
+            return batch
+
+    def start(self):
+        """Start the writer thread (done automatically by the first emit)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="log-sink-writer", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """Flush the queued records and stop the writer thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                self._write(batch)
+            if self._stopping:
+                self._close_file()
+                if self._lock_file is not None:
+                    self._lock_file.close()
+                    self._lock_file = None
+                return
+
+    def _write(self, batch: list):
+        text = "".join(self._format(record) for record in batch)
+        try:
+            if self.stdout:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            if self.file_path:
+                self._write_file(text)
+            elif self._file is not None:
+                self._close_file()
+            self.written += len(batch)
+        except Exception:
+            self.write_errors += 1
+
+    @staticmethod
+    def _format(record: tuple) -> str:
+        _, _, label, payload, formatter = record
+        try:
+            return formatter(label, payload)
+        except Exception as e:
+            return f"\nlog record could not be formatted: {e}\n"
+
+    def _write_file(self, text: str):
+        if self._file is not None and self._file.name != self.file_path:
+            self._close_file()  # file_path was reconfigured
+        if self._lock_file is None or self._lock_file.name != self.file_path + ".lock":
+            if self._lock_file is not None:
+                self._lock_file.close()
+            self._lock_file = open(self.file_path + ".lock", "a")
+        rotated = None
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if self._file is not None and not self._is_current():
+                self._close_file()  # rotated by another process
+            if self._file is None:
+                self._file = open(self.file_path, "a", encoding="utf-8")
+                self._file_opened = time.time()
+            self._file.write(text)
+            self._file.flush()
+            if (self.rotate_bytes and self._file.tell() >= self.rotate_bytes) or (
+                self.rotate_seconds
+                and time.time() - self._file_opened >= self.rotate_seconds
+            ):
+                rotated = self._rotate()
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        if rotated:
+            self._compress(rotated)
+
+    def _is_current(self) -> bool:
+        """Whether the open file is still the one at `file_path`."""
+        try:
+            return (
+                os.stat(self.file_path).st_ino == os.fstat(self._file.fileno()).st_ino
+            )
+        except FileNotFoundError:
+            return False
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self) -> str:
+        """
+        Move the current file aside with the lock held, the next write opens a new one.
+        """
+        self._close_file()
+        suffix = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        rotated = f"{self.file_path}.{suffix}-{os.getpid()}"
+        os.replace(self.file_path, rotated)
+        return rotated
+
+    def _compress(self, rotated: str):
+        """Gzip a rotated file and drop the oldest backups, outside the lock."""
+        with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+        for old in sorted(glob.glob(f"{glob.escape(self.file_path)}.*.gz"))[
+            : -self.backups or None
+        ]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass  # removed by another process
+
+    def write_line(self, message: str):
+        """Loguru sink: queue an already formatted loguru message."""
+        self.emit(
+            message.record["level"].no,
+            message.record["level"].name,
+            str(message),
+            formatter=lambda label, text: text,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._size,
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": dict(self.dropped),
+            "write_errors": self.write_errors,
+            "overflow": self.overflow,
+        }
+
+
+def env_int(key: str, default=None):
+    value = os.getenv(key)
+    return int(value) if value else default
+
+
+# process wide sink used by LogDataClass and loguru, file output is enabled by
+# init_logging
+log_sink = LogSink(
+    capacity=env_int("LOG_QUEUE_SIZE", 10_000),
+    batch_size=env_int("LOG_BATCH_SIZE", 500),
+    flush_interval=float(os.getenv("LOG_FLUSH_SECONDS", 0.5)),
+    overflow=os.getenv("LOG_OVERFLOW_POLICY", "drop_lowest"),
+    rotate_bytes=env_int("LOG_ROTATE_BYTES", 100 * 1024 * 1024),
+    rotate_seconds=env_int("LOG_ROTATE_SECONDS"),
+    backups=env_int("LOG_BACKUPS", 5),
+)
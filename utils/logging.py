@@ -1,11 +1,11 @@
 """Configure handlers and formats for application loggers."""
 from fileinput import filename
 import logging
-import sys
 from os import environ
 from pprint import pformat
 
 from loguru import logger
+from utils.log_sink import log_sink
 # from loguru._defaults import LOGURU_FORMAT
 
 
@@ -56,7 +56,7 @@ def env(key, type_, default=None):
             raise ValueError(
                 "Invalid environment variable '%s' (expected an integer): '%s'" % (key, val)
             ) from None
-            
+
 def format_record(record: dict) -> str:
     """
     Custom format for loguru loggers.
@@ -119,8 +119,20 @@ def init_logging():
     logging.getLogger("uvicorn").handlers = [intercept_handler]
 
     # set logs output, level and format
+    # loguru only formats, the shared log sink owns stdout and log_file.log and writes
+    # in the background
     if environ["ENVIRONMENT_PATH"] == '.env.development':
-        logger.configure(handlers=[{"sink": sys.stdout, "level": logging.DEBUG,"format": format_record}])
+        log_sink.configure(stdout=True, file_path=None)
     else:
-        logger.configure(handlers=[{"sink": "log_file.log", "level": logging.DEBUG, "format": format_record},
-                               {"sink": sys.stdout, "level": logging.DEBUG,"format": format_record}])
\ No newline at end of file
+        log_sink.configure(
+            stdout=True, file_path=environ.get("LOG_FILE", "log_file.log")
+        )
+    logger.configure(
+        handlers=[
+            {
+                "sink": log_sink.write_line,
+                "level": logging.DEBUG,
+                "format": format_record,
+            }
+        ]
+    )
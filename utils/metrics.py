@@ -0,0 +1,37 @@
+"""Process-local registry of metric collectors exposed on the /metrics endpoint."""
+from typing import Callable, Dict
+
+_collectors: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, collector: Callable[[], dict]):
+    """
+    Register a callable returning a dict of metric values under `name`.
+
+    Registering the same name again replaces the previous collector.
+
+    Usage:
+        register('rate_limiter', limiter.store.stats)
+    """
+    _collectors[name] = collector
+
+
+def unregister(name: str):
+    """Remove the collector registered under `name`, if any."""
+    _collectors.pop(name, None)
+
+
+def snapshot() -> dict:
+    """
+    Collect the current value of every registered metric.
+
+    Example output:
+    {'rate_limiter': {'entries': 12, 'max_entries': 100000, 'hits': 40, ...}}
+    """
+    data = {}
+    for name, collector in list(_collectors.items()):
+        try:
+            data[name] = collector()
+        except Exception as e:
+            data[name] = {"error": str(e)}
+    return data
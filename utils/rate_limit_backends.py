@@ -0,0 +1,369 @@
+import os
+import re
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from typing import NamedTuple
+from utils.ttl_cache import TTLCache
+
+# storage backends for utils.rate_limiter.RateLimiter, pick one with
+# RATE_LIMIT_BACKEND=local|shared_memory|redis
+
+
+def safe_name(name: str) -> str:
+    """
+    `name` with only the characters allowed in file names and Redis keys.
+
+    Example output:
+    'rate_limiter_30_per_60s'
+    """
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+class RateLimitPolicy(NamedTuple):
+    """GCRA parameters of one RateLimiter, passed to the backend on every check."""
+    emission_interval: float
+    burst_tolerance: float
+    wait_request_limit: int
+    cooldown_seconds: float
+    time_window: float
+
+
+def gcra_update(
+    tat: float,
+    rejections: int,
+    cooldown_until: float,
+    now: float,
+    policy: RateLimitPolicy,
+):
+    """
+    Apply one request to a GCRA state.
+
+    Args:
+        tat (float): Theoretical arrival time of the key, `now` for an unknown key.
+        rejections (int): Consecutive rejections so far.
+        cooldown_until (float): Cooldown deadline, 0 when none.
+        now (float): Current timestamp on the same clock as the state.
+        policy (RateLimitPolicy): Limits to apply.
+
+    Returns:
+        tuple: (retry_after, tat, rejections, cooldown_until), retry_after is 0.0
+            when admitted.
+    """
+    if cooldown_until > now:
+        return cooldown_until - now, tat, rejections, cooldown_until
+
+    if tat < now:
+        tat = now
+    allow_at = tat - policy.burst_tolerance
+    if now < allow_at:
+        rejections += 1
+        if rejections >= policy.wait_request_limit:
+            return policy.cooldown_seconds, tat, 0, now + policy.cooldown_seconds
+        return allow_at - now, tat, rejections, cooldown_until
+
+    return 0.0, tat + policy.emission_interval, 0, cooldown_until
+
+
+class LocalBackend(object):
+    """
+    Per-process backend keeping the GCRA state in a bounded TTLCache.
+
+    Limits are enforced per worker, so with N uvicorn workers a client may get up to N
+    times the configured limit. Use it for single worker deployments and local
+    development.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.store = TTLCache(
+            max_entries=max_entries
+            or int(os.getenv('RATE_LIMIT_MAX_ENTRIES', 100_000)),
+            purge_interval=int(os.getenv('RATE_LIMIT_PURGE_SECONDS', 60)),
+        )
+
+    def hit(self, key: str, policy: RateLimitPolicy, now: float = None) -> float:
+        """Synchronous check, returns 0.0 when admitted or the seconds to wait."""
+        if now is None:
+            now = time.monotonic()
+        entry = self.store.get(key, now=now)
+        if entry is None:
+            entry = [now, 0, 0.0]
+        retry_after, entry[0], entry[1], entry[2] = gcra_update(
+            entry[0], entry[1], entry[2], now, policy
+        )
+        self.store.set(key, entry, expires_at=max(entry[0], entry[2]), now=now)
+        return retry_after
+
+    async def check(self, key: str, policy: RateLimitPolicy) -> float:
+        return self.hit(key, policy)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+class SharedMemoryBackend(object):
+    """
+    Host-wide backend: a fixed size counter table in a memory mapped file shared by all
+    workers.
+
+    The table is split into stripes of `stripe_slots` slots. A key hashes to one stripe
+    and is stored in the first matching, free or expired slot of that stripe. Each
+    stripe is guarded by a POSIX record lock on its byte range (between processes) plus
+    a thread lock (inside a process), so unrelated keys rarely contend. When a stripe is
+    full, the slot expiring first is reused. Timestamps come from the system wide
+    monotonic clock.
+
+    Args:
+        path (str, optional): Backing file, defaults to a file named after `namespace`
+            in RATE_LIMIT_SHM_DIR, /dev/shm or the temp directory.
+        slots (int): Total number of slots in the table, defaults to
+            RATE_LIMIT_SHM_SLOTS or 65536.
+        stripe_slots (int): Slots per stripe (and per lock).
+        namespace (str): Name of the limiter owning the table, limiters never share a
+            default file.
+    """
+
+    # key digest, tat, cooldown deadline, consecutive rejections, padding
+    SLOT = struct.Struct('<QddI4x')
+
+    def __init__(
+        self,
+        path: str = None,
+        slots: int = None,
+        stripe_slots: int = 16,
+        namespace: str = 'rate_limiter',
+    ):
+        slots = slots or int(os.getenv('RATE_LIMIT_SHM_SLOTS', 65536))
+        self.stripe_slots = stripe_slots
+        self.stripes = max(1, slots // stripe_slots)
+        self.slots = self.stripes * stripe_slots
+        self.stripe_bytes = self.stripe_slots * self.SLOT.size
+        size = self.slots * self.SLOT.size
+        if path is None:
+            folder = os.getenv('RATE_LIMIT_SHM_DIR') or (
+                '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            )
+            # one file per limiter, and per slot count since the layout depends on it
+            path = os.path.join(
+                folder, f"backend-rate-limit-{safe_name(namespace)}-{self.slots}.bin"
+            )
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.table = mmap.mmap(
+            self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.thread_locks = [threading.Lock() for _ in range(self.stripes)]
+
+    @staticmethod
+    def digest(key: str) -> int:
+        # stable across processes, unlike hash(); 0 marks an empty slot
+        return (
+            int.from_bytes(
+                hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little'
+            )
+            or 1
+        )
+
+    def hit(self, key: str, policy: RateLimitPolicy, now: float = None) -> float:
+        """Synchronous check, returns 0.0 when admitted or the seconds to wait."""
+        if now is None:
+            now = time.monotonic()
+        digest = self.digest(key)
+        stripe = digest % self.stripes
+        start = stripe * self.stripe_bytes
+        with self.thread_locks[stripe]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.stripe_bytes, start)
+            try:
+                offset, state = self._find(digest, start, now)
+                tat, cooldown_until, rejections = state
+                retry_after, tat, rejections, cooldown_until = gcra_update(
+                    tat, rejections, cooldown_until, now, policy
+                )
+                self.SLOT.pack_into(
+                    self.table, offset, digest, tat, cooldown_until, rejections
+                )
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.stripe_bytes, start)
+        return retry_after
+
+    def _find(self, digest: int, start: int, now: float):
+        """
+        Return the slot offset for `digest` in the stripe at `start` and its live state.
+        """
+        reusable = None
+        oldest, oldest_expiry = start, None
+        for offset in range(start, start + self.stripe_bytes, self.SLOT.size):
+            slot_digest, tat, cooldown_until, rejections = self.SLOT.unpack_from(
+                self.table, offset
+            )
+            expiry = tat if tat > cooldown_until else cooldown_until
+            if slot_digest == digest:
+                if expiry <= now:
+                    return offset, (now, 0.0, 0)
+                return offset, (tat, cooldown_until, rejections)
+            if reusable is None and (slot_digest == 0 or expiry <= now):
+                reusable = offset
+            elif oldest_expiry is None or expiry < oldest_expiry:
+                oldest, oldest_expiry = offset, expiry
+        return (oldest if reusable is None else reusable), (now, 0.0, 0)
+
+    async def check(self, key: str, policy: RateLimitPolicy) -> float:
+        return self.hit(key, policy)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        live = 0
+        for offset in range(0, self.slots * self.SLOT.size, self.SLOT.size):
+            slot_digest, tat, cooldown_until, _ = self.SLOT.unpack_from(
+                self.table, offset
+            )
+            if slot_digest and max(tat, cooldown_until) > now:
+                live += 1
+        return {"entries": live, "max_entries": self.slots, "path": self.path}
+
+
+# Atomic GCRA check-and-increment. Tries to reserve ARGV[5] requests at once for local
+# batching and falls back to a single request. Returns {granted, retry_after}.
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local wait_limit = tonumber(ARGV[3])
+local cooldown = tonumber(ARGV[4])
+local batch = tonumber(ARGV[5])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'r', 'c')
+local tat = tonumber(state[1]) or now
+local rejections = tonumber(state[2]) or 0
+local cooldown_until = tonumber(state[3]) or 0
+if cooldown_until > now then
+    return {0, tostring(cooldown_until - now)}
+end
+if tat < now then
+    tat = now
+end
+local granted = 0
+local retry = 0
+for _, cost in ipairs({batch, 1}) do
+    local allow_at = tat + interval * (cost - 1) - tolerance
+    if now >= allow_at then
+        granted = cost
+        tat = tat + interval * cost
+        rejections = 0
+        break
+    end
+    retry = allow_at - now
+end
+if granted == 0 then
+    rejections = rejections + 1
+    if rejections >= wait_limit then
+        rejections = 0
+        cooldown_until = now + cooldown
+        retry = cooldown
+    end
+end
+redis.call('HSET', KEYS[1], 't', tostring(tat), 'r', rejections,
+           'c', tostring(cooldown_until))
+local ttl = math.max(tat, cooldown_until) - now
+redis.call('PEXPIRE', KEYS[1], math.ceil(ttl * 1000) + 1)
+return {granted, tostring(retry)}
+"""
+
+
+class RedisBackend(object):
+    """
+    Cluster-wide backend doing an atomic GCRA check-and-increment in one Redis round
+    trip.
+
+    With `batch_size` > 1 every round trip tries to reserve that many requests at once;
+    the spare ones are consumed locally for up to `time_window` seconds without touching
+    Redis. Reserved but unused requests still count against the client, so keep the
+    batch small compared to `requests_limit`.
+
+    Args:
+        url (str, optional): Redis URL, defaults to RATE_LIMIT_REDIS_URL.
+        client (optional): Existing `redis.asyncio` compatible client (fakeredis works).
+        batch_size (int): Requests reserved per round trip, defaults to
+            RATE_LIMIT_REDIS_BATCH or 1.
+        prefix (str): Key prefix in Redis.
+    """
+
+    def __init__(
+        self,
+        url: str = None,
+        client=None,
+        batch_size: int = None,
+        prefix: str = 'rate-limit:',
+    ):
+        if client is None:
+            import redis.asyncio as redis  # only needed when this backend is selected
+            client = redis.from_url(
+                url or os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+            )
+        self.client = client
+        self.script = client.register_script(GCRA_SCRIPT)
+        self.batch_size = batch_size or int(os.getenv('RATE_LIMIT_REDIS_BATCH', 1))
+        self.prefix = prefix
+        self.credits = TTLCache(
+            max_entries=int(os.getenv('RATE_LIMIT_MAX_ENTRIES', 100_000))
+        )
+        self.round_trips = 0
+        self.local_hits = 0
+
+    async def check(self, key: str, policy: RateLimitPolicy) -> float:
+        if self.batch_size > 1:
+            credits = self.credits.get(key)
+            if credits and credits[0] > 0:
+                credits[0] -= 1
+                self.local_hits += 1
+                return 0.0
+
+        self.round_trips += 1
+        granted, retry_after = await self.script(
+            keys=[self.prefix + key],
+            args=[
+                policy.emission_interval,
+                policy.burst_tolerance,
+                policy.wait_request_limit,
+                policy.cooldown_seconds,
+                self.batch_size,
+            ],
+        )
+        granted = int(granted)
+        if granted > 1:
+            self.credits.set(key, [granted - 1], ttl=policy.time_window)
+        return 0.0 if granted else float(retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "round_trips": self.round_trips,
+            "local_hits": self.local_hits,
+            "batch_size": self.batch_size,
+            "credit_entries": len(self.credits),
+        }
+
+
+def get_backend(name: str = None, namespace: str = 'rate_limiter'):
+    """
+    Build the backend selected by `name` or the RATE_LIMIT_BACKEND environment variable.
+
+    `namespace` (the limiter name) keeps the shared memory file and the Redis keys of
+    one limiter apart from the others.
+
+    Usage:
+        get_backend('shared_memory', namespace='login')
+    """
+    name = (name or os.getenv('RATE_LIMIT_BACKEND', 'local')).lower()
+    if name == 'local':
+        return LocalBackend()
+    elif name == 'shared_memory':
+        return SharedMemoryBackend(namespace=namespace)
+    elif name == 'redis':
+        return RedisBackend(prefix=f"rate-limit:{safe_name(namespace)}:")
+    raise ValueError(f"Unknown rate limit backend {name}")
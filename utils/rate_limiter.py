@@ -1,62 +1,104 @@
 import os
-import asyncio
 from fastapi import Request
 from utils.invalid_response_class import RequestTimeoutError
-from utils.helpers import add_time, current_datetime
-from asyncio import Lock
-from collections import defaultdict
+from utils.rate_limit_backends import RateLimitPolicy, get_backend
+from utils import metrics
+from utils.timing import timed
+
+# names of the limiters created in this process, each one owns its metrics and backend
+# state
+_limiter_names = set()
 
 class RateLimiter:
-    def __init__(self, requests_limit: int = 30, time_window: int = 60, wait_request_limit: int = 10):
+    """
+    Per client/endpoint rate limiter based on GCRA (generic cell rate algorithm).
+
+    Every (client, endpoint) pair keeps a single "theoretical arrival time" (TAT), so
+    the memory per key is constant no matter how many requests arrive. A request is
+    admitted or rejected immediately, rejected requests carry the exact delay after
+    which the next request would be admitted. Clients that keep hammering after being
+    rejected `wait_request_limit` times in a row are put on cooldown for
+    `cooldown_minutes`.
+
+    The state is kept by a pluggable backend (see utils.rate_limit_backends): a bounded
+    per-process table by default, a shared memory table for all workers on the host, or
+    Redis for all hosts. RATE_LIMIT_BACKEND selects it when no backend is passed. The
+    limiter name keeps limiters apart: it is the metrics name, part of the shared memory
+    file name and of the Redis key prefix, so it must be unique in the process.
+
+    The admission path takes no limiter-wide lock: the local backend updates a key in
+    one synchronous step (atomic on the event loop), the shared memory backend locks
+    only the stripe holding the key and Redis runs the update as one script. It also
+    does no I/O.
+
+    Args:
+        requests_limit (int): Requests allowed per `time_window` (also the burst size).
+        time_window (int): Window length in seconds.
+        wait_request_limit (int): Consecutive rejections tolerated before the cooldown.
+        cooldown_minutes (int): Cooldown applied once `wait_request_limit` is reached.
+        backend (optional): Backend instance, defaults to `get_backend(namespace=name)`.
+        name (str, optional): Unique name of the limiter, defaults to
+            'rate_limiter_{requests_limit}_per_{time_window}s'.
+
+    Raises:
+        ValueError: If another limiter of this process already uses `name`.
+    """
+
+    def __init__(
+        self,
+        requests_limit: int = 30,
+        time_window: int = 60,
+        wait_request_limit: int = 10,
+        cooldown_minutes: int = 1,
+        backend=None,
+        name: str = None,
+    ):
+        name = name or f"rate_limiter_{requests_limit}_per_{time_window}s"
+        if name in _limiter_names:
+            raise ValueError(
+                f"rate limiter name {name!r} is already used, pass a unique name"
+            )
+        _limiter_names.add(name)
+        self.name = name
         self.is_development = os.getenv('ENVIRONMENT') == 'DEVELOPMENT'
         self.requests_limit = requests_limit
         self.time_window = time_window
         self.wait_request_limit = wait_request_limit
-        self.request_counters = defaultdict(lambda: defaultdict(int))
-        self.wait_request_counters = defaultdict(lambda: defaultdict(int))
-        self.cooldown_times = defaultdict(lambda: defaultdict(lambda: None))
-        self.lock = Lock()
+        emission_interval = time_window / requests_limit
+        # spacing between two requests at the sustained rate, and how far ahead of it a
+        # burst may go
+        self.policy = RateLimitPolicy(
+            emission_interval=emission_interval,
+            burst_tolerance=time_window - emission_interval,
+            wait_request_limit=wait_request_limit,
+            cooldown_seconds=cooldown_minutes * 60,
+            time_window=time_window,
+        )
+        self.backend = backend or get_backend(namespace=name)
+        metrics.register(name, self.backend.stats)
 
-    async def time_sleep(self, seconds: int):
-        print(f"\nSleeping for {seconds} seconds")
-        await asyncio.sleep(seconds)
+    async def check(self, key: str) -> float:
+        """
+        Admit or reject one request for `key` without waiting.
+
+        Returns:
+            float: 0.0 if the request is admitted, otherwise the seconds until a
+                retry is admitted.
+        """
+        return await self.backend.check(key, self.policy)
 
     async def __call__(self, request: Request):
-        if self.is_development or request.headers.get('user-agent')== 'AI': # add specific term for it
+        headers = request.headers
+        # add specific term for it
+        if self.is_development or headers.get('user-agent') == 'AI':
             # Bypass rate limiter in development mode
-            print("\nRate limiter bypassed in development mode.")
             return
-        
-        user = request.headers.get('x-forwarded-for', request.client.host)
-        endpoint = request.url.path
-
-        async with self.lock:
-            if self.cooldown_times[user][endpoint] and self.cooldown_times[user][endpoint] > current_datetime():
-                print(f"\nCooldown time active for {user} on {endpoint}, raising RequestTimeoutError")
-                raise RequestTimeoutError()
-
-            if self.request_counters[user][endpoint] >= self.requests_limit:
-                print(f"\nRequest limit reached for {user} on {endpoint}")
-
-                if self.wait_request_counters[user][endpoint] >= self.wait_request_limit:
-                    print(f"\nWait request limit reached for {user} on {endpoint}, raising RequestTimeoutError")
-                    asyncio.create_task(self.cooldown(user, endpoint, 1))
-                    raise RequestTimeoutError('TESTTTTTTTTTTTTTTTTTT')
-
-                self.wait_request_counters[user][endpoint] += 1
-                print(f"\nIncremented wait counter for {user} on {endpoint}, wait: {self.wait_request_counters[user][endpoint]}")
-
-                await self.time_sleep(self.time_window)
-
-            else:
-                self.request_counters[user][endpoint] += 1
-                print(f"\nIncremented request counter for {user} on {endpoint}, request: {self.request_counters[user][endpoint]}")
-
-    async def cooldown(self, user, endpoint, minutes: int):
-        self.cooldown_times[user][endpoint] = add_time(minutes=minutes)
-        await self.time_sleep(minutes * 60)
-        self.cooldown_times[user][endpoint] = None
-        self.request_counters[user][endpoint] = 0
-        self.wait_request_counters[user][endpoint] = 0
-        print(f"\nCooldown for {minutes} minutes for {user} on {endpoint}")
-        print(f"\nCooldown over, reset counters for {user} on {endpoint}, request: {self.request_counters[user][endpoint]}, wait: {self.wait_request_counters[user][endpoint]}")
+
+        user = headers.get('x-forwarded-for') or request.client.host
+        # scope path instead of request.url, which would build and parse the full URL
+        with timed('rate_limit'):
+            retry_after = await self.backend.check(
+                f"{user}|{request.scope['path']}", self.policy
+            )
+        if retry_after:
+            raise RequestTimeoutError(retry_after=retry_after)
@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import inspect
+import itertools
+import contextvars
+from functools import wraps
+from typing import Callable, Iterable, Optional, Union
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from loguru import logger
+from utils.ttl_cache import TTLCache
+from utils.logData import current_request_log
+from utils.response_manipulator import etag_matches, set_request_cookie
+from utils import metrics
+
+# in-process cache of rendered GET responses, declared per route with @cached
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 10_000))
+RESPONSE_CACHE_MAX_BODY_BYTES = int(
+    os.getenv('RESPONSE_CACHE_MAX_BODY_BYTES', 1024 * 1024)
+)
+# headers that belong to one response only and are never replayed from the cache
+UNCACHED_HEADERS = (b'set-cookie', b'content-length', b'server-timing')
+# running background refreshes, referenced until done so the event loop cannot collect
+# them
+_refresh_tasks = set()
+
+
+class CachedResponse(object):
+    """A rendered response kept by ResponseCache."""
+
+    __slots__ = ("status_code", "headers", "body", "etag", "fresh_until", "generations")
+
+    def __init__(self, response: Response, fresh_until: float, generations: tuple):
+        self.status_code = response.status_code
+        self.headers = [
+            (name, value)
+            for name, value in response.raw_headers
+            if name not in UNCACHED_HEADERS
+        ]
+        self.body = response.body
+        self.etag = response.headers.get('etag')
+        self.fresh_until = fresh_until
+        self.generations = generations
+
+
+class ResponseCache(object):
+    """
+    Bounded cache of rendered GET responses with per route TTL, stale-while-revalidate
+    and tag invalidation.
+
+    Entries are stored in a TTLCache, so the cache never holds more than `max_entries`
+    responses (least recently used evicted first) and bodies larger than
+    `max_body_bytes` are not cached. A response is fresh for `ttl` seconds, then for
+    `stale_ttl` more seconds it is still served while the handler is re-run in the
+    background to refresh it. Tags are invalidated in O(1): every tag has a generation
+    that changes on invalidation, an entry stored under an older generation of one of
+    its tags is a miss.
+
+    Args:
+        max_entries (int): Maximum number of cached responses.
+        max_body_bytes (int): Larger bodies are never cached.
+
+    Usage:
+        @DEMO_ROUTE.get('/items')
+        @response_cache.cached(ttl=30, stale_ttl=60, tags=['items'])
+        async def items(request: Request):
+            ...
+        response_cache.invalidate('items')  # after a write
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        max_body_bytes: int = RESPONSE_CACHE_MAX_BODY_BYTES,
+    ):
+        self.entries = TTLCache(max_entries=max_entries, purge_interval=60)
+        self.max_body_bytes = max_body_bytes
+        # tag -> generation. A tag evicted from this bounded table must not fall back
+        # to an older generation, so unknown tags read as `_evicted_floor`, raised past
+        # every evicted generation
+        self.generations = TTLCache(max_entries=max_entries)
+        self._generation = itertools.count(1)
+        self._evicted_floor = 0
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def key(self, request: Request, per_user: bool) -> tuple:
+        """
+        Cache key of a request: path, sorted query parameters and, with `per_user`, the
+        user.
+        """
+        user = getattr(request.state, 'user_data', None) if per_user else None
+        return (
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            user,
+        )
+
+    def tag_generations(self, tags: Iterable[str]) -> tuple:
+        return tuple(self.generations.get(tag, self._evicted_floor) for tag in tags)
+
+    def invalidate(self, *tags: str):
+        """Drop every cached response stored under one of `tags`."""
+        for tag in tags:
+            generation = next(self._generation)
+            evictions = self.generations.evictions
+            self.generations.set(tag, generation)
+            if self.generations.evictions != evictions:
+                # the evicted generation is older than this one, entries of any unknown
+                # tag now miss once
+                self._evicted_floor = generation
+        self.invalidations += len(tags)
+
+    def clear(self):
+        self.entries.clear()
+
+    def lookup(self, key: tuple, tags: tuple) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is not None and entry.generations != self.tag_generations(tags):
+            self.entries.pop(key)  # a tag was invalidated since it was stored
+            return None
+        return entry
+
+    def store(
+        self, key: tuple, response, ttl: float, stale_ttl: float, generations: tuple
+    ) -> bool:
+        """
+        Cache `response` if it is a complete 200 response small enough, return True if
+        it was stored.
+        """
+        body = getattr(response, 'body', None)
+        if (
+            not isinstance(response, Response)
+            or response.status_code != 200
+            or body is None
+            or len(body) > self.max_body_bytes
+        ):
+            return False
+        now = time.monotonic()
+        self.entries.set(
+            key,
+            CachedResponse(response, now + ttl, generations),
+            ttl=ttl + stale_ttl,
+            now=now,
+        )
+        return True
+
+    def cached(
+        self,
+        ttl: float,
+        stale_ttl: float = 0,
+        tags: Union[Iterable[str], Callable[[Request], Iterable[str]]] = (),
+        per_user: bool = True,
+    ):
+        """
+        Decorator caching the responses of a GET route handler.
+
+        The handler needs a `request: Request` parameter. Only complete 200 responses
+        (e.g. CustomResponse(...).respond()) are cached; streaming and error responses
+        pass through.
+
+        Args:
+            ttl (float): Seconds a response is served from the cache.
+            stale_ttl (float, optional): Seconds after `ttl` the stale response is still
+                served while it is refreshed in the background.
+            tags (Iterable[str] | callable, optional): Tags to invalidate the responses
+                with, or a function of the request returning them.
+            per_user (bool, optional): Key on `request.state.user_data` too, keep it on
+                for any user specific response.
+        """
+        def decorator(func):
+            request_parameter = next(
+                (
+                    name
+                    for name, parameter in inspect.signature(func).parameters.items()
+                    if parameter.annotation is Request
+                ),
+                None,
+            )
+            if request_parameter is None:
+                raise ValueError(
+                    f"{func.__name__} needs a `request: Request` parameter to be cached"
+                )
+            is_coroutine = asyncio.iscoroutinefunction(func)
+
+            async def call(kwargs):
+                if is_coroutine:
+                    return await func(**kwargs)
+                return await run_in_threadpool(func, **kwargs)
+
+            @wraps(func)
+            async def wrapper(**kwargs):
+                request = kwargs[request_parameter]
+                if request.method != 'GET':
+                    return await call(kwargs)
+                route_tags = tuple(tags(request) if callable(tags) else tags)
+                key = self.key(request, per_user)
+                entry = self.lookup(key, route_tags)
+                if entry is not None:
+                    if entry.fresh_until > time.monotonic():
+                        self.hits += 1
+                        return self.replay(request, entry, "hit")
+                    self.stale_hits += 1
+                    self.refresh(key, call, kwargs, ttl, stale_ttl, route_tags)
+                    return self.replay(request, entry, "stale")
+                self.misses += 1
+                # taken first, so a write during the call is not hidden
+                generations = self.tag_generations(route_tags)
+                response = await call(kwargs)
+                self.store(key, response, ttl, stale_ttl, generations)
+                log = current_request_log()
+                if log is not None:
+                    log.job_dict["@message"]['cache'] = "miss"
+                return response
+
+            return wrapper
+        return decorator
+
+    def refresh(
+        self,
+        key: tuple,
+        call: Callable,
+        kwargs: dict,
+        ttl: float,
+        stale_ttl: float,
+        tags: tuple,
+    ):
+        """
+        Re-run the handler in the background to replace a stale entry, once per key at a
+        time.
+        """
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        self.refreshes += 1
+
+        async def run():
+            try:
+                generations = self.tag_generations(tags)
+                self.store(key, await call(kwargs), ttl, stale_ttl, generations)
+            except Exception:
+                logger.exception("Response cache refresh failed")
+            finally:
+                self._refreshing.discard(key)
+
+        # run in an empty context so the refresh is not timed and logged as part of this
+        # request
+        task = contextvars.Context().run(asyncio.ensure_future, run())
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+
+    def replay(self, request: Request, entry: CachedResponse, status: str) -> Response:
+        """Build the response of a cache hit, a 304 if the client already has it."""
+        request_id = getattr(request.state, 'request_token', 'unknown')
+        if entry.etag is not None and etag_matches(
+            request.headers.get('if-none-match'), entry.etag
+        ):
+            response = Response(status_code=304, headers={'ETag': entry.etag})
+        else:
+            response = Response(entry.body, status_code=entry.status_code)
+            response.raw_headers = [
+                (b'content-length', str(len(entry.body)).encode('latin-1'))
+            ] + entry.headers
+        set_request_cookie(response, request_id)
+        log = current_request_log()
+        if log is not None and log.request_id == request_id and not log.flushed:
+            log.job_dict["@message"]['cache'] = status
+            log.add_response(response)
+        return response
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters and the entry table stats, used by the metrics
+        endpoint.
+        """
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "invalidations": self.invalidations,
+            "entries": self.entries.stats(),
+        }
+
+
+# shared by every router, `cached = response_cache.cached`
+response_cache = ResponseCache()
+cached = response_cache.cached
+metrics.register('response_cache', response_cache.stats)
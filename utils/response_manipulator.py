@@ -1,11 +1,134 @@
-import json
-from fastapi.responses import JSONResponse
-from utils.logData import LogDataClass
-from typing import Union
+import os
+import re
+import hashlib
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from utils.logData import LogDataClass, current_request_log
+from utils.timing import timed
+from utils.json_encoder import dumps
+from typing import AsyncIterable, Iterable, Optional, Union
 from pydantic import validate_arguments
 from enum import Enum
 
-#https://restfulapi.net/http-status-codes/ for error codes reference
+try:
+    import xxhash
+except ImportError:  # optional, ETags fall back to blake2b
+    xxhash = None
+
+# https://restfulapi.net/http-status-codes/ for error codes reference
+
+# pydantic validation of CustomResponse arguments, on by default in development only
+RESPONSE_VALIDATION = (
+    os.getenv(
+        'RESPONSE_VALIDATION', '1' if os.getenv('ENVIRONMENT') == 'DEVELOPMENT' else '0'
+    )
+    == '1'
+)
+COOKIE_SAFE_VALUE = re.compile(r'[A-Za-z0-9._-]+')
+AI_ERROR_CODES = ('AI_ERROR', 'AI_502_BAD_GATEWAY', 'AI_503_CUDA_SERVICE_UNAVAILABLE')
+# strong ETags on 200 responses to GET/HEAD requests, answered with 304 when
+# If-None-Match matches
+RESPONSE_ETAGS = os.getenv('RESPONSE_ETAGS', '1') == '1'
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+def body_etag(body: bytes) -> str:
+    """
+    Strong ETag of an encoded body, a fast non-cryptographic 128 bit hash (xxh3 when
+    installed).
+
+    Example output:
+    '"9c1b3f0a4d5e6f708192a3b4c5d6e7f8"'
+    """
+    digest = (
+        xxhash.xxh3_128_hexdigest(body)
+        if xxhash is not None
+        else hashlib.blake2b(body, digest_size=16).hexdigest()
+    )
+    return f'"{digest}"'
+
+
+def version_etag(resp_code: str, version: str) -> str:
+    """
+    ETag of a handler supplied version tag (e.g. a document's updated_at), never looks
+    at the body.
+
+    Example output:
+    '"v-3f9a0c7e1b2d4a6c8e0f1a2b3c4d5e6f"'
+    """
+    return '"v-' + body_etag(f"{resp_code}|{version}".encode('utf-8'))[1:]
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header value with `etag`, as required for GET
+    and HEAD.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+
+def set_request_cookie(response: Response, request_id: str):
+    """Set the request_id cookie on `response`."""
+    if COOKIE_SAFE_VALUE.fullmatch(request_id):
+        # same header as set_cookie(key='request_id', value=...) without going through
+        # http.cookies
+        response.raw_headers.append(
+            (
+                b'set-cookie',
+                f'request_id={request_id}; Path=/; SameSite=lax'.encode('latin-1'),
+            )
+        )
+    else:
+        response.set_cookie(key='request_id', value=request_id)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded with orjson (datetime, ObjectId, Decimal...); bytes are sent as
+    already encoded JSON.
+    """
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def compile_envelopes(codes: dict) -> dict:
+    """
+    Pre-encode the parts of the response envelope that only depend on the response code.
+
+    Returns:
+        dict: code -> (head, tail, static body), where a body is
+              `head + data + tail + details + b'}'` and the static body is the whole
+              response with empty data and details.
+
+    Example output:
+    {'HTTP_200_SUCCESS': (b'{"code":"HTTP_200_SUCCESS","message":"Success","data":',
+                          b',"error":false,"details":', b'{...}')}
+    """
+    envelopes = {}
+    for code, entry in codes.items():
+        head = (
+            b'{"code":'
+            + dumps(code)
+            + b',"message":'
+            + dumps(entry["message"])
+            + b',"data":'
+        )
+        tail = b',"error":' + dumps(entry["status"] >= 400) + b',"details":'
+        envelopes[code] = (head, tail, head + b'{}' + tail + b'{}}')
+    return envelopes
+
 
 class CustomResponse:
     """
@@ -124,9 +247,17 @@ class CustomResponse:
     }
 
     resp_codes = Enum('resp_codes', {field: field for field in LEGAL_RESPONSE_CODES.keys()}, type=str)
+    ENVELOPES = compile_envelopes(LEGAL_RESPONSE_CODES)
 
-    @validate_arguments
-    def __init__(self, request, resp_code: str = 'HTTP_403_FORBIDDEN', data: Union[str, dict, list] = {}, details: Union[str, dict, list] = {}, message: str = ''):
+    def __init__(
+        self,
+        request,
+        resp_code: str = 'HTTP_403_FORBIDDEN',
+        data: Union[str, dict, list] = {},
+        details: Union[str, dict, list] = {},
+        message: str = '',
+        version: Optional[str] = None,
+    ):
         """
         Initialize the CustomResponse object with the specified parameters.
 
@@ -136,23 +267,32 @@ class CustomResponse:
             data (Union[str, dict, list], optional): The response data. Defaults to {}.
             details (Union[str, dict, list], optional): Additional details. Defaults to {}.
             message (str, optional): Custom message for the response. Defaults to ''.
+            version (str, optional): Cheap version tag of `data` (e.g. its updated_at)
+                used as ETag instead of hashing the body, so a 304 skips rendering.
+                Defaults to None.
 
         Attributes:
             request_id (str): The request ID extracted from the request object.
             status (int): The HTTP status code.
             request_url (str): The request URL.
             responseData (dict): The constructed response data dictionary.
+
+        Arguments are only validated by pydantic when RESPONSE_VALIDATION is on.
         """
-        
+
         resp_status = CustomResponse.LEGAL_RESPONSE_CODES[resp_code]['status']
         resp_message = message if message else CustomResponse.LEGAL_RESPONSE_CODES[resp_code]['message']
         error = bool(resp_status >= 400)
 
         self.request_id = getattr(request.state, 'request_token', 'unknown')
-        self.start_time = getattr(request.state, 'start_time', 'unknown')
+        self.timer = getattr(request.state, 'timer', None)
         self.status = resp_status
         self.request_url = request.url.path
         self.location = request.url.path or None # write proper logic to get the location
+        self.custom_message = bool(message)
+        self.method = request.method
+        self.if_none_match = request.headers.get('if-none-match')
+        self.version = version
         self.responseData = {
             "code": resp_code,
             "message": resp_message,
@@ -160,10 +300,95 @@ class CustomResponse:
             "error": error,
             "details": details
         }
-    
+
+    if RESPONSE_VALIDATION:
+        __init__ = validate_arguments(__init__)
+
+    @staticmethod
+    def not_modified(
+        request, version: str, resp_code: str = 'HTTP_200_SUCCESS'
+    ) -> Optional[Response]:
+        """
+        Return a 304 response if the client already has `version`, before any data is
+        loaded.
+
+        Usage:
+            version = str(document['updated_at'])
+            response = CustomResponse.not_modified(request, version=version)
+            if response is not None:
+                return response
+            return CustomResponse(
+                request=request, resp_code='HTTP_200_SUCCESS', data=load(document),
+                version=version,
+            ).respond()
+        """
+        conditional = CustomResponse(
+            request=request, resp_code=resp_code, version=version
+        )
+        etag = conditional.etag()
+        if not conditional.conditional(etag):
+            return None
+        return conditional.not_modified_response(etag)
+
+    def conditional(self, etag: Optional[str]) -> bool:
+        """
+        Return True if the request is a conditional GET/HEAD whose If-None-Match matches
+        `etag`.
+        """
+        return (
+            etag is not None
+            and self.method in CONDITIONAL_METHODS
+            and etag_matches(self.if_none_match, etag)
+        )
+
+    def not_modified_response(self, etag: str) -> Response:
+        """Build, cookie and log the bodiless 304 answering a matching If-None-Match."""
+        response = Response(
+            status_code=CustomResponse.LEGAL_RESPONSE_CODES['HTTP_304_NOT_MODIFIED'][
+                'status'
+            ],
+            headers={'ETag': etag},
+        )
+        self.set_request_cookie(response)
+        self.log_response(response)
+        return response
+
+    def etag(self, body: Optional[bytes] = None) -> Optional[str]:
+        """
+        ETag of a successful GET/HEAD response: the version tag when given, else the
+        hash of `body`.
+        """
+        if (
+            not RESPONSE_ETAGS
+            or self.status != 200
+            or self.method not in CONDITIONAL_METHODS
+        ):
+            return None
+        if self.version is not None:
+            return version_etag(self.responseData["code"], self.version)
+        return None if body is None else body_etag(body)
+
+    def render(self) -> bytes:
+        """
+        Encode the response envelope, reusing the pre-encoded parts of its response
+        code.
+
+        Responses without data, details or custom message (e.g. 401, 429, 500) are
+        cached bytes.
+        """
+        data = self.responseData["data"]
+        details = self.responseData["details"]
+        head, tail, static = CustomResponse.ENVELOPES[self.responseData["code"]]
+        if self.custom_message:
+            return dumps(self.responseData)
+        if type(data) is dict and not data and type(details) is dict and not details:
+            return static
+        return b"".join((head, dumps(data), tail, dumps(details), b"}"))
+
     def respond(self, response: JSONResponse = None):
         """
-        Create and return a JSONResponse with the stored status code and response data.
+        Create and return a JSONResponse (FastJSONResponse) with the stored status code
+        and response data.
 
         Args:
             response (JSONResponse, optional): An optional existing JSONResponse to modify. Defaults to None.
@@ -171,25 +396,311 @@ class CustomResponse:
         Returns:
             JSONResponse: The created or modified JSONResponse object.
         """
-        
-        if response is None:
-            response = JSONResponse(status_code=self.status, content=self.responseData)
-        else:
-            response.status_code = self.status
-            response.content = self.responseData
-            response.body = json.dumps(self.responseData).encode('utf-8')
+
+        etag = self.etag()
+        if self.conditional(etag):
+            # version tag matched, nothing is rendered
+            return self.not_modified_response(etag)
+
+        with timed('serialization'):
+            body = self.render()
+            if etag is None:
+                etag = self.etag(body)
+            if self.conditional(etag):
+                return self.not_modified_response(etag)
+            if response is None:
+                response = FastJSONResponse(status_code=self.status, content=body)
+            else:
+                response.status_code = self.status
+                response.body = body
+                response.headers['content-length'] = str(len(body))
 
         if 300 <= self.status < 400 and self.location:
             response.headers['Location'] = self.location
+        if etag is not None:
+            response.headers['ETag'] = etag
 
-        response.set_cookie(key='request_id', value=self.request_id) # for team to track the request to backend
-        
-        if self.status >= 400:
-            if self.status >=500 and self.responseData["code"] in ['AI_ERROR', 'AI_502_BAD_GATEWAY', 'AI_503_CUDA_SERVICE_UNAVAILABLE']:
+        self.set_request_cookie(response)
+        self.log_response(response)
+        return response
+
+    def set_request_cookie(self, response):
+        """Set the request_id cookie, for team to track the request to backend."""
+        set_request_cookie(response, self.request_id)
+
+    def log_response(self, response):
+        """
+        Add the response to the access log record of the request, or log it on its own
+        outside of RequestContextMiddleware.
+        """
+        log = current_request_log()
+        if log is not None and log.request_id == self.request_id and not log.flushed:
+            # part of the access log record RequestContextMiddleware writes for the
+            # request
+            ai_error = (
+                self.status >= 500 and self.responseData["code"] in AI_ERROR_CODES
+            )
+            log.add_response(response, level="AI Log" if ai_error else None)
+        elif self.status >= 400:
+            if self.status >= 500 and self.responseData["code"] in AI_ERROR_CODES:
                 LogDataClass(request_id=self.request_id).general_log(self.responseData, log_type="AI", error=True)
                 # todo, notification for staging and specific to prod cases, slack notfications
             else:
                 LogDataClass(request_id=self.request_id).warn_log(response)
         else:
-            LogDataClass(request_id=self.request_id).response_log(self.start_time, response)
-        return response
\ No newline at end of file
+            LogDataClass(request_id=self.request_id).response_log(self.timer, response)
+
+
+def pull_items(iterator, count: int) -> tuple:
+    """
+    Take up to `count` items from a sync iterator, one next() at a time, in a threadpool
+    worker.
+
+    Returns:
+        tuple: (items, exhausted, error), `items` holds everything taken before
+            the iterator ended or raised `error`.
+    """
+    items = []
+    try:
+        for _ in range(count):
+            items.append(next(iterator))
+    except StopIteration:
+        return items, True, None
+    except Exception as e:
+        return items, False, e
+    return items, False, None
+
+
+class PrefetchingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse producing its first chunk before the status line is sent.
+
+    Until then the status can still change: when the body iterator fails on its first
+    chunk, the response returned by `on_error(exception)` is sent instead.
+    """
+
+    def __init__(self, content, on_error, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_error = on_error
+
+    async def __call__(self, scope, receive, send):
+        iterator = self.body_iterator
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except Exception as e:
+            await self.on_error(e)(scope, receive, send)
+            return
+        self.body_iterator = self.resume(first, iterator)
+        await super().__call__(scope, receive, send)
+
+    @staticmethod
+    async def resume(first, iterator):
+        if first is None:
+            return
+        yield first
+        async for chunk in iterator:
+            yield chunk
+
+
+class StreamingCustomResponse(CustomResponse):
+    """
+    CustomResponse for large lists, streamed item by item instead of encoded into one
+    body.
+
+    Items come from a sync or async iterator (DB rows, S3 listings...) and are sent as
+    NDJSON (one JSON document per line) or as the usual envelope with `data` as a JSON
+    array written incrementally: `{"code":...,"message":...,"data":[` item, item...
+    `],"error":false,"details":{}}`. Encoded items are buffered up to `chunk_size` bytes
+    per chunk, so time to first byte and memory stay constant whatever the number of
+    items. Sync iterators are drained in the threadpool up to `batch_size` items per
+    call so blocking cursors never stall the event loop. The request_id cookie and
+    logging work as for CustomResponse, the access log record gets the number of bytes
+    sent once the stream is finished.
+
+    The status is only sent with the first chunk. If the iterator fails before it, the
+    client gets a regular HTTP_500_SERVER_ERROR response. Once streaming started the
+    status can no longer change: the items read before the failure are sent, then the
+    error is logged and reported in the last line (NDJSON) or in `error`/`details` of
+    the envelope.
+
+    Args:
+        request (Request): The FastAPI request object.
+        items (Iterable | AsyncIterable): The items of `data`.
+        resp_code (str, optional): The response code. Defaults to 'HTTP_200_SUCCESS'.
+        details (Union[str, dict, list], optional): Additional details. Defaults to {}.
+        message (str, optional): Custom message for the response. Defaults to ''.
+        media (str, optional): 'json' or 'ndjson', None picks 'ndjson' when the Accept
+            header asks for it.
+        chunk_size (int, optional): Bytes buffered before a chunk is sent.
+        batch_size (int, optional): Items pulled per threadpool call from a sync
+            iterator.
+
+    Usage:
+        items = DbExecute().iter_rows(query, values)
+        return StreamingCustomResponse(request=request, items=items).respond()
+    """
+
+    MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+    def __init__(
+        self,
+        request,
+        items: Union[Iterable, AsyncIterable],
+        resp_code: str = 'HTTP_200_SUCCESS',
+        details: Union[str, dict, list] = {},
+        message: str = '',
+        media: str = None,
+        chunk_size: int = 64 * 1024,
+        batch_size: int = 500,
+    ):
+        entry = CustomResponse.LEGAL_RESPONSE_CODES[resp_code]
+        if media is None:
+            media = (
+                "ndjson"
+                if "application/x-ndjson" in request.headers.get("accept", "")
+                else "json"
+            )
+        if media not in self.MEDIA_TYPES:
+            raise ValueError(f"Unknown media {media}")
+        self.request = request
+        self.request_id = getattr(request.state, 'request_token', 'unknown')
+        self.timer = getattr(request.state, 'timer', None)
+        self.status = entry['status']
+        self.request_url = request.url.path
+        self.location = None
+        self.custom_message = bool(message)
+        self.responseData = {
+            "code": resp_code,
+            "message": message or entry['message'],
+            "data": None,
+            "error": self.status >= 400,
+            "details": details
+        }
+        self.items = items
+        self.media = media
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+
+    async def iterate(self):
+        """Yield the items from the sync or async iterator."""
+        if hasattr(self.items, "__aiter__"):
+            async for item in self.items:
+                yield item
+            return
+        iterator = iter(self.items)
+        while True:
+            batch, exhausted, error = await run_in_threadpool(
+                pull_items, iterator, self.batch_size
+            )
+            for item in batch:
+                yield item
+            if error is not None:
+                raise error
+            if exhausted:
+                return
+
+    async def chunks(self):
+        """Encode the items into chunks of about `chunk_size` bytes."""
+        ndjson = self.media == "ndjson"
+        if ndjson:
+            head, separator = b"", b"\n"
+        elif self.custom_message:
+            head, separator = (
+                b'{"code":'
+                + dumps(self.responseData["code"])
+                + b',"message":'
+                + dumps(self.responseData["message"])
+                + b',"data":[',
+                b",",
+            )
+        else:
+            head, separator = (
+                CustomResponse.ENVELOPES[self.responseData["code"]][0] + b"[",
+                b",",
+            )
+        buffer = bytearray(head)
+        first = True
+        sent = False
+        try:
+            async for item in self.iterate():
+                if not first and not ndjson:
+                    buffer += separator
+                buffer += dumps(item)
+                if ndjson:
+                    buffer += separator
+                first = False
+                if len(buffer) >= self.chunk_size:
+                    yield bytes(buffer)
+                    sent = True
+                    buffer.clear()
+        except Exception as e:
+            if not sent:
+                # the status is not sent yet, respond() answers with an error response
+                raise
+            self.log_stream_error(self.exception_details(e))
+            if ndjson:
+                buffer += (
+                    dumps(
+                        {
+                            "code": "HTTP_500_SERVER_ERROR",
+                            "error": True,
+                            "details": "stream interrupted",
+                        }
+                    )
+                    + b"\n"
+                )
+            else:
+                buffer += b'],"error":true,"details":"stream interrupted"}'
+            yield bytes(buffer)
+            return
+        if not ndjson:
+            buffer += (
+                b"]"
+                + CustomResponse.ENVELOPES[self.responseData["code"]][1]
+                + dumps(self.responseData["details"])
+                + b"}"
+            )
+        if buffer:
+            yield bytes(buffer)
+
+    @staticmethod
+    def exception_details(e: Exception) -> dict:
+        return {"exception_type": type(e).__name__, "exception_object": str(e)}
+
+    def error_response(self, e: Exception):
+        """
+        The regular error response sent when the iterator failed before anything was
+        sent.
+        """
+        self.log_stream_error(self.exception_details(e))
+        return CustomResponse(
+            request=self.request, resp_code='HTTP_500_SERVER_ERROR'
+        ).respond()
+
+    def log_stream_error(self, error: dict):
+        """Record an iterator failure in the access log record, or log it on its own."""
+        log = current_request_log()
+        if log is not None and log.request_id == self.request_id and not log.flushed:
+            log.add_error(error)
+        else:
+            LogDataClass(request_id=self.request_id).exception_log(error)
+
+    def respond(self, response: StreamingResponse = None):
+        """
+        Create and return the StreamingResponse sending the items.
+
+        Returns:
+            StreamingResponse: The response, consumed by the server after the
+                handler returned.
+        """
+        response = PrefetchingStreamingResponse(
+            self.chunks(),
+            self.error_response,
+            status_code=self.status,
+            media_type=self.MEDIA_TYPES[self.media],
+        )
+        self.set_request_cookie(response)
+        self.log_response(response)
+        return response
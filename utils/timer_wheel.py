@@ -0,0 +1,203 @@
+import math
+import time
+import asyncio
+import threading
+from typing import Callable, Tuple
+from loguru import logger
+
+
+class TimerHandle(object):
+    """A scheduled callback, returned by `TimerWheel.schedule` and used to cancel it."""
+
+    __slots__ = ("expires", "callback", "args", "cancelled")
+
+    def __init__(self, expires: int, callback: Callable, args: tuple):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel running every deadline of the process from one ticker
+    task.
+
+    Level 0 has `slots[0]` buckets of one `tick` each, every next level has buckets as
+    wide as the whole level below it. A deadline is stored in the lowest level that can
+    hold it and cascades down as the wheel turns, so scheduling and cancelling are O(1)
+    and a tick only touches the bucket that is due. Deadlines beyond the top level are
+    parked in its furthest bucket and re-inserted when it comes around.
+
+    Args:
+        tick (float): Resolution in seconds.
+        slots (tuple): Buckets per level, the default covers one day at one second
+            resolution.
+
+    Usage:
+        handle = timer_wheel.schedule(60, cache.purge_expired)
+        handle.cancel()
+    """
+
+    def __init__(self, tick: float = 1.0, slots: Tuple[int, ...] = (60, 60, 24)):
+        self.tick = tick
+        self.slots = slots
+        self.spans = [math.prod(slots[:level]) for level in range(len(slots))]
+        self.levels = [[[] for _ in range(size)] for size in slots]
+        self.origin = time.monotonic()
+        self.current = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._task = None
+        # tasks of coroutine callbacks, referenced until done so the event loop cannot
+        # collect them
+        self._callback_tasks = set()
+
+    def _insert(self, handle: TimerHandle):
+        expires = handle.expires
+        delta = expires - self.current
+        for level, size in enumerate(self.slots):
+            span = self.spans[level]
+            if delta < span * size:
+                self.levels[level][(expires // span) % size].append(handle)
+                return
+        # beyond the wheel range, park it in the furthest bucket of the top level
+        level = len(self.slots) - 1
+        span = self.spans[level]
+        parked = self.current + span * (self.slots[level] - 1)
+        self.levels[level][(parked // span) % self.slots[level]].append(handle)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """
+        Run `callback(*args)` once `delay` seconds have passed (rounded up to the next
+        tick).
+
+        Callbacks run on the event loop; a coroutine returned by the callback is
+        scheduled as a task.
+        """
+        return self._schedule_at(
+            math.ceil((time.monotonic() - self.origin + delay) / self.tick),
+            callback,
+            args,
+        )
+
+    def _schedule_at(
+        self, expires: int, callback: Callable, args: tuple
+    ) -> TimerHandle:
+        with self._lock:
+            handle = TimerHandle(max(self.current + 1, expires), callback, args)
+            self._insert(handle)
+            self.pending += 1
+        self.start()
+        return handle
+
+    def every(self, interval: float, callback: Callable, *args) -> TimerHandle:
+        """
+        Run `callback(*args)` every `interval` seconds until the returned handle is
+        cancelled.
+        """
+        handle = TimerHandle(0, callback, args)
+        step = max(1, round(interval / self.tick))
+
+        def run():
+            if handle.cancelled:
+                return
+            # count from the tick that was due, not from now, so the period does not
+            # drift
+            handle.expires = self._schedule_at(handle.expires + step, run, ()).expires
+            callback(*args)
+
+        handle.expires = self.schedule(interval, run).expires
+        return handle
+
+    def advance(self, now: float = None) -> int:
+        """
+        Turn the wheel up to `now` and run every callback that became due.
+
+        Returns:
+            int: The number of callbacks run.
+        """
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.origin) / self.tick)
+        due = []
+        with self._lock:
+            while self.current < target:
+                self.current += 1
+                for level in range(len(self.slots) - 1, 0, -1):
+                    span = self.spans[level]
+                    if self.current % span == 0:
+                        bucket_index = (self.current // span) % self.slots[level]
+                        bucket = self.levels[level][bucket_index]
+                        self.levels[level][bucket_index] = []
+                        for handle in bucket:
+                            if not handle.cancelled:
+                                self._insert(handle)
+                            else:
+                                self.pending -= 1
+                bucket_index = self.current % self.slots[0]
+                bucket = self.levels[0][bucket_index]
+                self.levels[0][bucket_index] = []
+                for handle in bucket:
+                    self.pending -= 1
+                    if not handle.cancelled:
+                        due.append(handle)
+        for handle in due:
+            try:
+                result = handle.callback(*handle.args)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.ensure_future(result)
+                    self._callback_tasks.add(task)
+                    task.add_done_callback(self._callback_done)
+            except Exception:
+                logger.exception("Timer wheel callback failed")
+        return len(due)
+
+    def _callback_done(self, task: asyncio.Task):
+        self._callback_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).error("Timer wheel callback failed")
+
+    def start(self):
+        """
+        Start the ticker task if an event loop is running and it is not started yet.
+        """
+        if (
+            self._task is not None
+            and not self._task.done()
+            and not self._task.get_loop().is_closed()
+        ):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # started by the next schedule() made from the loop, or on app startup
+            return
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        """Stop the ticker task; pending timers stay scheduled."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            next_tick = self.origin + (self.current + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self.advance()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "tick": self.tick,
+            "running": self._task is not None and not self._task.done(),
+            "callback_tasks": len(self._callback_tasks),
+        }
+
+
+# shared by the whole process: limiter/cache sweeps, SSE event expiry...
+timer_wheel = TimerWheel()
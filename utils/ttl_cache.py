@@ -0,0 +1,176 @@
+import time
+import threading
+from collections import OrderedDict
+from itertools import islice
+from utils.timer_wheel import timer_wheel
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    Bounded in-memory mapping with per-entry expiry and LRU eviction.
+
+    Entries expire lazily: an expired entry is dropped when it is read or when it
+    reaches the least recently used end of the table while room is needed for a new key.
+    The table never holds more than `max_entries` keys, the least recently used one is
+    evicted first. Every operation is O(1) and guarded by a lock so the cache can be
+    shared between the event loop and threadpool workers. With `purge_interval`, a sweep
+    registered on the shared timer wheel also drops expired entries of idle keys in the
+    background.
+
+    Args:
+        max_entries (int): Hard cap on the number of live keys.
+        ttl (float, optional): Default time to live in seconds, None keeps entries until
+            evicted.
+        purge_interval (float, optional): Seconds between background sweeps, None
+            disables them.
+
+    Usage:
+        cache = TTLCache(max_entries=1000, ttl=30)
+        cache.set('key', 'value')
+        cache.get('key')
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        ttl: float = None,
+        purge_interval: float = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> [expires_at, value]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.purge_timer = (
+            timer_wheel.every(purge_interval, self.purge_expired)
+            if purge_interval
+            else None
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None, now: float = None):
+        """
+        Return the live value for `key` and mark it as recently used.
+
+        Args:
+            key: The cache key.
+            default: Returned when the key is missing or expired.
+            now (float, optional): Monotonic timestamp, defaults to `time.monotonic()`.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            if item[0] is not None and item[0] <= (
+                time.monotonic() if now is None else now
+            ):
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(
+        self,
+        key,
+        value,
+        ttl: float = _MISSING,
+        expires_at: float = None,
+        now: float = None,
+    ):
+        """
+        Store `value` under `key`, evicting the least recently used entry if the table
+        is full.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl (float, optional): Seconds to live, defaults to the cache ttl. None
+                never expires.
+            expires_at (float, optional): Absolute monotonic deadline, takes precedence
+                over `ttl`.
+            now (float, optional): Monotonic timestamp, defaults to `time.monotonic()`.
+        """
+        if now is None:
+            now = time.monotonic()
+        if expires_at is None:
+            if ttl is _MISSING:
+                ttl = self.ttl
+            expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                item[0] = expires_at
+                item[1] = value
+                self._data.move_to_end(key)
+                return
+            while len(self._data) >= self.max_entries:
+                _, oldest = self._data.popitem(last=False)
+                if oldest[0] is not None and oldest[0] <= now:
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+            self._data[key] = [expires_at, value]
+
+    def pop(self, key, default=None):
+        """Remove `key` and return its value, or `default` if it is not present."""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def purge_expired(self, now: float = None, max_scan: int = 10_000) -> int:
+        """
+        Drop expired entries, starting from the least recently used end, and return how
+        many were removed.
+
+        Args:
+            now (float, optional): Monotonic timestamp, defaults to `time.monotonic()`.
+            max_scan (int, optional): Entries inspected per call so a sweep never stalls
+                the loop, None scans all.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            items = (
+                self._data.items()
+                if max_scan is None
+                else islice(self._data.items(), max_scan)
+            )
+            expired = [
+                key for key, item in items if item[0] is not None and item[0] <= now
+            ]
+            for key in expired:
+                del self._data[key]
+            self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        """Return size and hit/miss/eviction counters, used by the metrics endpoint."""
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
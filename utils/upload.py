@@ -3,6 +3,7 @@ import os , mimetypes, json
 import boto3
 from requests.utils import quote
 from utils.exception import CustomException
+from utils.timing import timed
 
 class S3_SERVICE(object):
     """ 
@@ -20,8 +21,8 @@ class S3_SERVICE(object):
         self.region = os.getenv('AMAZON_REGION')
         self.generate_project_sqs=os.getenv('GENERATE_PROJECT_SQS')
         self.generate_project_sqs_production=os.getenv('GENERATE_PROJECT_SQS_PRODUCTION')
-        
-   
+
+
 
     async def upload_fileobj(self, fileobject, key,bucket=None):
         """
@@ -42,11 +43,14 @@ class S3_SERVICE(object):
 
         session = get_session()
         content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
-         
+
         async with session.create_client('s3', region_name=self.region,
                                          aws_secret_access_key=self.aws_secret_access_key,
                                          aws_access_key_id=self.AMAZON_ACCESS_KEY_id) as client:
-            file_upload_response = await client.put_object( Bucket=bucket, Key=key, Body=fileobject, ContentType=content_type)
+            with timed('s3'):
+                file_upload_response = await client.put_object(
+                    Bucket=bucket, Key=key, Body=fileobject, ContentType=content_type
+                )
 
             if file_upload_response["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 key = quote(key) # convert # to %23
@@ -69,13 +73,16 @@ class S3_SERVICE(object):
             bucket = self.default_aws_bucket
         if not None and (bucket in self.AWS_BUCKETS):
             return "invalid_bucket" # create exception
-        
+
         session = get_session()
         content_type = mimetypes.guess_type(key)[0]
         async with session.create_client('s3', region_name=self.region,
                                          aws_secret_access_key=self.aws_secret_access_key,
                                          aws_access_key_id=self.AMAZON_ACCESS_KEY_id) as client:
-            file_upload_response = await client.put_object(Bucket=bucket, Key=key, Body=file_content, ContentType=content_type)
+            with timed('s3'):
+                file_upload_response = await client.put_object(
+                    Bucket=bucket, Key=key, Body=file_content, ContentType=content_type
+                )
 
             if file_upload_response["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 key = quote(key)  # convert # to %23
@@ -96,20 +103,21 @@ class S3_SERVICE(object):
             dict: A dictionary containing the status and the SQS response.
         """
         sqs_url = self.__dict__.get(sqs_url_key)
-        
+
         if not sqs_url:
             return {"status": 400, "sqs_message": {}, "error_message": "wrong sqs_key!"}  # TODO need to handle this return case to raise exception rather than returning the object.
         sqs_client = self.session.client('sqs')
-        sqs_response = sqs_client.send_message(
-            QueueUrl=sqs_url,
-            MessageBody=json.dumps(message, default=str),
-            MessageAttributes={},
-            MessageGroupId=group_id,
-            MessageDeduplicationId=dedup_id,
-        )
-        
+        with timed('sqs'):
+            sqs_response = sqs_client.send_message(
+                QueueUrl=sqs_url,
+                MessageBody=json.dumps(message, default=str),
+                MessageAttributes={},
+                MessageGroupId=group_id,
+                MessageDeduplicationId=dedup_id,
+            )
+
         return {"status": 200, "sqs_response": sqs_response}
-    
+
     async def get_attributes_sqs(self, sqs_url_key):
         """
         Retrieve the attributes of the specified SQS queue.
@@ -121,17 +129,18 @@ class S3_SERVICE(object):
             dict: A dictionary containing the status and the SQS attributes.
         """
         sqs_url = self.__dict__.get(sqs_url_key)
-        
+
         if not sqs_url:
             return {"status": 400, "sqs_message": {}, "error_message": "wrong sqs_key!"}  # TODO need to handle this return case to raise exception rather than returning the object.
         sqs_client = self.session.client('sqs')
-        sqs_response = sqs_client.get_queue_attributes(
-            QueueUrl=sqs_url,
-            AttributeNames=['All']
-        )
-        
+        with timed('sqs'):
+            sqs_response = sqs_client.get_queue_attributes(
+                QueueUrl=sqs_url,
+                AttributeNames=['All']
+            )
+
         return {"status": 200, "sqs_response": sqs_response}
-    
+
     async def fetch_files_(self, folderId, bucket):
         """
         Fetch files from the specified folder in the S3 bucket.
@@ -155,16 +164,59 @@ class S3_SERVICE(object):
             paginator = client.get_paginator('list_objects_v2')
             operation_parameters = {'Bucket': bucket, 'Prefix': folderId}
             page_iterator = paginator.paginate(**operation_parameters)
-            
+
             files = []
-            async for page in page_iterator:
-                if "Contents" in page:
-                    for obj in page["Contents"]:
-                        key = obj["Key"]
-                        if key != folderId:  # Skip the folderId itself
-                            key = quote(key)
-                            url = f"https://{bucket}.s3.amazonaws.com/{key}"
-                            image_name = os.path.basename(key)
-                            files.append({"imageName": image_name, "url": url})
-            
+            with timed('s3'):
+                async for page in page_iterator:
+                    if "Contents" in page:
+                        for obj in page["Contents"]:
+                            key = obj["Key"]
+                            if key != folderId:  # Skip the folderId itself
+                                key = quote(key)
+                                url = f"https://{bucket}.s3.amazonaws.com/{key}"
+                                image_name = os.path.basename(key)
+                                files.append({"imageName": image_name, "url": url})
+
             return files
+
+    async def iter_files_(self, folderId, bucket):
+        """
+        Yield the files of the specified folder in the S3 bucket page by page, without
+        building the whole list.
+
+        Args:
+            folderId: The folder ID (prefix) in the S3 bucket.
+            bucket: The S3 bucket name.
+
+        Yields:
+            dict: The image name and URL of one file, as in `fetch_files_`.
+
+        Raises:
+            ValueError: If the bucket is not configured.
+
+        Usage:
+            items = S3_SERVICE().iter_files_(folderId, bucket)
+            return StreamingCustomResponse(request=request, items=items).respond()
+        """
+        if not bucket:
+            bucket = self.default_aws_bucket
+        if not (bucket in self.AWS_BUCKETS):
+            raise ValueError("invalid_bucket")
+
+        session = get_session()
+        async with session.create_client(
+            's3',
+            region_name=self.region,
+            aws_secret_access_key=self.aws_secret_access_key,
+            aws_access_key_id=self.AMAZON_ACCESS_KEY_id,
+        ) as client:
+            paginator = client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=bucket, Prefix=folderId):
+                for obj in page.get("Contents", ()):
+                    key = obj["Key"]
+                    if key != folderId:  # Skip the folderId itself
+                        key = quote(key)
+                        yield {
+                            "imageName": os.path.basename(key),
+                            "url": f"https://{bucket}.s3.amazonaws.com/{key}",
+                        }